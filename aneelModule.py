@@ -0,0 +1,186 @@
+'''
+Importer of the ANEEL dataset of tariffs of the distribution utilities (tarifas homologadas das distribuidoras).
+The file has one row per tariff, separated by ';', with the columns used here:
+    SigAgente, DatInicioVigencia, DatFimVigencia, DscBaseTarifaria, DscSubGrupo, DscModalidadeTarifaria, DscClasse,
+    DscSubClasse, DscDetalhe, NomPostoTarifario, DscUnidadeTerciaria, SigAgenteAcessante, VlrTUSD, VlrTE
+'''
+import sys
+import csv
+import unicodedata
+import datetime as dt
+
+import recalcModule
+import connectionModule
+import tariffModule
+from clientsModule import dbName, hourDict, modalityList
+
+# unidades aceitas e o fator que as leva para as unidades usadas em tarifas
+unitDict = {
+            'r$/mwh':('R$/MWh', 1),
+            'r$/kwh':('R$/MWh', 1000),
+            'r$/kw':('R$/kW', 1)
+        }
+
+
+def _plain(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+
+    return ' '.join(text.lower().split())
+
+
+postoNames = {_plain(posto): posto for posto in set(hourDict.values())}
+modalityNames = {_plain(modality): modality for modality in modalityList}
+
+
+def _number(text: str) -> float:
+    text = (text or '').strip()
+    if not text:
+        return 0
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+
+    return float(text)
+
+
+def _isoDate(text: str) -> str:
+    text = (text or '').strip()
+    if not text:
+        return None
+    if '/' in text:
+        return dt.datetime.strptime(text[:10], '%d/%m/%Y').date().isoformat()
+
+    return dt.date.fromisoformat(text[:10]).isoformat()
+
+
+def normalize(line: dict, utilityMap: dict = None):
+    '''
+    This function turns a row of the ANEEL file into a row of the tarifas table. Rows that don't apply to clientsModule return None:
+    base tariffs other than 'Tarifa de Aplicação', details and accessing agents other than 'Não se aplica', subclasses other
+    than the class itself, and postos, modalities or units not known by hourDict, modalityList and unitDict
+
+    :param line: A row of the file, as read by csv.DictReader
+    :param utilityMap: dict {SigAgente: utility}, to translate the names of the utilities to the ones used in ucs. Missing names are kept
+
+    :return: tuple (inicio_vigencia, fim_vigencia, concessionaria, modalidade, subgrupo, classe, posto, unidade, tusd, te) or None
+    '''
+    if _plain(line.get('DscBaseTarifaria')) != 'tarifa de aplicacao':
+        return None
+    if _plain(line.get('DscDetalhe', 'Não se aplica')) != 'nao se aplica':
+        return None
+    if _plain(line.get('SigAgenteAcessante', 'Não se aplica')) != 'nao se aplica':
+        return None
+    if _plain(line.get('DscSubClasse', 'Não se aplica')) not in ('nao se aplica', _plain(line.get('DscClasse'))):
+        return None
+
+    posto = postoNames.get(_plain(line.get('NomPostoTarifario')))
+    modality = modalityNames.get(_plain(line.get('DscModalidadeTarifaria')))
+    unit = unitDict.get(_plain(line.get('DscUnidadeTerciaria')).replace(' ', ''))
+
+    if posto is None or modality is None or unit is None:
+        return None
+
+    unit, factor = unit
+    utility = line['SigAgente'].strip()
+    utility = (utilityMap or {}).get(utility, utility)
+
+    return (
+        _isoDate(line['DatInicioVigencia']), _isoDate(line['DatFimVigencia']), utility, modality,
+        line['DscSubGrupo'].strip(), line['DscClasse'].strip(), posto, unit,
+        _number(line.get('VlrTUSD')) * factor, _number(line.get('VlrTE')) * factor
+    )
+
+
+def _open(path: str):
+    # os arquivos da ANEEL já foram publicados em UTF-8 e em Latin-1
+    with open(path, 'rb') as archive:
+        sample = archive.read(1 << 16)
+
+    try:
+        sample.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as error:
+        # o bloco lido pode ter cortado um caractere de vários bytes no fim
+        encoding = 'utf-8-sig' if error.start >= len(sample) - 3 else 'latin-1'
+
+    return open(path, 'r', encoding=encoding, newline='')
+
+
+def _lastYear(db, utility: str) -> int:
+    # o último ano com valores das UCs da concessionária, até onde vão as tarifas sem fim de vigência
+    return db.cursor().execute(
+        'SELECT MAX(r.ano) FROM rollup_mensal r JOIN ucs u ON u.id = r.uc_id WHERE u.concessionaria = ?', (utility,)
+    ).fetchone()[0]
+
+
+def importTariffs(path: str, utilityMap: dict = None, chunkSize: int = 5000, workers: int = None, db = None) -> dict:
+    '''
+    This function imports the ANEEL tariff file into the tarifas table. The file is read and written chunkSize rows at a time,
+    so it's never whole in memory, and everything is written in a single transaction. Tariffs already registered with the same
+    utility, modality, subgroup, class, posto, unit and start of validity are updated. Dates are saved as ISO strings (YYYY-MM-DD),
+    which sort like dates and can use the index of tarifas.
+    The costs of rollup_mensal of each imported utility are then recalculated by recalcModule.recalculate, from the first to
+    the last validity date imported for it
+
+    :param path: The path of the csv file
+    :param utilityMap: dict {SigAgente: utility}, to translate the names of the utilities to the ones used in ucs
+    :param chunkSize: How many rows are written at a time
+    :param workers: How many processes recalculate the costs. See recalcModule.recalculate
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict with how many rows were 'read', 'imported' and 'skipped', and how many rows of rollup_mensal were 'recalculated'
+    '''
+    db = connectionModule.resolve(db, dbName)
+    result = {'read': 0, 'imported': 0, 'skipped': 0, 'recalculated': 0}
+    windows = {}
+
+    def upsert(cursor, rows):
+        cursor.executemany(
+            '''
+            INSERT INTO tarifas (inicio_vigencia, fim_vigencia, concessionaria, modalidade, subgrupo, classe, posto, unidade, tusd, te)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT (concessionaria, modalidade, subgrupo, classe, posto, unidade, inicio_vigencia)
+            DO UPDATE SET fim_vigencia = excluded.fim_vigencia, tusd = excluded.tusd, te = excluded.te
+            ''', rows
+        )
+        result['imported'] += len(rows)
+
+    with _open(path) as archive, db.transaction() as cursor:
+        rows = []
+        for line in csv.DictReader(archive, delimiter=';'):
+            result['read'] += 1
+
+            row = normalize(line, utilityMap)
+            if row is None:
+                result['skipped'] += 1
+                continue
+
+            # a janela de vigência importada de cada concessionária. Um fim vazio vale até a última leitura
+            start, end, utility = row[:3]
+            if start:
+                first, last = windows.get(utility, (start, end))
+                windows[utility] = (min(first, start), None if last is None or end is None else max(last, end))
+
+            rows.append(row)
+            if len(rows) >= chunkSize:
+                upsert(cursor, rows)
+                rows = []
+
+        if rows:
+            upsert(cursor, rows)
+
+    tariffModule.invalidate(db)
+
+    for utility, (start, end) in windows.items():
+        lastYear = _lastYear(db, utility)
+        if lastYear is None:
+            continue
+
+        end = dt.date.fromisoformat(end) if end else dt.date(lastYear, 12, 31)
+        result['recalculated'] += recalcModule.recalculate(utility, dt.date.fromisoformat(start), end, workers=workers, db=db)
+
+    return result
+
+
+if __name__ == '__main__':
+    dbPath = sys.argv[2] if len(sys.argv) > 2 else dbName
+    print(importTariffs(sys.argv[1], db=connectionModule.getManager(dbPath)))
@@ -0,0 +1,196 @@
+'''
+Asyncio counterparts of the classes client and uc, for callers that can't block the event loop.
+The database work runs on a bounded pool of threads. Each thread has its own connection, given by the connectionManager,
+and the database is in WAL mode, so readers running at the same time don't wait for each other nor for a writer.
+The db param must be None or a connectionManager: a sqlite3 connection would be shared by every thread of the pool.
+A session of the connectionManager opened around the awaits is seen by every thread of the pool.
+Creating the shared connectionManager migrates the database, so the instances are created with aopen, which does it in the pool
+Usage
+-----
+    uc = await asyncModule.asyncUC.aopen(...)
+    cost = await uc.amonthlyCosts('jan', 2024)
+
+    with db.session():
+        costs = await asyncModule.monthlyCostsOf(ucs, 'jan', 2024)
+'''
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import connectionModule
+import clientsModule
+from clientsModule import client, uc
+
+_executor = None
+_executorLock = threading.Lock()
+
+
+def getExecutor(workers: int = None) -> ThreadPoolExecutor:
+    '''
+    This function returns the pool of threads where the database work runs, creating it on the first call
+
+    :param workers: How many threads the pool has. Used only when it's created. If None, 8
+
+    :return: ThreadPoolExecutor
+    '''
+    global _executor
+
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers or 8, thread_name_prefix='agv-db')
+
+    return _executor
+
+
+def shutdown(wait: bool = True) -> None:
+    '''
+    This function stops the pool of threads. The next call creates a new one
+    '''
+    global _executor
+
+    with _executorLock:
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+async def run(function, *args, **kwargs):
+    '''
+    This function runs a blocking function in the pool of threads and waits for its result without blocking the event loop
+    '''
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(getExecutor(), functools.partial(function, *args, **kwargs))
+
+
+def _async(method):
+    # versão assíncrona de um método de client ou uc, com a mesma assinatura
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await run(method, self, *args, **kwargs)
+
+    wrapper.__name__ = 'a' + method.__name__
+    wrapper.__doc__ = f'Async version of {method.__qualname__}'
+
+    return wrapper
+
+
+async def getManager(db = None):
+    '''
+    This function turns the optional db param of client and uc into a connectionManager, like connectionModule.resolve,
+    creating and migrating the shared manager in the pool of threads instead of the event loop
+
+    :return: connectionManager
+    '''
+    return await run(connectionModule.resolve, db, clientsModule.dbName)
+
+
+class asyncClient(client):
+    '''
+    This class is a client whose methods have an async version, named with the prefix a (areadClient, atotalConsumption...)
+    '''
+    __slots__ = ()
+
+    @classmethod
+    async def aopen(cls, *args, db = None, **kwargs):
+        '''
+        This method creates the instance without blocking the event loop, resolving db with getManager. It takes the params of client
+        '''
+        return cls(*args, db=await getManager(db), **kwargs)
+
+    acreateClient           = _async(client.createClient)
+    areadClient             = _async(client.readClient)
+    aupdateClient           = _async(client.updateClient)
+    atotalConsumption       = _async(client.totalConsumption)
+    aconsumptionMatrix      = _async(client.consumptionMatrix)
+    ahistory                = _async(client.history)
+    atotalCosts             = _async(client.totalCosts)
+    atotalSavings           = _async(client.totalSavings)
+    acreateSavingsReport    = _async(client.createSavingsReport)
+    asendSavingsReport      = _async(client.sendSavingsReport)
+    alinkUC                 = _async(client.linkUC)
+    aunlinkUC               = _async(client.unlinkUC)
+
+    @staticmethod
+    async def aconsumptionTotals(cnpjs: list = None, months: list = None, years: list = None, valueTypes: list = None, db = None) -> dict:
+        '''
+        Async version of client.consumptionTotals
+        '''
+        return await run(client.consumptionTotals, cnpjs, months, years, valueTypes, db)
+
+
+class asyncUC(uc):
+    '''
+    This class is a uc whose methods have an async version, named with the prefix a (areadUC, amonthlyCosts...)
+    '''
+    __slots__ = ()
+
+    @classmethod
+    async def aopen(cls, *args, db = None, **kwargs):
+        '''
+        This method creates the instance without blocking the event loop, resolving db with getManager. It takes the params of uc
+        '''
+        return cls(*args, db=await getManager(db), **kwargs)
+
+    acreateUC       = _async(uc.createUC)
+    areadUC         = _async(uc.readUC)
+    aupdateUC       = _async(uc.updateUC)
+    acreateValue    = _async(uc.createValue)
+    areadValue      = _async(uc.readValue)
+    aupdateValue    = _async(uc.updateValue)
+    adeleteValue    = _async(uc.deleteValue)
+    ahistory        = _async(uc.history)
+    aoptimizeDemand = _async(uc.optimizeDemand)
+    amonthlyCosts   = _async(uc.monthlyCosts)
+    atotalSavings   = _async(uc.totalSavings)
+    acreateReport   = _async(uc.createReport)
+    asendReport     = _async(uc.sendReport)
+    alinkClient     = _async(uc.linkClient)
+    aunlinkClient   = _async(uc.unlinkClient)
+
+    @staticmethod
+    async def acreateValues(rows, db = None) -> dict:
+        '''
+        Async version of uc.createValues
+        '''
+        return await run(uc.createValues, rows, db)
+
+
+async def gather(coroutines, limit: int = None, returnExceptions: bool = False) -> list:
+    '''
+    This function awaits many coroutines at the same time, like asyncio.gather, with at most limit of them running at once.
+    The pool of threads already bounds the database work; limit also bounds what is waiting for it
+
+    :param coroutines: An iterable of coroutines, such as [uc.amonthlyCosts('jan', 2024) for uc in ucs]
+    :param limit: The most coroutines running at the same time. If None, no limit besides the pool
+    :param returnExceptions: If True, exceptions are returned in the place of the results instead of being raised
+
+    :return: list with the results, in the order of the coroutines
+    '''
+    if limit is None:
+        return await asyncio.gather(*coroutines, return_exceptions=returnExceptions)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines), return_exceptions=returnExceptions)
+
+
+async def monthlyCostsOf(ucs: list, month: str, year: int = None, limit: int = None) -> dict:
+    '''
+    This function calculates the monthly costs of many UCs at the same time
+
+    :param ucs: A list of asyncUC
+    :param month: The reference month
+    :param year: The reference year
+
+    :return: dict {ucNumber: cost}. UCs whose cost couldn't be calculated have the exception raised in the place of the cost
+    '''
+    results = await gather([unit.amonthlyCosts(month, year) for unit in ucs], limit, returnExceptions=True)
+
+    return {unit.number: result for unit, result in zip(ucs, results)}
@@ -0,0 +1,262 @@
+'''
+Benchmark of the main paths of clientsModule over synthetic portfolios.
+Run it with, for example:
+    python benchmarkModule.py --scales 10x5x12,100x10x24 --output bench.json
+Each scale is clients x UCs per client x months. The results are printed, or saved, as json.
+With --import-budget, the time to import clientsModule in a new interpreter is checked instead, and the exit code is 1 when it's
+over the budget (importBudget, if no value is given) or when a heavy dependency (heavyModules) was imported with it:
+    python benchmarkModule.py --import-budget 0.15
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import tempfile
+import platform
+import datetime as dt
+
+import connectionModule
+import instrumentModule
+import clientsModule
+from clientsModule import client, uc, monthDict, valueTypesList, aGroupList, bGroupList, modalityList, hourDict
+
+utilities = ['CEMIG', 'LIGHT', 'ENEL SP']
+classes = ['Residencial', 'Comercial', 'Industrial']
+
+# dependências que só podem ser importadas quando usadas
+heavyModules = ['pandas', 'numpy', 'imbox', 'openpyxl', 'reportlab']
+
+# segundos que a importação de clientsModule pode levar, usados quando --import-budget não traz o valor
+importBudget = 0.15
+
+
+def _months(count: int, lastYear: int) -> list:
+    names = list(monthDict)
+    months = []
+    for position in range(count):
+        year, number = divmod(position, 12)
+        months.append((lastYear - (count - 1) // 12 + year, names[number]))
+
+    return months
+
+
+def buildPortfolio(db, clients: int, ucsPerClient: int, months: int, tariffVersions: int = 2, seed: int = 0, lastYear: int = 2024) -> dict:
+    '''
+    This function fills an empty database with a synthetic portfolio: clients, UCs of every subgroup of aGroupList and bGroupList
+    and every modality of modalityList, one value of every type each month, and tariffVersions tariff versions that cover the period
+
+    :return: dict with the lists 'clients' (client objects), 'ucs' (uc objects) and 'rows' (the values, as accepted by uc.createValues)
+    '''
+    random.seed(seed)
+    subgroups = aGroupList + bGroupList
+    period = _months(months, lastYear)
+    portfolio = {'clients': [], 'ucs': [], 'rows': []}
+
+    with db.transaction():
+        for clientNumber in range(clients):
+            newClient = client(f'Cliente {clientNumber}', 'Rua', '00000-000', f'{clientNumber:014d}', f'c{clientNumber}@agv.com', '', 'company', db=db)
+            newClient.createClient()
+            portfolio['clients'].append(newClient)
+
+            for ucNumber in range(ucsPerClient):
+                position = clientNumber * ucsPerClient + ucNumber
+                subgroup = subgroups[position % len(subgroups)]
+                modality = modalityList[position % len(modalityList)]
+                newUC = uc(
+                    utilities[position % len(utilities)], f'{position:010d}', newClient.name, 'Rua', '00000-000',
+                    subgroup, modality, classes[position % len(classes)],
+                    peakDemand=random.uniform(50, 500), offPeakDemand=random.uniform(100, 1000), demand=random.uniform(100, 1000), db=db
+                )
+                newUC.createUC()
+                portfolio['ucs'].append(newUC)
+
+                for year, month in period:
+                    for valueType in valueTypesList:
+                        portfolio['rows'].append((newUC.number, month, valueType, round(random.uniform(10, 5000), 2), year))
+
+        # versões de tarifa que começam no primeiro dia de um mês e cobrem todo o período
+        tariffs = []
+        length = -(-len(period) // tariffVersions)
+        for version in range(0, len(period), length):
+            year, month = period[version]
+            start = dt.date(year, monthDict[month], 1)
+            end = dt.date(lastYear, 12, 31)
+            if version + length < len(period):
+                year, month = period[version + length]
+                end = dt.date(year, monthDict[month], 1) - dt.timedelta(days=1)
+
+            for utility in utilities:
+                for modality in modalityList:
+                    for subgroup in subgroups:
+                        for clientClass in classes:
+                            for posto in set(hourDict.values()):
+                                for unit in ('R$/MWh', 'R$/kW'):
+                                    tariffs.append((start.isoformat(), end.isoformat(), utility, modality, subgroup, clientClass, posto, unit,
+                                                    round(random.uniform(20, 600), 2), round(random.uniform(0, 400), 2) if unit == 'R$/MWh' else 0))
+
+        db.cursor().executemany(
+            '''
+            INSERT INTO tarifas (inicio_vigencia, fim_vigencia, concessionaria, modalidade, subgrupo, classe, posto, unidade, tusd, te)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
+            ''', tariffs
+        )
+
+    return portfolio
+
+
+def importTime(module: str = 'clientsModule', runs: int = 5) -> dict:
+    '''
+    This function measures the time to import a module in a new interpreter, the best of some runs, so the modules already imported
+    by this process don't hide the cost
+
+    :return: dict with 'module', 'seconds' and 'heavyModules', the ones of heavyModules imported with it
+    '''
+    code = (
+        f'import sys, time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start); '
+        f"print(','.join(name for name in {heavyModules!r} if name in sys.modules))"
+    )
+
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        times.append(float(output[0]))
+        loaded = [name for name in output[1].split(',') if name] if len(output) > 1 else []
+
+    return {'module': module, 'seconds': round(min(times), 6), 'heavyModules': loaded}
+
+
+def _timed(results: list, scale: str, name: str, calls: int, function) -> None:
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+
+    results.append({'scale': scale, 'path': name, 'calls': calls, 'seconds': round(elapsed, 6), 'perCall': round(elapsed / max(calls, 1), 9)})
+
+
+def runScale(clients: int, ucsPerClient: int, months: int, tariffVersions: int = 2, sample: int = 200, directory: str = None) -> list:
+    '''
+    This function builds a synthetic database of one scale and times its ingestion, lookup, aggregation and costing paths
+
+    :param sample: How many calls of the per-UC paths (createValue, readValue, monthlyCosts...) are timed
+    :param directory: Where the temporary database is created. If None, the system temporary directory
+
+    :return: list of dicts {'scale', 'path', 'calls', 'seconds', 'perCall'}
+    '''
+    import costModule
+
+    scale = f'{clients}x{ucsPerClient}x{months}'
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=directory) as folder:
+        db = connectionModule.getManager(os.path.join(folder, 'agv.db'))
+
+        # os clientes e UCs lidos ficam no mapa de identidade durante todo o benchmark, como numa sessão de um job
+        with db.session():
+            portfolio = {}
+            _timed(results, scale, 'buildPortfolio', clients * ucsPerClient, lambda: portfolio.update(buildPortfolio(db, clients, ucsPerClient, months, tariffVersions)))
+
+            rows = portfolio['rows']
+            single, bulk = rows[:sample], rows[sample:]
+            ucsByNumber = {newUC.number: newUC for newUC in portfolio['ucs']}
+            lastYear, lastMonth = rows[-1][4], rows[-1][1]
+
+            _timed(results, scale, 'uc.createValue', len(single), lambda: [ucsByNumber[row[0]].createValue(row[1], row[2], row[3], row[4]) for row in single])
+            _timed(results, scale, 'uc.createValues', len(bulk), lambda: uc.createValues(bulk, db))
+
+            picks = random.sample(portfolio['ucs'], min(sample, len(portfolio['ucs'])))
+            _timed(results, scale, 'uc.readUC', len(picks), lambda: [pick.readUC() for pick in picks])
+            _timed(results, scale, 'uc.readValue', len(picks), lambda: [pick.readValue(lastMonth, 'consumption', lastYear) for pick in picks])
+
+            clientPicks = portfolio['clients'][:sample]
+            _timed(results, scale, 'client.readClient', len(clientPicks), lambda: [pick.readClient() for pick in clientPicks])
+            _timed(results, scale, 'client.totalConsumption', len(clientPicks), lambda: [pick.totalConsumption(lastMonth, 'consumption', lastYear) for pick in clientPicks])
+            _timed(results, scale, 'client.consumptionTotals', 1, lambda: client.consumptionTotals(years=[lastYear], db=db))
+
+            def monthlyCosts():
+                for pick in picks:
+                    try:
+                        pick.monthlyCosts(lastMonth, lastYear)
+                    except RuntimeError:
+                        pass
+
+            _timed(results, scale, 'uc.monthlyCosts', len(picks), monthlyCosts)
+
+            def monthlyCostOf():
+                for pick in picks:
+                    try:
+                        clientsModule.monthlyCostOf(pick.number, lastMonth, lastYear, db)
+                    except RuntimeError:
+                        pass
+
+            _timed(results, scale, 'clientsModule.monthlyCostOf', len(picks), monthlyCostOf)
+            _timed(results, scale, 'costModule.portfolioCosts', 1, lambda: costModule.portfolioCosts(lastYear, [lastMonth], db=db))
+
+        db.closeAll()
+
+    return results
+
+
+def parseScale(text: str) -> tuple:
+    clients, ucsPerClient, months = (int(value) for value in text.lower().split('x'))
+
+    return clients, ucsPerClient, months
+
+
+def main(arguments: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of clientsModule over synthetic portfolios')
+    parser.add_argument('--scales', help='comma separated clients x UCs per client x months. Default: 10x5x12,50x10x12,100x20x24, unless --import-budget is used')
+    parser.add_argument('--tariff-versions', type=int, default=2)
+    parser.add_argument('--sample', type=int, default=200)
+    parser.add_argument('--output', help='json file where the results are saved. If not filled, they are printed')
+    parser.add_argument('--profile', action='store_true', help='saves the counters of instrumentModule of each scale with the results')
+    parser.add_argument('--import-budget', type=float, nargs='?', const=importBudget, help=f'the most seconds that importing clientsModule may take. Default: {importBudget}')
+    options = parser.parse_args(arguments)
+
+    scales = options.scales or ('' if options.import_budget is not None else '10x5x12,50x10x12,100x20x24')
+
+    if options.profile:
+        instrumentModule.enable()
+
+    results = []
+    profiles = {}
+    for text in filter(None, scales.split(',')):
+        results.extend(runScale(*parseScale(text), tariffVersions=options.tariff_versions, sample=options.sample))
+        if options.profile:
+            profiles[text] = instrumentModule.snapshot()
+            instrumentModule.reset()
+
+    report = {
+        'created_at': dt.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if options.profile:
+        report['profile'] = profiles
+
+    status = 0
+    if options.import_budget is not None:
+        report['import'] = importTime()
+        report['import']['budget'] = options.import_budget
+
+        if report['import']['seconds'] > options.import_budget or report['import']['heavyModules']:
+            status = 1
+            print(f"import budget exceeded: {report['import']}", file=sys.stderr)
+
+    if options.output:
+        with open(options.output, 'w') as archive:
+            json.dump(report, archive, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict
+
+
+class identityMap:
+    '''
+    This class keeps the registers of clients and UCs already read in a session, so repeated operations on the same
+    entity don't go to the database again. Entries are grouped by kind (for example 'clientes' by cnpj, 'ucs' by numero)
+    and the least recently used ones are discarded when maxSize is reached.
+    Registers are only kept while a session is open (see connectionModule.connectionManager.session), and every register is
+    discarded when the last session ends, so what other processes write is seen by the next session
+    '''
+    def __init__(self, maxSize: int = 10000) -> None:
+        '''
+        Constructor of the class identityMap
+
+        :param maxSize: How many entries, of all kinds together, are kept in memory
+        '''
+        self.maxSize    = maxSize
+        self.hits       = 0
+        self.misses     = 0
+        self._entries   = OrderedDict()
+        self._sessions  = 0
+        self._lock      = threading.Lock()
+
+    def begin(self) -> None:
+        '''
+        This method opens a session. The registers are kept from now on, until the last open session ends
+        '''
+        with self._lock:
+            if not self._sessions:
+                self._entries.clear()
+            self._sessions += 1
+
+    def end(self) -> None:
+        '''
+        This method ends a session opened by begin. When no session is left open, every register is discarded
+        '''
+        with self._lock:
+            self._sessions -= 1
+            if not self._sessions:
+                self._entries.clear()
+
+    def get(self, kind: str, key):
+        '''
+        This method returns the register of an entity, or None if it isn't in memory
+        '''
+        with self._lock:
+            register = self._entries.get((kind, key))
+            if register is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end((kind, key))
+
+        return register
+
+    def put(self, kind: str, key, register) -> None:
+        '''
+        This method keeps the register of an entity. None registers, and any register outside a session, are not kept
+        '''
+        if register is None:
+            return
+
+        with self._lock:
+            if not self._sessions:
+                return
+
+            self._entries[(kind, key)] = register
+            self._entries.move_to_end((kind, key))
+
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind: str, key) -> None:
+        '''
+        This method discards the register of an entity. It must be called every time the entity is written
+        '''
+        with self._lock:
+            self._entries.pop((kind, key), None)
+
+    def clear(self) -> None:
+        '''
+        This method discards every register in memory
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, kind: str, key, read):
+        '''
+        This method returns the register of an entity, calling read() and keeping its result when it isn't in memory.
+        Outside a session, read() is always called
+        '''
+        if not self._sessions:
+            return read()
+
+        register = self.get(kind, key)
+        if register is None:
+            register = read()
+            self.put(kind, key, register)
+
+        return register
+
+
+class resultCache:
+    '''
+    This class keeps the results of queries, such as totals and costs, by a key like (entity, period, type).
+    Each result has tags, such as ('uc', id) or ('cliente', id), and invalidate discards every result with a tag.
+    A result computed while an invalidation happened is not kept, since it may have read the data from before the write
+    '''
+    def __init__(self, maxSize: int = 10000) -> None:
+        '''
+        Constructor of the class resultCache
+
+        :param maxSize: How many results are kept in memory
+        '''
+        self.maxSize    = maxSize
+        self.hits       = 0
+        self.misses     = 0
+        self.generation = 0
+        self.seq        = 0
+        self._entries   = OrderedDict()
+        self._tags      = {}
+        self._lock      = threading.Lock()
+
+    def get(self, key):
+        '''
+        This method returns a tuple (True, result) if the result of key is in memory, or (False, None) if it isn't
+        '''
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            return True, self._entries[key][0]
+
+    def put(self, key, result, tags: tuple = (), generation: int = None) -> None:
+        '''
+        This method keeps a result. If generation is filled and an invalidation happened after it, the result is discarded
+
+        :param generation: The value of the attribute generation read before the result was computed
+        '''
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries[key] = (result, tags)
+            self._entries.move_to_end(key)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.maxSize:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key) -> None:
+        result, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tag) -> None:
+        '''
+        This method discards every result with a tag
+        '''
+        with self._lock:
+            self.generation += 1
+            for key in list(self._tags.get(tag, ())):
+                self._discard(key)
+
+    def clear(self) -> None:
+        '''
+        This method discards every result
+        '''
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,8 +1,9 @@
-import imbox
-import sqlite3  as sql
-import pandas   as pd
+import calendar
 import datetime as dt
-from datetime import datetime
+
+import connectionModule
+import tariffModule
+import rollupModule
 
 dbName = 'agv.db'
 typeDict = {
@@ -63,6 +64,9 @@ aGroupList = [
     'A5'
 ]
 
+# tipo de valor a partir da tabela (consumo ou demanda) e do posto de um registro
+valueTypeDict = {(typeDict[valueType], hourDict[valueType]): valueType for valueType in valueTypesList}
+
 modalityList = [
     'Azul',
     'Branca',
@@ -73,12 +77,107 @@ modalityList = [
     'Verde'
 ]
 
+# categorias dos custos reais da tabela lancamentos
+costCategoryList = [
+    'cooperativa',
+    'energia contratada',
+    'encargos'
+]
+
+
+def valueCost(subgroup: str, valueType: str, value: float, prices: dict) -> float:
+    '''
+    This function calculates the share of one value in the cost of a month of an UC, disregarding taxes like ICMS, PIS/COFINS.
+        - B group: only the consumption is charged, by (tusd + te) / 1000
+        - A group: peak and off-peak consumptions are charged by (tusd + te) / 1000 and every demand by its tusd
+
+    :param subgroup: The subgroup of the UC
+    :param valueType: One of valueTypesList
+    :param value: The value read
+    :param prices: dict {(posto, unit): (tusd, te)}, like the return of tariffModule.tariffRepository.prices
+
+    :return: float. Values that aren't charged for the subgroup cost 0
+    '''
+    if subgroup in bGroupList:
+        if valueType != 'consumption':
+            return 0
+
+    elif subgroup in aGroupList:
+        if valueType == 'consumption':
+            return 0
+
+    else:
+        raise RuntimeError('Subgroup not finded')
+
+    if typeDict[valueType] == 'consumo':
+        tusd, te = prices.get((hourDict[valueType], 'R$/MWh'), (0, 0))
+
+        return value * (tusd + te) / 1000
+
+    return value * prices.get((hourDict[valueType], 'R$/kW'), (0, 0))[0]
+
+
+def costOf(subgroup: str, values: dict, prices: dict) -> float:
+    '''
+    This function calculates the cost of a month of an UC, disregarding taxes like ICMS, PIS/COFINS.
+    It's the sum of valueCost of every value of the month
+
+    :param subgroup: The subgroup of the UC
+    :param values: dict {valueType: value} with the readings of the month. Missing types count as 0
+    :param prices: dict {(posto, unit): (tusd, te)}, like the return of tariffModule.tariffRepository.prices
+
+    :return: float
+    '''
+    return sum(valueCost(subgroup, valueType, value or 0, prices) for valueType, value in values.items())
+
+
+def monthlyCostOf(ucNumber: str, month: str, year: int = None, db = None) -> float:
+    '''
+    This function calculates the cost of a month of an UC like uc.monthlyCosts, straight from sqlite: the UC, its values and the
+    prices of the month are read with one query each, without building the uc, loading the tariff repository or using pandas.
+    It's meant for short-lived processes, such as cron jobs, that look up a few costs
+
+    :param ucNumber: The number of the UC
+    :param month: A reference month
+    :param year: A reference year. If not filled, the current year is considered
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: float
+    '''
+    db = connectionModule.resolve(db, dbName)
+    year = year or dt.datetime.now().year
+
+    register = db.cursor().execute('SELECT id, concessionaria, modalidade, subgrupo, classe FROM ucs WHERE numero = ?', (ucNumber,)).fetchone()
+    if not register:
+        raise RuntimeError('UC not found')
+
+    ucID, utility, modality, subgroup, clientClass = register
+
+    minDate = dt.date(year, monthDict[month], 1)
+    maxDate = dt.date(year, monthDict[month], calendar.monthrange(year, monthDict[month])[1])
+    prices = tariffModule.queryPrices(db, utility, modality, subgroup, clientClass, minDate, maxDate)
+
+    if not prices:
+        raise RuntimeError('Please, update the prices table for this utility')
+
+    rows = db.cursor().execute(
+        '''
+        SELECT 'consumo', p.descricao, r.valor FROM consumos r JOIN posto p ON p.id = r.posto_id WHERE r.uc_id = ? AND r.ano = ? AND r.mes = ?
+        UNION ALL
+        SELECT 'demanda', p.descricao, r.valor FROM demandas r JOIN posto p ON p.id = r.posto_id WHERE r.uc_id = ? AND r.ano = ? AND r.mes = ?
+        ''', (ucID, year, month) * 2
+    )
+
+    return costOf(subgroup, {valueTypeDict[(tipo, posto)]: value for tipo, posto, value in rows}, prices)
+
 
 class client:
     '''
     This class defines an active client of AGV for the energy management service
     '''
-    def __init__(self, name: str, address: str, CEP: str, cnpj: str, email: str, phone: str, legalPerson: str, paymentMethod = None) -> None:
+    __slots__ = ('name', 'address', 'CEP', 'cnpj', 'email', 'phone', 'legalPerson', 'paymentMethod', 'ucList', 'db')
+
+    def __init__(self, name: str, address: str, CEP: str, cnpj: str, email: str, phone: str, legalPerson: str, paymentMethod = None, db = None) -> None:
         '''
         Constructor of the class client
 
@@ -91,6 +190,8 @@ class client:
         :param legalPerson: The person type. If is a company or a person. It accepts the following values:
             - 'person'
             - 'company'
+        :param db: The database used by the client. It accepts a connectionModule.connectionManager or a sqlite3 connection.
+            If None, the shared connection manager of dbName will be used
 
         :return: None
         '''
@@ -102,48 +203,70 @@ class client:
         self.phone          = phone
         self.legalPerson    = legalPerson
         self.paymentMethod  = paymentMethod
-        self.ucList         = []
+        self.ucList         = ucCollection(self)
+        self.db             = connectionModule.resolve(db, dbName)
         
     def createClient(self) -> None:
         '''
         This method will include the client in the clients database
         '''
 
-        verification = self.readClient()
         date = dt.datetime.now()
-        if not verification:
-            conn = sql.connect(dbName)
-            cursor = conn.cursor()
 
+        # um cliente já cadastrado com o mesmo cnpj é mantido como está, numa única instrução atômica
+        with self.db.transaction() as cursor:
             cursor.execute(
                 '''
                 INSERT INTO clientes (nome, endereco, cep, cnpj, email, telefone, responsavel_legal, forma_de_pagamento, created_at)
-                VALUES (?,?,?,?,?,?,?,?)
+                VALUES (?,?,?,?,?,?,?,?,?)
+                ON CONFLICT (cnpj) DO NOTHING
                 ''', (self.name, self.address, self.CEP, self.cnpj, self.email, self.phone, self.legalPerson, self.paymentMethod, date)
             )
-            conn.commit()
-            conn.close()
+            created = cursor.rowcount
+
+        # só depois do commit, para que outra sessão não guarde de novo o registro de antes da escrita
+        if created:
+            self.db.identity.invalidate('clientes', self.cnpj)
+            self.db.identity.invalidate('clientesNome', self.name)
 
     def readClient(self):
         '''
         This method will read the client's data in the client's database
         '''
-        conn = sql.connect(dbName)
-        cursor = conn.cursor()
+        return self._readClient(self.db.cursor())
 
-        results = cursor.execute(
+    def _readClient(self, cursor):
+        return self.db.identity.lookup('clientes', self.cnpj, lambda: cursor.execute(
             '''
             SELECT * 
             FROM clientes
             WHERE cnpj = ?
             ''', (self.cnpj,)
-        ).fetchone()
-        conn.close()
-
-        return results
+        ).fetchone())
 
     def updateClient(self) -> None:
-        pass
+        '''
+        This method will update the client's data in the client's database with the attributes of this object.
+        The client is found by its cnpj, so the cnpj itself can't be changed. It raises a RuntimeError if the client isn't registered
+        '''
+        with self.db.transaction() as cursor:
+            register = cursor.execute('SELECT nome FROM clientes WHERE cnpj = ?', (self.cnpj,)).fetchone()
+
+            if not register:
+                raise RuntimeError('Client not registered')
+
+            cursor.execute(
+                '''
+                UPDATE clientes
+                SET nome = ?, endereco = ?, cep = ?, email = ?, telefone = ?, responsavel_legal = ?, forma_de_pagamento = ?
+                WHERE cnpj = ?
+                ''', (self.name, self.address, self.CEP, self.email, self.phone, self.legalPerson, self.paymentMethod, self.cnpj)
+            )
+
+        # o nome antigo e o novo podem estar no mapa de identidade, que só é limpo depois do commit
+        self.db.identity.invalidate('clientes', self.cnpj)
+        self.db.identity.invalidate('clientesNome', register[0])
+        self.db.identity.invalidate('clientesNome', self.name)
 
     def deleteClient(self) -> None:
         pass
@@ -163,91 +286,198 @@ class client:
             :param year: A reference year. If None, then the method will consider the current year
             :return: int
         '''
-        total = None
-
         if not year:
             year = dt.datetime.now().year
-        
-        conn = sql.connect(dbName)
-        cursor = conn.cursor()
 
-        clientID = cursor.execute(
-            '''
-            SELECT id
-            FROM clientes
-            WHERE cnpj = ?
-            ''', (self.cnpj,)
-        ).fetchone()
+        totals = client.consumptionTotals([self.cnpj], [month], [year], [consumptionType], db=self.db)
 
-        elecTariff = cursor.execute(
-            '''
-            SELECT id
-            FROM posto
-            WHERE descricao = ?
-            ''', (hourDict[consumptionType], )
-        ).fetchone()
+        return totals.get((self.cnpj, year, month, consumptionType), 0)
 
-        if typeDict[consumptionType] == 'consumo':
-            value = cursor.execute(
-                '''
-                SELECT valor
-                FROM consumo
-                WHERE mes = ?, ano = ?, posto_id = ?, cliente_id = ?
-                ''', (month, year, elecTariff, clientID)
-            ).fetchall()
+    def consumptionMatrix(self, year = None) -> dict:
+        '''
+            This method returns every value type of every month of a year for all the UCs linked to this client, read in a single query
 
-        else:
-            value = cursor.execute(
+            :param year: A reference year. If None, then the method will consider the current year
+            :return: dict {month: {valueType: total}}, with all the months of monthDict and all the types of valueTypesList. Missing values are 0
+        '''
+        if not year:
+            year = dt.datetime.now().year
+
+        totals = client.consumptionTotals([self.cnpj], years=[year], db=self.db)
+
+        return {
+            month: {valueType: totals.get((self.cnpj, year, month, valueType), 0) for valueType in valueTypesList}
+            for month in monthDict
+        }
+
+    @staticmethod
+    def consumptionTotals(cnpjs: list = None, months: list = None, years: list = None, valueTypes: list = None, db = None) -> dict:
+        '''
+            This method sums the consumptions and demands of the UCs of many clients, in many months, years and value types at once.
+            The join between clients, UCs and values and the sums are made by the database, in a single query
+
+            :param cnpjs: The documents of the clients. If None, all the clients are considered
+            :param months: The reference months. If None, all the months are considered
+            :param years: The reference years. If None, all the years are considered
+            :param valueTypes: The value types, from valueTypesList. If None, all of them are considered
+            :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+            :return: dict {(cnpj, year, month, valueType): total}. Combinations without values are not in the dict
+        '''
+        db = connectionModule.resolve(db, dbName)
+        valueTypes = valueTypes or valueTypesList
+
+        for valueType in valueTypes:
+            if valueType not in valueTypesList:
+                raise TypeError('valueType param not recognized')
+
+        filters = ''
+        params = []
+        for column, values in (('cl.cnpj', cnpjs), ('r.mes', months), ('r.ano', years)):
+            if values:
+                filters += f" AND {column} IN ({','.join('?' * len(values))})"
+                params.extend(values)
+
+        queries = []
+        queryParams = []
+        for table, tipo in (('consumos', 'consumo'), ('demandas', 'demanda')):
+            postos = list({hourDict[valueType] for valueType in valueTypes if typeDict[valueType] == tipo})
+            if not postos:
+                continue
+
+            queries.append(
+                f'''
+                SELECT cl.cnpj, r.ano, r.mes, '{tipo}', p.descricao, SUM(r.valor)
+                FROM {table} r
+                JOIN ucs u ON u.id = r.uc_id
+                JOIN clientes cl ON cl.id = u.client_id
+                JOIN posto p ON p.id = r.posto_id
+                WHERE p.descricao IN ({','.join('?' * len(postos))}){filters}
+                GROUP BY cl.cnpj, r.ano, r.mes, p.descricao
                 '''
-                SELECT valor
-                FROM demanda
-                WHERE mes = ?, ano = ?, posto_id = ?, cliente_id = ?
-                ''', (month, year, elecTariff, clientID)
-            ).fetchall()
-            
-        conn.close()
+            )
+            queryParams.extend(postos + params)
 
-        for unit in value:
-            total += value[unit]
+        rows = db.cursor().execute(' UNION ALL '.join(queries), queryParams)
 
-        return total
+        return {(cnpj, year, month, valueTypeDict[(tipo, posto)]): total for cnpj, year, month, tipo, posto, total in rows}
     
 
-    def totalCosts(self, month: str) -> float:
+    def history(self, years: list = None, fill: bool = True):
+        '''
+            This method returns the whole series of consumptions and demands of the UCs linked to the client, read in a single query
+            :param years: If filled, only these years are read
+            :param fill: If True, the missing months between the first and the last month of each UC are added, with NaN values
+            :return: DataFrame indexed by (numero, ano, mes), with one column for each type of valueTypesList. See historyModule
+        '''
+        import historyModule
+
+        return historyModule.history(cnpj=self.cnpj, years=years, fill=fill, db=self.db)
+
+    def totalCosts(self, month: str, year: int = None) -> float:
         '''
             This method calculates the costs that would be if the UCs linked to the client had no savings in a reference month
             :param month: A reference month
+            :param year: A reference year. If not filled, the current year is considered
 
             :return: float
         '''
-        pass
+        import savingsModule
 
-    def totalSavings(self, month: str):
+        savings = savingsModule.portfolioSavings(year or dt.datetime.now().year, [month], cnpj=self.cnpj, db=self.db)
+        if savings['missingTariff'].any():
+            raise RuntimeError('Please, update the prices table for this utility')
+
+        return float(savings['custoRegulado'].sum())
+
+    def totalSavings(self, month: str, year: int = None) -> float:
         '''
-            This method calculates the savings of all the UCs linked to the client in a reference month
-        '''        
-        pass
+            This method calculates the savings of all the UCs linked to the client in a reference month.
+            Only the UCs with real costs registered in the month have savings
+            :param month: A reference month
+            :param year: A reference year. If not filled, the current year is considered
 
-    def linkUC(self, ucNumber: str):
-        pass
+            :return: float
+        '''
+        import savingsModule
 
-    def unlinkUC(self, ucNumber: str):
-        pass
+        savings = savingsModule.portfolioSavings(year or dt.datetime.now().year, [month], cnpj=self.cnpj, db=self.db)
+        if savings['missingTariff'].any():
+            raise RuntimeError('Please, update the prices table for this utility')
+
+        return float(savings['economia'].sum())
 
-    def createSavingsReport(self, month: str):
+    def linkUC(self, ucNumber: str) -> int:
         '''
-            This method creates a saving report for all the UCs linked to the client in a reference month
+            This method links a pre registered UC to the client. A UC linked to another client is moved to this one
+            :param ucNumber: The number of the UC
+            :return: 0 if everything runs ok
         '''
-        pass
+        register = self.readClient()
+        if not register:
+            raise RuntimeError('Client not registered')
+
+        _linkUC(self.db, ucNumber, register[0])
+        self.ucList.invalidate()
 
-    def sendSavingsReport(self,archive: str):
+        return 0
+
+    def unlinkUC(self, ucNumber: str) -> int:
         '''
-            This method sends an archive which must be a saving report created previously
+            This method unlinks a UC from the client. It raises a RuntimeError if the UC isn't linked to the client
+            :param ucNumber: The number of the UC
+            :return: 0 if everything runs ok
         '''
-        pass
+        register = self.readClient()
+        if not register:
+            raise RuntimeError('Client not registered')
+
+        _linkUC(self.db, ucNumber, None, register[0])
+        self.ucList.invalidate()
+
+        return 0
+
+    def createSavingsReport(self, month = None, year = None, path: str = None, chunkSize: int = 1000) -> str:
+        '''
+            This method creates a saving report for all the UCs linked to the client in a reference month.
+            The values are read in chunks and the report is written as it's calculated, so the memory used doesn't grow with the number of UCs
+
+            :param month: A reference month, or a list of months. If None, all the months are considered
+            :param year: A reference year, or a list of years. If None, the current year is considered
+            :param path: The archive of the report. The extension defines the format: '.csv', '.xlsx' or '.pdf'. If None, a csv named after the cnpj is created
+            :param chunkSize: How many values are read from the database at a time
+            :return: str, the path of the archive
+        '''
+        import reportModule
+
+        months = [month] if isinstance(month, str) else month
+        years = [int(year or dt.datetime.now().year)] if not isinstance(year, (list, tuple)) else [int(value) for value in year]
+        # um cnpj formatado tem '/', que viraria uma pasta no caminho
+        path = path or f"relatorio_{''.join(character for character in self.cnpj if character.isdigit())}.csv"
+
+        register = self.readClient()
+        if not register:
+            raise RuntimeError('Client not registered')
+
+        rows = reportModule.reportRows(self.db, clientID=register[0], years=years, months=months, chunkSize=chunkSize)
+
+        return reportModule.writeReport(rows, path)
+
+    def sendSavingsReport(self,archive: str) -> int:
+        '''
+            This method sends an archive which must be a saving report created previously.
+            The message is put in the outbox and sent to the client's email by the next outboxModule.deliver run
+
+            :param archive: The path of the report
+            :return: int, the id of the message in the outbox
+        '''
+        import outboxModule
+
+        return outboxModule.enqueue(self.email, f'Relatório de economia - {self.name}', 'Segue em anexo o relatório de economia.', archive, db=self.db)
 
 class uc:
-    def __init__(self, utility, number, client, address, CEP, subgroup, modality, clientClass, peakDemand = None, offPeakDemand = None, demand = None) -> None:
+    __slots__ = ('utility', 'number', 'client', 'address', 'CEP', 'subgroup', 'modality', 'peakDemand', 'offPeakDemand', 'demand', 'clientClass', 'db')
+
+    def __init__(self, utility, number, client, address, CEP, subgroup, modality, clientClass, peakDemand = None, offPeakDemand = None, demand = None, db = None) -> None:
         self.utility        = utility
         self.number         = number
         self.client         = client
@@ -259,6 +489,7 @@ class uc:
         self.offPeakDemand  = offPeakDemand
         self.demand         = demand
         self.clientClass    = clientClass
+        self.db             = connectionModule.resolve(db, dbName)
     
     '''
  ## ##   ### ##   ##  ###  ### ##             ## ##   #### ##    ##     ### ##   #### ##  
@@ -274,59 +505,81 @@ class uc:
         '''
         This method create an UC in the database. It returns a RunTimeError if you try to create an existent UC, and returns 0 if everything runs ok
         '''
-        ucValidation = self.readUC()
-
-        if not ucValidation:
-            date = dt.datetime.now()
-            
-            conn = sql.connect(dbName)
-            cursor = conn.cursor()
+        date = dt.datetime.now()
 
-            clientID = cursor.execute(
+        with self.db.transaction() as cursor:
+            clientID = self.db.identity.lookup('clientesNome', self.client, lambda: cursor.execute(
                 '''
                 SELECT id
                 FROM clientes
                 WHERE nome = ?
                 ''', (self.client,)
-            ).fetchone()
-            
+            ).fetchone())
+
+            # a verificação de UC repetida é o próprio índice único de numero, sem uma leitura antes
             cursor.execute(
                 '''
                 INSERT INTO ucs (numero, concessionaria, client_id, endereco, cep, subgrupo, modalidade, classe, demanda, demanda_ponta, demanda_fora_ponta, created_at)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                ''', (self.number, self.utility, clientID, self.address, self.CEP, self.subgroup, self.modality, self.clientClass, self.demand, self.peakDemand, self.offPeakDemand, date)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+                ON CONFLICT (numero) DO NOTHING
+                ''', (self.number, self.utility, clientID[0] if clientID else None, self.address, self.CEP, self.subgroup, self.modality, self.clientClass, self.demand, self.peakDemand, self.offPeakDemand, date)
             )
-            conn.commit()
-            conn.close()
 
-        else:
-            raise RuntimeError('Essa UC já está cadastrada')
+            if not cursor.rowcount:
+                raise RuntimeError('Essa UC já está cadastrada')
+
+        self.db.identity.invalidate('ucs', self.number)
 
         return 0
     
     def readUC(self):
-        conn = sql.connect(dbName)
-        cursor = conn.cursor()
+        return self._readUC(self.db.cursor())
 
-        ucRegister = cursor.execute(
+    def _readUC(self, cursor):
+        return self.db.identity.lookup('ucs', self.number, lambda: cursor.execute(
             '''
             SELECT *
             FROM ucs
             WHERE numero = ?
             ''', (self.number,)
-        ).fetchone()
+        ).fetchone())
 
-        conn.close()
+    def updateUC(self) -> int:
+        '''
+        This method updates the UC in the database with the attributes of this object. The UC is found by its number, and its
+        client is changed only by linkClient. The costs of rollup_mensal are recalculated, since the tariffs may have changed.
+        It raises a RuntimeError if the UC isn't registered, and returns 0 if everything runs ok
+        '''
+        with self.db.transaction() as cursor:
+            register = cursor.execute(
+                '''
+                UPDATE ucs
+                SET concessionaria = ?, endereco = ?, cep = ?, subgrupo = ?, modalidade = ?, classe = ?, demanda = ?, demanda_ponta = ?, demanda_fora_ponta = ?
+                WHERE numero = ?
+                RETURNING id
+                ''', (self.utility, self.address, self.CEP, self.subgroup, self.modality, self.clientClass, self.demand, self.peakDemand, self.offPeakDemand, self.number)
+            ).fetchone()
 
-        return ucRegister
+            if not register:
+                raise RuntimeError('UC not found')
 
-    def updateUC(self) -> int:
-        pass
+            keys = cursor.execute(
+                '''
+                SELECT uc_id, ano, mes FROM consumos WHERE uc_id = ?
+                UNION
+                SELECT uc_id, ano, mes FROM demandas WHERE uc_id = ?
+                ''', (register[0], register[0])
+            ).fetchall()
+            rollupModule.refresh(self.db, cursor, keys)
+
+        self.db.identity.invalidate('ucs', self.number)
+
+        return 0
 
     def deleteUC(self) -> int:
         pass
 
-    def createValue(self, month, valueType, value, year = None) -> int:
+    def createValue(self, month, valueType, value, year = None, replace: bool = False) -> int:
         '''
         This method will create a register of consumption or demand for this UC for a specific month
         :param month: A reference month
@@ -339,53 +592,157 @@ class uc:
             6. off-peak-demand
         :param value: The value that'll be registered
         :param year: A reference year. If not filled, it'll be the current year
+        :param replace: If True, a value already registered is replaced instead of raising a RuntimeError, so the call can be repeated safely
         '''
-        
+        if month not in monthDict:
+            raise ValueError('month param not recognized')
+
         if valueType in valueTypesList:
-            existsValue = self.readValue(month, valueType, year)
             date = dt.datetime.now()
 
             if not year:
                 year = date.year
 
-            if not existsValue:
-                ucReg = self.readUC()
-                ucID = ucReg[0]
+            table = 'demandas' if typeDict[valueType] == 'demanda' else 'consumos'
+            conflict = 'DO UPDATE SET valor = excluded.valor' if replace else 'DO NOTHING'
+
+            # UC, posto e verificação de valor repetido resolvidos numa única instrução atômica
+            with self.db.transaction() as cursor:
+                register = cursor.execute(
+                    f'''
+                    INSERT INTO {table} (uc_id, posto_id, mes, ano, valor, created_at)
+                    SELECT u.id, p.id, ?, ?, ?, ?
+                    FROM ucs u, posto p
+                    WHERE u.numero = ? AND p.descricao = ?
+                    ON CONFLICT (uc_id, posto_id, ano, mes) {conflict}
+                    RETURNING uc_id
+                    ''', (month, year, value, date, self.number, hourDict[valueType])
+                ).fetchone()
 
-                conn = sql.connect(dbName)
-                cursor = conn.cursor()
+                if not register:
+                    if not self._readUC(cursor):
+                        raise RuntimeError('UC not found')
+                    raise RuntimeError('This value is already registered. Please update it or leave it')
 
-                postoID = cursor.execute(
-                    '''
-                    SELECT id
-                    FROM posto_id
-                    WHERE descricao = ?
-                    ''', (hourDict[valueType], )
-                )
+                rollupModule.refresh(self.db, cursor, [(register[0], year, month)])
 
-                if typeDict[valueType] == 'demanda':
-                    cursor.execute(
-                        '''
-                        INSERT INTO demandas (uc_id, posto_id, mes, ano, valor, created_at)
-                        VALUES (?,?,?,?,?,?)
-                        ''', (ucID, postoID, month, year, value, date)
-                    )
+        return 0
+
+    @staticmethod
+    def createValues(rows, db = None) -> dict:
+        '''
+        This method registers many values of consumption or demand at once, for any number of UCs, in a single transaction.
+        Rows already registered are not inserted nor raise an error. They are reported in the returned conflicts list
 
-                else:
-                    cursor.execute(
-                        '''
-                        INSERT INTO consumos (uc_id, posto_id, mes, ano, valor, created_at)
-                        VALUES (?,?,?,?,?,?)
-                        ''', (ucID, postoID, month, year, value, date)
+        :param rows: An iterable of tuples (ucNumber, month, valueType, value, year), or a DataFrame with the columns
+            'number', 'month', 'valueType', 'value' and 'year'. If year is None, the current year will be considered
+        :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+        :return: dict with the keys:
+            - 'inserted': how many values were registered
+            - 'conflicts': a list of tuples (row index, row, reason). The reason can be 'valueType not recognized',
+              'month not recognized', 'UC not found', 'duplicated in batch' or 'already registered'
+        '''
+        db = connectionModule.resolve(db, dbName)
+        date = dt.datetime.now()
+
+        if hasattr(rows, 'itertuples'):
+            rows = rows[['number', 'month', 'valueType', 'value', 'year']].itertuples(index=False, name=None)
+
+        rows = list(rows)
+        conflicts = []
+        inserted = 0
+
+        with db.transaction() as cursor:
+            # posto e ids das UCs são resolvidos uma única vez para todo o lote
+            postos = dict(cursor.execute('SELECT descricao, id FROM posto').fetchall())
+
+            numbers = list({row[0] for row in rows})
+            ucIDs = {}
+            for start in range(0, len(numbers), 500):
+                chunk = numbers[start:start + 500]
+                ucIDs.update(cursor.execute(
+                    f'''
+                    SELECT numero, id
+                    FROM ucs
+                    WHERE numero IN ({','.join('?' * len(chunk))})
+                    ''', chunk
+                ).fetchall())
+
+            batch = []
+            seen = set()
+            for index, row in enumerate(rows):
+                number, month, valueType, value, year = row
+                # anos vazios vindos de um DataFrame chegam como NaN, que é diferente de si mesmo
+                year = int(year) if year and year == year else date.year
+
+                if valueType not in valueTypesList:
+                    conflicts.append((index, row, 'valueType not recognized'))
+                    continue
+
+                if month not in monthDict:
+                    conflicts.append((index, row, 'month not recognized'))
+                    continue
+
+                if number not in ucIDs:
+                    conflicts.append((index, row, 'UC not found'))
+                    continue
+
+                table = 'demandas' if typeDict[valueType] == 'demanda' else 'consumos'
+                key = (table, ucIDs[number], postos[hourDict[valueType]], month, year)
+
+                if key in seen:
+                    conflicts.append((index, row, 'duplicated in batch'))
+                    continue
+
+                seen.add(key)
+                batch.append((index,) + key + (value, date))
+
+            cursor.execute(
+                '''
+                CREATE TEMP TABLE IF NOT EXISTS carga_valores (
+                    linha INTEGER, tabela TEXT, uc_id INTEGER, posto_id INTEGER, mes TEXT, ano INTEGER, valor REAL, created_at TEXT
+                )
+                '''
+            )
+            cursor.execute('DELETE FROM carga_valores')
+            db.bulkInsert(cursor, 'carga_valores', batch)
+
+            for table in ('consumos', 'demandas'):
+                registered = cursor.execute(
+                    f'''
+                    SELECT c.linha
+                    FROM carga_valores c
+                    WHERE c.tabela = ? AND EXISTS (
+                        SELECT 1
+                        FROM {table} t
+                        WHERE t.uc_id = c.uc_id AND t.posto_id = c.posto_id AND t.mes = c.mes AND t.ano = c.ano
                     )
+                    ''', (table,)
+                ).fetchall()
 
-                conn.commit()
-                conn.close()
+                for (index,) in registered:
+                    conflicts.append((index, rows[index], 'already registered'))
 
-            else:
-                raise RuntimeError('This value is already registered. Please update it or leave it')
-        
-        return 0
+                cursor.executemany('DELETE FROM carga_valores WHERE linha = ?', registered)
+
+                cursor.execute(
+                    f'''
+                    INSERT INTO {table} (uc_id, posto_id, mes, ano, valor, created_at)
+                    SELECT uc_id, posto_id, mes, ano, valor, created_at
+                    FROM carga_valores
+                    WHERE tabela = ?
+                    ''', (table,)
+                )
+                inserted += cursor.rowcount
+
+            rollupModule.refresh(db, cursor, cursor.execute('SELECT DISTINCT uc_id, ano, mes FROM carga_valores').fetchall())
+
+            cursor.execute('DELETE FROM carga_valores')
+
+        conflicts.sort(key=lambda conflict: conflict[0])
+
+        return {'inserted': inserted, 'conflicts': conflicts}
 
 
     def readValue(self, month: str, valueType: str, year: int = None) -> int:
@@ -404,10 +761,10 @@ class uc:
             It accepts the following values: 'consumption', 'peak-consumption', 'off-peak-consumption', 'demand', 'peak-demand', 'off-peak-demand'
         '''
 
-        if valueType in valueTypesList:
-            conn = sql.connect(dbName)
-            cursor = conn.cursor()
+        return self._readValue(self.db.cursor(), month, valueType, year)
 
+    def _readValue(self, cursor, month: str, valueType: str, year: int = None):
+        if valueType in valueTypesList:
             date = dt.datetime.now()
 
             if not year:
@@ -416,18 +773,22 @@ class uc:
             if typeDict[valueType] == 'consumo':
                 value = cursor.execute(
                     '''
-                    SELECT *
-                    FROM consumos
-                    WHERE mes=?, ano=?
-                    ''', (month, year,)
+                    SELECT c.*
+                    FROM consumos c
+                    JOIN ucs u ON u.id = c.uc_id
+                    JOIN posto p ON p.id = c.posto_id
+                    WHERE u.numero=? AND p.descricao=? AND c.mes=? AND c.ano=?
+                    ''', (self.number, hourDict[valueType], month, year,)
                 ).fetchone()
             else:
                 value = cursor.execute(
                     '''
-                    SELECT *
-                    FROM demandas
-                    WHERE mes=?, ano=? 
-                    ''', (month, year,)
+                    SELECT d.*
+                    FROM demandas d
+                    JOIN ucs u ON u.id = d.uc_id
+                    JOIN posto p ON p.id = d.posto_id
+                    WHERE u.numero=? AND p.descricao=? AND d.mes=? AND d.ano=? 
+                    ''', (self.number, hourDict[valueType], month, year,)
                 ).fetchone()
 
             return value
@@ -437,9 +798,10 @@ class uc:
         
         
 
-    def updateValue(self, month, valueType) -> int:
+    def updateValue(self, month, valueType, value, year = None) -> int:
         '''
-        This method will update a register of consumption or demand for this UC for a specific month
+        This method will update a register of consumption or demand for this UC for a specific month.
+        It returns a RunTimeError if the value isn't registered, and returns 0 if everything runs ok
         valueType can be:
             1. consumption
             2. peak-consumption
@@ -447,12 +809,40 @@ class uc:
             4. demand
             5. peak-demand
             6. off-peak-demand
+        :param value: The new value
+        :param year: A reference year. If not filled, it'll be the current year
         '''
-        pass
+        if valueType not in valueTypesList:
+            raise TypeError('valueType param not recognized')
+        if month not in monthDict:
+            raise ValueError('month param not recognized')
+
+        if not year:
+            year = dt.datetime.now().year
+
+        table = 'demandas' if typeDict[valueType] == 'demanda' else 'consumos'
+
+        with self.db.transaction() as cursor:
+            register = cursor.execute(
+                f'''
+                UPDATE {table}
+                SET valor = ?
+                WHERE uc_id = (SELECT id FROM ucs WHERE numero = ?) AND posto_id = (SELECT id FROM posto WHERE descricao = ?) AND ano = ? AND mes = ?
+                RETURNING uc_id
+                ''', (value, self.number, hourDict[valueType], year, month)
+            ).fetchone()
+
+            if not register:
+                raise RuntimeError('This value is not registered. Please create it')
+
+            rollupModule.refresh(self.db, cursor, [(register[0], year, month)])
+
+        return 0
     
-    def deleteValue(self, month, valueType) -> int:
+    def deleteValue(self, month, valueType, year = None) -> int:
         '''
-        This method will delete a register of consumption or demand for this UC for a specific month
+        This method will delete a register of consumption or demand for this UC for a specific month.
+        It returns 0 if everything runs ok, even if the value wasn't registered
         valueType can be:
             1. consumption
             2. peak-consumption
@@ -460,8 +850,24 @@ class uc:
             4. demand
             5. peak-demand
             6. off-peak-demand
+        :param year: A reference year. If not filled, it'll be the current year
         '''
-        pass
+        if valueType not in valueTypesList:
+            raise TypeError('valueType param not recognized')
+
+        if not year:
+            year = dt.datetime.now().year
+
+        with self.db.transaction() as cursor:
+            register = self._readValue(cursor, month, valueType, year)
+
+            if register:
+                table = 'demandas' if typeDict[valueType] == 'demanda' else 'consumos'
+                cursor.execute(f'DELETE FROM {table} WHERE id = ?', (register[0],))
+
+                rollupModule.refresh(self.db, cursor, [(register[1], year, month)])
+
+        return 0
 
     '''
  ## ##   ### ##   ##  ###  ### ##            ### ###    ####   ###  ##    ####    ## ##   ###  ##  
@@ -473,7 +879,47 @@ class uc:
  ## ##   #### ##   ## ##   ### ##            ####       ####   ###  ##    ####    ## ##   ###  ##    
     '''
     
-    def monthlyCosts(self, month: str, year: int = None) -> float:
+    def history(self, years: list = None, fill: bool = True):
+        '''
+        This method returns the whole series of consumptions and demands of this UC, read in a single query.
+        It can be saved in a columnar archive with historyModule.exportHistory
+
+        Parameters
+        ----------
+
+        years : list
+            If filled, only these years are read
+
+        fill : bool
+            If True, the missing months between the first and the last month are added, with NaN values
+
+        return : DataFrame indexed by (numero, ano, mes), with one column for each type of valueTypesList
+        '''
+        import historyModule
+
+        return historyModule.history(ucNumbers=[self.number], years=years, fill=fill, db=self.db)
+
+    def optimizeDemand(self, months: int = 12, steps: int = 50) -> dict:
+        '''
+        This method finds the cheapest modality (Azul or Verde) and contracted demands of this UC for its last months of values.
+        Only A group UCs have contracted demand
+
+        Parameters
+        ----------
+
+        months : int
+            How many of the last months with values are considered
+
+        steps : int
+            How many candidates are tried for each contracted demand
+
+        return : dict with the current and the best contract, the savings and the cost curves. See demandModule.optimizeUC
+        '''
+        import demandModule
+
+        return demandModule.optimizeUC(self.number, months, steps, db=self.db)
+
+    def monthlyCosts(self, month: str, year: int = None, cached: bool = True) -> float:
         '''
         This method calculates the total cost for a reference month in this UC, disregarding taxes like ICMS, PIS/COFINS
 
@@ -486,103 +932,45 @@ class uc:
         year : int
             A reference year, like an integer. If the value is not filled, the function will consider the current year
 
+        cached : bool
+            If True, the prices come from the tariff repository, which keeps the whole tarifas table in memory.
+            If False, they are read with a single query by tariffModule.queryPrices, which is cheaper for a few lookups
+
         return : float
         '''
-        # verificar se as tarifas para o período existem no db
-        
-        peakDemand          = None
-        offPeakDemand       = None
-        demand              = None
-        peakConsumption     = None
-        offPeakConsumption  = None
-        consumption         = None
-        monthlyCosts        = None
-
-        tusd    = None
-        te      = None
-        
-        minDate = datetime(year, monthDict[month], 1)
-        if month == 'fev':
-            maxDate = datetime(year, monthDict[month], 28)
+        if not year:
+            year = dt.datetime.now().year
 
-        else:
-            maxDate = datetime(year, monthDict[month], 30)
+        minDate = dt.date(year, monthDict[month], 1)
+        maxDate = dt.date(year, monthDict[month], calendar.monthrange(year, monthDict[month])[1])
 
-        conn = sql.connect(dbName)
-        cursor = conn.cursor()
+        # as tarifas vêm do repositório em memória, carregado uma única vez por banco
+        if cached:
+            prices = tariffModule.getRepository(self.db).prices(self.utility, self.modality, self.subgroup, self.clientClass, minDate, maxDate)
+        else:
+            prices = tariffModule.queryPrices(self.db, self.utility, self.modality, self.subgroup, self.clientClass, minDate, maxDate)
 
-        # Baixa as tarifas filtradas por concessionaria, subgrupo, modalidade e classe
-        tariffs = cursor.execute(
-            '''
-            SELECT * 
-            FROM tarifas
-            WHERE concessionaria=?, modalidade=?, subgrupo=?, classe=?
-            ''', (self.utility, self.modality, self.subgroup, self.clientClass)
-        ).fetchall()
+        if not prices:
+            raise RuntimeError('Please, update the prices table for this utility')
 
-        conn.close()
+        cursor = self.db.cursor()
 
-        # Transforma as colunas de data em formato datetime
-        for item in tariffs:
-            tariffs[1] = dt.datetime.strptime(tariffs[1])
-            tariffs[2] = dt.datetime.strptime(tariffs[2])
+        if self.subgroup in bGroupList:
+            values = {'consumption': self._valueOf(cursor, month, 'consumption', year)}
 
-        # Transforma a a lista de tarifas em um dataframe e filtra pela data da REH
-        tariffs = pd.DataFrame(data=tariffs)
-        tariffs.query(f'inicio_vigencia <= {minDate} and fim_vigencia >= {maxDate}', inplace=True)
-        tariffs.reset_index(drop=True, inplace=True)
+        elif self.subgroup in aGroupList:
+            values = {valueType: self._valueOf(cursor, month, valueType, year) for valueType in valueTypesList if valueType != 'consumption'}
 
-        if not tariffs:
-            raise RuntimeError('Please, update the prices table for this utility')
-            return 0
-        
         else:
-            demandsPrice        = tariffs.query("unidade == 'R$/kW'")
-            consumptionsPrice   = tariffs.query("unidade == 'R$/MWh'")
-            
-            demandPrice         = demandsPrice.query("posto == 'Nao se aplica'")
-            demandPrice         = demandPrice.loc['0', 'tusd']
-            peakDemandPrice     = demandsPrice.query("posto == 'Ponta'")
-            peakDemandPrice     = peakDemandPrice.loc['0', 'tusd']
-            offPeakDemandPrice  = demandsPrice.query("posto == Fora ponta")
-            offPeakDemandPrice  = offPeakDemandPrice.loc['0', 'tusd']
-
-            consumptionPrice        = consumptionsPrice.query("posto == 'Nao se aplica'")
-            consumptionPrice        = consumptionPrice.loc['0', 'te'] + consumptionPrice.loc['0', 'tusd']
-            peakConsumptionPrice    = consumptionsPrice.query("posto == 'Ponta'")
-            peakConsumptionPrice    = peakConsumptionPrice.loc['0', 'te'] + peakConsumptionPrice.loc['0', 'tusd']
-            offPeakConsumptionPrice = consumptionsPrice.query("posto == 'Fora ponta'")
-            offPeakConsumptionPrice = offPeakConsumptionPrice.loc['0', 'te'] + offPeakConsumptionPrice.loc['0', 'tusd']
-            
-            if self.subgroup in bGroupList:
-                tusd    = tariffs.loc['0', 'tusd']
-                te      = tariffs.loc['0', 'te']
-
-                consumption = self.readValue(month, 'consumption', year)
-
-                monthlyCosts = consumption * (tusd + te) / 1000
-
-            elif self.subgroup in aGroupList:
-                peakConsumption     = self.readValue(month, 'peak-consumption', year)
-                offPeakConsumption  = self.readValue(month, 'off-peak-consumption', year)
-                
-                peakDemand      = self.readValue(month, 'peak-demand', year)
-                offPeakDemand   = self.readValue(month, 'off-peak-demand', year)
-                demand          = self.readValue(month, 'demand', year)
-
-                monthlyCosts = (
-                    peakConsumption * (peakConsumptionPrice / 1000) + 
-                    offPeakConsumption * (offPeakConsumptionPrice / 1000) +
-                    demand * demandPrice +
-                    peakDemand * peakDemandPrice +
-                    offPeakDemand * offPeakDemandPrice
-                )
+            raise RuntimeError('Subgroup not finded')
+        
+        return costOf(self.subgroup, values, prices)
 
-            else:
-                raise RuntimeError('Subgroup not finded')
-                return 0
-            
-            return monthlyCosts
+    def _valueOf(self, cursor, month: str, valueType: str, year: int) -> float:
+        # a coluna valor é a sexta do registro de consumos/demandas. Valores não cadastrados contam como zero
+        register = self._readValue(cursor, month, valueType, year)
+
+        return register[5] if register else 0
 
 
     def totalSavings(self, month: str, year: int = None) -> float:
@@ -600,34 +988,226 @@ class uc:
 
         return : float
         '''
+        import savingsModule
 
-        # Implementar tabela no db similar à tabela de consumos, porém com os custos com cooperativa ou acl
-        # Cooperativa, energia contratada, encargos
-        # Calcular a economia total no mes com base nessa tabela
-        # 'CRUDValue' deve servir para ler os valores de economia também
-        pass
+        # os custos com cooperativa ou ACL, energia contratada e encargos ficam na tabela lancamentos
+        savings = savingsModule.portfolioSavings(year or dt.datetime.now().year, [month], ucNumbers=[self.number], db=self.db)
+        if savings['missingTariff'].any():
+            raise RuntimeError('Please, update the prices table for this utility')
+
+        return float(savings['economia'].sum())
 
-    def createReport(self, period) -> str:
+    def createReport(self, period, path: str = None) -> str:
         '''
-            This method creates a saving report for the UC in a reference period
+            This method creates a saving report for the UC in a reference period. The report is written as it's calculated
+
+            :param period: A reference year, or a list of years
+            :param path: The archive of the report. The extension defines the format: '.csv', '.xlsx' or '.pdf'. If None, a csv named after the UC is created
+            :return: str, the path of the archive
         '''
-        pass
+        import reportModule
+
+        # um ano em texto ('2024') é um ano só, e não os seus dígitos
+        years = [int(period)] if isinstance(period, (int, str)) else [int(year) for year in period]
+        path = path or f'relatorio_{self.number}.csv'
+
+        rows = reportModule.reportRows(self.db, ucNumbers=[self.number], years=years)
+
+        return reportModule.writeReport(rows, path)
 
     def sendReport(self, archive) -> int:
         '''
-            This method sends an archive which must be a saving report
+            This method sends an archive which must be a saving report.
+            The message is put in the outbox and sent to the email of the client linked to the UC by the next outboxModule.deliver run
+
+            :param archive: The path of the report
+            :return: int, the id of the message in the outbox
         '''
-        pass
+        import outboxModule
+
+        register = self.db.cursor().execute(
+            '''
+            SELECT cl.email
+            FROM ucs u
+            JOIN clientes cl ON cl.id = u.client_id
+            WHERE u.numero = ?
+            ''', (self.number,)
+        ).fetchone()
+
+        if not register:
+            raise RuntimeError('This UC is not linked to a client')
+
+        return outboxModule.enqueue(register[0], f'Relatório de economia - UC {self.number}', 'Segue em anexo o relatório de economia.', archive, db=self.db)
 
     def linkClient(self, document) -> int:
         '''
             This method links the UC to a pre registered client.
             The client will be referenced by its document
         '''
-        pass
+        register = self.db.identity.lookup('clientes', document, lambda: self.db.cursor().execute(
+            '''
+            SELECT *
+            FROM clientes
+            WHERE cnpj = ?
+            ''', (document,)
+        ).fetchone())
+
+        if not register:
+            raise RuntimeError('Client not registered')
+
+        _linkUC(self.db, self.number, register[0])
+        self.client = register[1]
+
+        return 0
+
     def unlinkClient(self) -> int:
         '''
             This method unlinks the UC from a pre linked client. 
         '''
-        pass
-    
\ No newline at end of file
+        _linkUC(self.db, self.number, None)
+        self.client = None
+
+        return 0
+
+
+def _linkUC(db, ucNumber: str, clientID, currentClientID = None) -> None:
+    # o cliente da UC também fica em rollup_mensal, que é atualizado na mesma transação
+    with db.transaction() as cursor:
+        register = cursor.execute('SELECT id, client_id FROM ucs WHERE numero = ?', (ucNumber,)).fetchone()
+
+        if not register:
+            raise RuntimeError('UC not found')
+
+        if currentClientID is not None and register[1] != currentClientID:
+            raise RuntimeError('This UC is not linked to this client')
+
+        cursor.execute('UPDATE ucs SET client_id = ? WHERE id = ?', (clientID, register[0]))
+        cursor.execute('UPDATE rollup_mensal SET cliente_id = ? WHERE uc_id = ?', (clientID, register[0]))
+
+    db.identity.invalidate('ucs', ucNumber)
+
+
+class ucCollection:
+    '''
+    This class is the list of UCs linked to a client (client.ucList). Nothing is read until it's used:
+        - len, indexing, 'in' and numbers read every UC of the client in a single query, and keep them until invalidate
+        - iterating before that reads the UCs with a cursor, chunkSize at a time, without keeping them, for clients with many UCs
+        - prefetch reads the values of every UC for a period in one more query, which are then given by readings
+    '''
+    __slots__ = ('client', 'chunkSize', '_registers', '_readings')
+
+    def __init__(self, owner: client, chunkSize: int = 1000) -> None:
+        '''
+        Constructor of the class ucCollection
+
+        :param owner: The client whose UCs are listed
+        :param chunkSize: How many UCs are read at a time while iterating without loading
+        '''
+        self.client     = owner
+        self.chunkSize  = chunkSize
+        self._registers = None
+        self._readings  = {}
+
+    def _query(self, cursor):
+        return cursor.execute(
+            '''
+            SELECT u.*
+            FROM ucs u
+            JOIN clientes cl ON cl.id = u.client_id
+            WHERE cl.cnpj = ?
+            ORDER BY u.numero
+            ''', (self.client.cnpj,)
+        )
+
+    def _build(self, register) -> uc:
+        # os registros lidos aqui também servem ao readUC das UCs criadas
+        self.client.db.identity.put('ucs', register[1], register)
+
+        return uc(
+            register[2], register[1], self.client.name, register[4], register[5], register[6], register[7], register[8],
+            peakDemand=register[10], offPeakDemand=register[11], demand=register[9], db=self.client.db
+        )
+
+    def load(self) -> list:
+        '''
+        This method reads every UC of the client in a single query, if they weren't read yet
+
+        :return: list with the registers of the UCs, as in the ucs table
+        '''
+        if self._registers is None:
+            self._registers = self._query(self.client.db.cursor()).fetchall()
+
+        return self._registers
+
+    def invalidate(self) -> None:
+        '''
+        This method discards the UCs and values read. It must be called every time a UC is linked or unlinked
+        '''
+        self._registers = None
+        self._readings  = {}
+
+    def numbers(self) -> list:
+        return [register[1] for register in self.load()]
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._build(register) for register in self.load()[position]]
+
+        return self._build(self.load()[position])
+
+    def __contains__(self, item) -> bool:
+        number = item.number if isinstance(item, uc) else item
+
+        return any(register[1] == number for register in self.load())
+
+    def __iter__(self):
+        if self._registers is not None:
+            for register in self._registers:
+                yield self._build(register)
+            return
+
+        cursor = self.client.db.streamCursor(self.chunkSize)
+        try:
+            self._query(cursor)
+            while True:
+                registers = cursor.fetchmany(self.chunkSize)
+                if not registers:
+                    break
+
+                for register in registers:
+                    yield self._build(register)
+
+        # o cursor é fechado mesmo quando o laço de quem itera é interrompido
+        finally:
+            cursor.close()
+
+    def prefetch(self, years, months: list = None) -> dict:
+        '''
+        This method reads the values of every UC of the client for a period in a single query
+
+        :param years: A reference year or a list of years
+        :param months: A list of reference months. If None, all the months are considered
+
+        :return: dict {(ucNumber, year, month): {valueType: value}}
+        '''
+        import reportModule
+
+        register = self.client.readClient()
+        if not register:
+            raise RuntimeError('Client not registered')
+
+        years = [years] if isinstance(years, int) else list(years)
+        for (number, *_), year, month, values in reportModule.readMonths(self.client.db, clientID=register[0], years=years, months=months, chunkSize=self.chunkSize):
+            self._readings[(number, year, month)] = values
+
+        return self._readings
+
+    def readings(self, ucNumber: str, month: str, year: int) -> dict:
+        '''
+        This method returns the values read by prefetch of a UC in a month, as a dict {valueType: value}.
+        Months without values, or not prefetched, return an empty dict
+        '''
+        return self._readings.get((ucNumber, year, month), {})
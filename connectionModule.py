@@ -0,0 +1,317 @@
+import os
+import threading
+import sqlite3  as sql
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import cacheModule
+import schemaModule
+import backendModule
+
+defaultPragmas = {
+            'journal_mode':'WAL',
+            'synchronous':'NORMAL',
+            'foreign_keys':'ON',
+            'busy_timeout':5000,
+            'cache_size':-20000,
+            'temp_store':'MEMORY'
+        }
+
+_managers = {}
+_managersLock = threading.Lock()
+_wrapped = OrderedDict()
+wrappedSize = 64
+_workerDb = None
+_workerLocal = threading.local()
+
+
+class connectionManager:
+    '''
+    This class keeps the database connections used by clientsModule.
+    Each thread receives its own connection, which is opened once and reused by every call made from that thread
+    '''
+    def __init__(self, dbName: str, pragmas: dict = None, timeout: float = 30.0, identitySize: int = 10000, readOnly: bool = False) -> None:
+        '''
+        Constructor of the class connectionManager
+
+        :param dbName: The path of the sqlite database, or the URL of the database. See backendModule.fromUrl
+        :param pragmas: Pragmas applied to every new sqlite connection. They override the values of defaultPragmas
+        :param timeout: How many seconds a connection waits for a lock before raising an error
+        :param identitySize: How many clients and UCs the identity map keeps in memory while a session is open
+        :param readOnly: If True, the connections can't write, as the ones of services and workers that only read
+
+        :return: None
+        '''
+        self.dbName     = dbName
+        self.backend    = backendModule.fromUrl(dbName)
+        self.pragmas    = dict(defaultPragmas)
+        self.timeout    = timeout
+        self.readOnly   = readOnly
+        self.identity   = cacheModule.identityMap(identitySize)
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+        self._conns     = []
+
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+    @classmethod
+    def fromConnection(cls, conn: sql.Connection):
+        '''
+        This method wraps an already opened connection, so it can be passed wherever a connectionManager is expected.
+        The connection is shared by all threads, so it must have been opened with check_same_thread=False if used that way
+        '''
+        manager = cls(None)
+        manager._shared = conn
+        manager._conns.append(conn)
+
+        return manager
+
+    def _open(self):
+        return self.backend.connect(self.timeout, self.pragmas, self.readOnly)
+
+    def connection(self) -> sql.Connection:
+        '''
+        This method returns the connection of the current thread, opening it if needed
+        '''
+        shared = getattr(self, '_shared', None)
+        if shared is not None:
+            return shared
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+
+        return conn
+
+    def cursor(self) -> sql.Cursor:
+        '''
+        This method returns a new cursor over the connection of the current thread
+        '''
+        return self.connection().cursor()
+
+    def streamCursor(self, chunkSize: int = 1000):
+        '''
+        This method returns a new cursor over the connection of the current thread for reading many rows with fetchmany.
+        With PostgreSQL it's a server-side cursor, so only chunkSize rows at a time are sent to this process
+        '''
+        return self.backend.streamCursor(self.connection(), chunkSize)
+
+    def bulkInsert(self, cursor, table: str, rows, columns: list = None) -> None:
+        '''
+        This method inserts many rows in a table with the cursor of a transaction: with executemany in sqlite and with COPY in PostgreSQL
+
+        :param rows: An iterable of tuples, with the values of columns, or of every column of the table if columns is None
+        '''
+        self.backend.bulkInsert(cursor, table, rows, columns)
+
+    @contextmanager
+    def transaction(self):
+        '''
+        This method opens a transaction and yields a cursor. The transaction is commited when the block ends
+        and rolled back if any exception is raised. Nested calls become savepoints of the outer transaction
+
+        Usage
+        -----
+            with db.transaction() as cursor:
+                cursor.execute(...)
+        '''
+        conn = self.connection()
+        cursor = conn.cursor()
+        depth = getattr(self._local, 'depth', 0)
+
+        if depth == 0:
+            cursor.execute(self.backend.begin)
+        else:
+            cursor.execute(f'SAVEPOINT sp{depth}')
+
+        self._local.depth = depth + 1
+        try:
+            yield cursor
+
+        except BaseException:
+            if depth == 0:
+                cursor.execute('ROLLBACK')
+            else:
+                cursor.execute(f'ROLLBACK TO sp{depth}')
+                cursor.execute(f'RELEASE sp{depth}')
+            raise
+
+        else:
+            if depth == 0:
+                cursor.execute('COMMIT')
+            else:
+                cursor.execute(f'RELEASE sp{depth}')
+
+        finally:
+            self._local.depth = depth
+            cursor.close()
+
+    @contextmanager
+    def session(self):
+        '''
+        This method scopes the identity map to a job. The clients and UCs read inside the block are kept in memory and reused,
+        and they are all discarded when the block ends, so they never outlive writes made by other processes.
+        Sessions can be nested and opened by many threads, and the registers are kept until the last of them ends
+
+        Usage
+        -----
+            with db.session():
+                for row in rows:
+                    clientsModule.uc(..., db=db).createValue(...)
+        '''
+        self.identity.begin()
+        try:
+            yield self
+        finally:
+            self.identity.end()
+
+    def close(self) -> None:
+        '''
+        This method closes the connection of the current thread
+        '''
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._conns.remove(conn)
+            conn.close()
+
+    def connectionCount(self) -> int:
+        '''
+        This method returns how many connections this manager has open, in any thread
+        '''
+        with self._lock:
+            return len(self._conns)
+
+    def closeAll(self) -> None:
+        '''
+        This method closes every connection opened by this manager, in any thread
+        '''
+        with self._lock:
+            conns = self._conns
+            self._conns = []
+
+        self._local = threading.local()
+        for conn in conns:
+            # conexões de outras threads só podem ser fechadas por elas mesmas
+            try:
+                conn.close()
+            except sql.ProgrammingError:
+                pass
+
+
+def getManager(dbName: str, pragmas: dict = None) -> connectionManager:
+    '''
+    This function returns the shared connectionManager of a database, creating it on the first call.
+    When the manager is created, the database is created or upgraded to the last version of schemaModule
+
+    :param dbName: The path of the sqlite database, or the URL of the database. See backendModule.fromUrl
+    :param pragmas: Pragmas used only if the manager still doesn't exist
+
+    :return: connectionManager
+    '''
+    with _managersLock:
+        manager = _managers.get(dbName)
+        if manager is None:
+            manager = connectionManager(dbName, pragmas)
+            schemaModule.migrate(manager)
+            _managers[dbName] = manager
+
+    return manager
+
+
+def resolve(db, dbName: str) -> connectionManager:
+    '''
+    This function turns the optional db param of client and uc into a connectionManager.
+    It accepts None (shared manager of the database of AGV_DB_URL, or of dbName), a connectionManager or a sqlite3 connection.
+    The manager of a sqlite3 connection is kept for the next calls with the same connection, along with its tariff repository
+    '''
+    if db is None:
+        return getManager(backendModule.defaultDatabase(dbName))
+
+    if isinstance(db, sql.Connection):
+        # a conexão do sqlite3 não aceita referência fraca, então os gerenciadores das últimas conexões ficam num LRU pelo id,
+        # que não é reusado enquanto o gerenciador guardado mantém a conexão viva
+        with _managersLock:
+            manager = _wrapped.pop(id(db), None) or connectionManager.fromConnection(db)
+            _wrapped[id(db)] = manager
+            if len(_wrapped) > wrappedSize:
+                _wrapped.popitem(last=False)
+
+        return manager
+
+    return db
+
+
+def _startWorker(dbName: str) -> None:
+    # cada processo abre uma única conexão somente leitura, usada por todas as partes que ele calcular
+    global _workerDb
+
+    _workerDb = connectionManager(dbName, readOnly=True)
+
+
+def workerDb() -> connectionManager:
+    '''
+    This function returns the connectionManager of the functions run by a readOnlyPool
+    '''
+    return getattr(_workerLocal, 'db', None) or _workerDb
+
+
+class _serialPool:
+    '''
+    This class runs the functions given to a readOnlyPool in this process, with the connectionManager of the caller
+    '''
+    def __init__(self, db: connectionManager) -> None:
+        self.db = db
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        future = Future()
+        _workerLocal.db = self.db
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            _workerLocal.db = None
+
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> None:
+        pass
+
+
+def readOnlyPool(db: connectionManager, workers: int = None):
+    '''
+    This function returns a pool of processes for read-only work over a database. Each process opens a single read-only
+    connection, which the functions submitted get with workerDb. With workers=1, or a database that other processes can't
+    open (a connection wrapped by fromConnection or ':memory:'), the functions run in this process, with db itself
+
+    :param db: The connectionManager of the database read
+    :param workers: How many processes are used. If None, the number of CPUs
+
+    :return: ProcessPoolExecutor, or an object with the same submit that runs everything in this process
+
+    Usage
+    -----
+        def chunkCosts(ucIDs):
+            db = connectionModule.workerDb()
+            ...
+
+        with connectionModule.readOnlyPool(db, workers) as pool:
+            futures = [pool.submit(chunkCosts, chunk) for chunk in chunks]
+    '''
+    if workers == 1 or db.dbName in (None, ':memory:'):
+        return _serialPool(db)
+
+    # o multiprocessing só é importado por quem usa o pool, fora do caminho curto de clientsModule
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_startWorker, initargs=(db.dbName,))
@@ -0,0 +1,178 @@
+import calendar
+import datetime as dt
+
+import numpy    as np
+import pandas   as pd
+
+import connectionModule
+from clientsModule import dbName, monthDict, aGroupList, bGroupList, valueTypesList, valueTypeDict
+
+unitDict = {
+            'consumo':'R$/MWh',
+            'demanda':'R$/kW'
+        }
+
+
+def _periods(years, months) -> pd.DataFrame:
+    periods = []
+    for year in years:
+        for month in months:
+            lastDay = calendar.monthrange(year, monthDict[month])[1]
+            periods.append((month, year, dt.date(year, monthDict[month], 1), dt.date(year, monthDict[month], lastDay)))
+
+    periods = pd.DataFrame(periods, columns=['mes', 'ano', 'minDate', 'maxDate'])
+    periods['minDate'] = pd.to_datetime(periods['minDate'])
+    periods['maxDate'] = pd.to_datetime(periods['maxDate'])
+
+    return periods
+
+
+def _filters(utility, subgroups, ucNumbers) -> tuple:
+    clauses = []
+    params = []
+
+    if utility:
+        clauses.append('u.concessionaria = ?')
+        params.append(utility)
+
+    if subgroups:
+        clauses.append(f"u.subgrupo IN ({','.join('?' * len(subgroups))})")
+        params.extend(subgroups)
+
+    if ucNumbers:
+        clauses.append(f"u.numero IN ({','.join('?' * len(ucNumbers))})")
+        params.extend(ucNumbers)
+
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def readReadings(db, years: list, months: list, utility: str = None, subgroups: list = None, ucNumbers: list = None) -> pd.DataFrame:
+    '''
+    This function reads every consumption and demand of a period in a single query
+
+    :return: DataFrame with the columns numero, concessionaria, modalidade, subgrupo, classe, mes, ano, tipo, posto, valor
+    '''
+    filters, params = _filters(utility, subgroups, ucNumbers)
+    period = f"r.ano IN ({','.join('?' * len(years))}) AND r.mes IN ({','.join('?' * len(months))})"
+
+    query = ' UNION ALL '.join(
+        f'''
+        SELECT u.numero, u.concessionaria, u.modalidade, u.subgrupo, u.classe, r.mes, r.ano, '{tipo}' AS tipo, p.descricao AS posto, r.valor
+        FROM {table} r
+        JOIN ucs u ON u.id = r.uc_id
+        JOIN posto p ON p.id = r.posto_id
+        WHERE {period}{filters}
+        ''' for table, tipo in (('consumos', 'consumo'), ('demandas', 'demanda'))
+    )
+    params = (list(years) + list(months) + params) * 2
+
+    columns = ['numero', 'concessionaria', 'modalidade', 'subgrupo', 'classe', 'mes', 'ano', 'tipo', 'posto', 'valor']
+
+    return pd.DataFrame(db.cursor().execute(query, params).fetchall(), columns=columns)
+
+
+def readTariffs(db, minDate: dt.date, maxDate: dt.date, utility: str = None) -> pd.DataFrame:
+    '''
+    This function reads every tariff in force at any moment between two dates in a single query.
+    As in tariffModule, an empty fim_vigencia means the tariff is still in force
+
+    :return: DataFrame with the columns concessionaria, modalidade, subgrupo, classe, posto, unidade, inicio_vigencia, fim_vigencia, tusd, te.
+        The empty fim_vigencia are NaT
+    '''
+    # as datas podem ter sido gravadas com a hora, então só os dez primeiros caracteres são comparados
+    query = '''
+        SELECT concessionaria, modalidade, subgrupo, classe, posto, unidade, inicio_vigencia, fim_vigencia, tusd, te
+        FROM tarifas
+        WHERE substr(inicio_vigencia, 1, 10) <= ? AND (fim_vigencia IS NULL OR fim_vigencia = '' OR substr(fim_vigencia, 1, 10) >= ?)
+    '''
+    params = [maxDate.isoformat(), minDate.isoformat()]
+
+    if utility:
+        query += ' AND concessionaria = ?'
+        params.append(utility)
+
+    columns = ['concessionaria', 'modalidade', 'subgrupo', 'classe', 'posto', 'unidade', 'inicio_vigencia', 'fim_vigencia', 'tusd', 'te']
+    tariffs = pd.DataFrame(db.cursor().execute(query, params).fetchall(), columns=columns)
+
+    tariffs['inicio_vigencia'] = pd.to_datetime(tariffs['inicio_vigencia'].str[:10])
+    # fim_vigencia vazio vira NaT, o mesmo de NULL
+    tariffs['fim_vigencia'] = pd.to_datetime(tariffs['fim_vigencia'].str[:10])
+    tariffs[['tusd', 'te']] = tariffs[['tusd', 'te']].fillna(0)
+
+    return tariffs
+
+
+def priceReadings(readings: pd.DataFrame, tariffs: pd.DataFrame, periods: pd.DataFrame) -> pd.DataFrame:
+    '''
+    This function joins readings with the tariff in force on the first day of their reference month, the version with the latest start,
+    as tariffModule does, and prices every row whose tariff covers the whole month, with the same rules of uc.monthlyCosts:
+        - B group: consumption * (tusd + te) / 1000
+        - A group: peak and off-peak consumption * (tusd + te) / 1000 plus every demand * tusd
+
+    :return: The readings with the columns valueType and custo. Rows without tariff have custo NaN
+    '''
+    readings = readings.copy()
+    readings['valueType'] = [valueTypeDict[key] for key in zip(readings['tipo'], readings['posto'])]
+    readings['unidade'] = readings['tipo'].map(unitDict)
+
+    isBGroup = readings['subgrupo'].isin(bGroupList) & (readings['valueType'] == 'consumption')
+    isAGroup = readings['subgrupo'].isin(aGroupList) & (readings['valueType'] != 'consumption')
+    readings = readings[isBGroup | isAGroup]
+
+    readings = readings.merge(periods, on=['mes', 'ano'])
+    readings = readings.reset_index(drop=True)
+    readings['linha'] = readings.index
+
+    keys = ['concessionaria', 'modalidade', 'subgrupo', 'classe', 'posto', 'unidade']
+    priced = readings.merge(tariffs, on=keys)
+    priced = priced[priced['inicio_vigencia'] <= priced['minDate']]
+    priced = priced.sort_values('inicio_vigencia', kind='stable').drop_duplicates('linha', keep='last')
+    priced = priced[priced['fim_vigencia'].isna() | (priced['fim_vigencia'] >= priced['maxDate'])].set_index('linha')
+
+    readings['tusd'] = priced['tusd']
+    readings['te'] = priced['te']
+    readings['custo'] = np.where(
+        readings['unidade'] == 'R$/MWh',
+        readings['valor'] * (readings['tusd'] + readings['te']) / 1000,
+        readings['valor'] * readings['tusd']
+    )
+
+    return readings.drop(columns=['minDate', 'maxDate', 'linha'])
+
+
+def portfolioCosts(year, months: list = None, utility: str = None, subgroups: list = None, ucNumbers: list = None, db = None) -> pd.DataFrame:
+    '''
+    This function calculates the monthly costs of a whole portfolio, disregarding taxes like ICMS, PIS/COFINS.
+    Readings and tariffs are read with one query each and priced as whole columns, instead of calling uc.monthlyCosts for every UC
+
+    :param year: A reference year or a list of years
+    :param months: A list of reference months, in the pattern of monthDict. If None, all the months are considered
+    :param utility: If filled, only the UCs of this utility are considered
+    :param subgroups: If filled, only the UCs of these subgroups are considered
+    :param ucNumbers: If filled, only these UCs are considered. It accepts a list of numbers or a portfolioModule.ucColumns,
+        such as ucColumns.load(db=db).filter(aGroupList, ['Azul', 'Verde']), whose UCs are the ones considered
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: DataFrame indexed by (numero, ano, mes), with the cost of each value type, the column total and the column
+        missingTariff, which is True when some reading of the month had no tariff to be priced with
+    '''
+    db = connectionModule.resolve(db, dbName)
+    years = [year] if isinstance(year, int) else list(year)
+    months = list(months or monthDict)
+
+    # uma coleção vazia não seleciona nenhuma UC, e não todas
+    if hasattr(ucNumbers, 'numbers'):
+        ucNumbers = ucNumbers.numbers.tolist() or [None]
+
+    periods = _periods(years, months)
+    readings = readReadings(db, years, months, utility, subgroups, ucNumbers)
+    tariffs = readTariffs(db, periods['minDate'].min().date(), periods['maxDate'].max().date(), utility)
+
+    readings = priceReadings(readings, tariffs, periods)
+
+    costs = readings.pivot_table(index=['numero', 'ano', 'mes'], columns='valueType', values='custo', aggfunc='sum')
+    costs = costs.reindex(columns=[valueType for valueType in valueTypesList if valueType in costs.columns])
+    costs['total'] = costs.sum(axis=1)
+    costs['missingTariff'] = readings['custo'].isna().groupby([readings['numero'], readings['ano'], readings['mes']]).any()
+
+    return costs
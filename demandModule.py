@@ -0,0 +1,284 @@
+'''
+Optimizer of the contracted demands of A group UCs. For each UC, a grid of candidates is priced against its last months of values:
+    - Verde: one contracted demand, charged by the tusd of 'Nao se aplica'
+    - Azul: a peak and an off-peak contracted demand, charged by the tusd of 'Ponta' and 'Fora ponta'
+The billed demand of a month is the largest between the measured and the contracted one. When the measured demand passes the
+contracted one by more than the tolerance, the difference is also charged penalty times (ultrapassagem).
+The consumptions of each modality are added, so Azul and Verde can be compared. Taxes like ICMS, PIS/COFINS are disregarded
+'''
+import calendar
+import datetime as dt
+from concurrent.futures import as_completed
+
+import numpy    as np
+import pandas   as pd
+
+import connectionModule
+import tariffModule
+import historyModule
+from clientsModule import dbName, monthDict, aGroupList
+
+# menor demanda contratada aceita para UCs do grupo A, em kW
+minDemand = 30
+
+contractModalities = ['Verde', 'Azul']
+
+
+def grid(measured: np.ndarray, current: float = None, steps: int = 50) -> np.ndarray:
+    '''
+    This function returns the candidate demands of a series of measured demands: steps whole kW values between half and one and
+    a half times the largest measured demand, never below minDemand, plus the current contracted demand
+    '''
+    largest = np.nanmax(measured) if np.isfinite(measured).any() else minDemand
+    candidates = np.round(np.linspace(max(minDemand, 0.5 * largest), max(minDemand, 1.5 * largest), steps))
+
+    if current is not None and np.isfinite(current):
+        candidates = np.append(candidates, current)
+
+    return np.unique(candidates)
+
+
+def demandCosts(measured: np.ndarray, tusd: np.ndarray, candidates: np.ndarray, tolerance: float = 0.05, penalty: float = 2) -> np.ndarray:
+    '''
+    This function prices every candidate contracted demand against every month at once
+
+    :param measured: The measured demands, one per month. NaN counts as 0
+    :param tusd: The tusd in R$/kW of each month
+    :param candidates: The candidate contracted demands
+
+    :return: array with the total cost of the months for each candidate
+    '''
+    measured = np.nan_to_num(measured)[:, None]
+    contracted = candidates[None, :]
+
+    billed = np.maximum(measured, contracted)
+    overrun = np.where(measured > contracted * (1 + tolerance), measured - contracted, 0)
+
+    return (tusd[:, None] * (billed + penalty * overrun)).sum(axis=0)
+
+
+def _tariffs(repository, utility: str, modality: str, subgroup: str, clientClass: str, periods: list) -> dict:
+    # tarifas de cada mês em arrays. Meses sem tarifa ficam NaN e tornam a modalidade inviável
+    arrays = {name: np.full(len(periods), np.nan) for name in ('demanda', 'demandaPonta', 'demandaForaPonta', 'consumoPonta', 'consumoForaPonta')}
+
+    for position, (year, month) in enumerate(periods):
+        minDate = dt.date(year, monthDict[month], 1)
+        maxDate = dt.date(year, monthDict[month], calendar.monthrange(year, monthDict[month])[1])
+        prices = repository.prices(utility, modality, subgroup, clientClass, minDate, maxDate)
+
+        for name, posto, unit in (('demanda', 'Nao se aplica', 'R$/kW'), ('demandaPonta', 'Ponta', 'R$/kW'), ('demandaForaPonta', 'Fora ponta', 'R$/kW'),
+                                  ('consumoPonta', 'Ponta', 'R$/MWh'), ('consumoForaPonta', 'Fora ponta', 'R$/MWh')):
+            if (posto, unit) in prices:
+                tusd, te = prices[(posto, unit)]
+                arrays[name][position] = tusd if unit == 'R$/kW' else (tusd + te) / 1000
+
+    return arrays
+
+
+def optimizeValues(values: pd.DataFrame, tariffs: dict, current: dict = None, steps: int = 50, tolerance: float = 0.05, penalty: float = 2) -> dict:
+    '''
+    This function finds the cheapest modality and contracted demands for a series of months of one UC
+
+    :param values: DataFrame with one row per month and the columns of valueTypesList, like historyModule.history
+    :param tariffs: dict {modality: arrays of the tariffs of each month}, for the modalities of contractModalities
+    :param current: dict with the current 'modalidade', 'demanda', 'demandaPonta' and 'demandaForaPonta'. If None, the current cost isn't calculated
+    :param steps: How many candidates are tried for each contracted demand
+
+    :return: dict with:
+        - 'atual' and 'melhor': dicts with 'modalidade', 'demanda', 'demandaPonta', 'demandaForaPonta' and 'custo'
+        - 'economia': the cost of 'atual' minus the cost of 'melhor'
+        - 'curvas': {'Verde': {'demandas', 'custos'}, 'Azul': {'demandasPonta', 'demandasForaPonta', 'custos' (peak x off-peak)}}
+    '''
+    column = lambda valueType: values[valueType].to_numpy(dtype=np.float64)
+    peakDemand = np.where(np.isnan(column('peak-demand')), column('demand'), column('peak-demand'))
+    offPeakDemand = np.where(np.isnan(column('off-peak-demand')), column('demand'), column('off-peak-demand'))
+    demand = np.where(np.isnan(column('demand')), np.fmax(column('peak-demand'), column('off-peak-demand')), column('demand'))
+    peakConsumption = np.nan_to_num(column('peak-consumption'))
+    offPeakConsumption = np.nan_to_num(column('off-peak-consumption'))
+
+    current = current or {}
+    curves = {}
+    options = []
+
+    def consumption(arrays):
+        return (peakConsumption * arrays['consumoPonta'] + offPeakConsumption * arrays['consumoForaPonta']).sum()
+
+    verde = tariffs.get('Verde')
+    if verde is not None:
+        candidates = grid(demand, current.get('demanda') if current.get('modalidade') == 'Verde' else None, steps)
+        costs = demandCosts(demand, verde['demanda'], candidates, tolerance, penalty) + consumption(verde)
+        curves['Verde'] = {'demandas': candidates, 'custos': costs}
+
+        if np.isfinite(costs).any():
+            best = int(np.nanargmin(costs))
+            options.append({'modalidade': 'Verde', 'demanda': float(candidates[best]), 'demandaPonta': None, 'demandaForaPonta': None, 'custo': float(costs[best])})
+
+    azul = tariffs.get('Azul')
+    if azul is not None:
+        isAzul = current.get('modalidade') == 'Azul'
+        peakCandidates = grid(peakDemand, current.get('demandaPonta') if isAzul else None, steps)
+        offPeakCandidates = grid(offPeakDemand, current.get('demandaForaPonta') if isAzul else None, steps)
+
+        # ponta e fora ponta são independentes, então a grade inteira é a soma externa das duas curvas
+        costs = (demandCosts(peakDemand, azul['demandaPonta'], peakCandidates, tolerance, penalty)[:, None]
+                 + demandCosts(offPeakDemand, azul['demandaForaPonta'], offPeakCandidates, tolerance, penalty)[None, :]
+                 + consumption(azul))
+        curves['Azul'] = {'demandasPonta': peakCandidates, 'demandasForaPonta': offPeakCandidates, 'custos': costs}
+
+        if np.isfinite(costs).any():
+            peak, offPeak = np.unravel_index(int(np.nanargmin(costs)), costs.shape)
+            options.append({'modalidade': 'Azul', 'demanda': None, 'demandaPonta': float(peakCandidates[peak]),
+                            'demandaForaPonta': float(offPeakCandidates[offPeak]), 'custo': float(costs[peak, offPeak])})
+
+    best = min(options, key=lambda option: option['custo']) if options else None
+
+    actual = None
+    modality = current.get('modalidade')
+    if modality == 'Verde' and 'Verde' in curves and current.get('demanda') is not None:
+        curve = curves['Verde']
+        cost = curve['custos'][np.searchsorted(curve['demandas'], current['demanda'])]
+        actual = {'modalidade': 'Verde', 'demanda': current['demanda'], 'demandaPonta': None, 'demandaForaPonta': None, 'custo': float(cost)}
+
+    elif modality == 'Azul' and 'Azul' in curves and current.get('demandaPonta') is not None and current.get('demandaForaPonta') is not None:
+        curve = curves['Azul']
+        cost = curve['custos'][np.searchsorted(curve['demandasPonta'], current['demandaPonta']), np.searchsorted(curve['demandasForaPonta'], current['demandaForaPonta'])]
+        actual = {'modalidade': 'Azul', 'demanda': None, 'demandaPonta': current['demandaPonta'], 'demandaForaPonta': current['demandaForaPonta'], 'custo': float(cost)}
+
+    savings = actual['custo'] - best['custo'] if actual and best and np.isfinite(actual['custo']) else None
+
+    return {'atual': actual, 'melhor': best, 'economia': savings, 'curvas': curves}
+
+
+def _registers(db, ucNumbers: list) -> dict:
+    registers = {}
+    for start in range(0, len(ucNumbers), 500):
+        chunk = ucNumbers[start:start + 500]
+        rows = db.cursor().execute(
+            f'''
+            SELECT numero, concessionaria, modalidade, subgrupo, classe, demanda, demanda_ponta, demanda_fora_ponta
+            FROM ucs
+            WHERE numero IN ({','.join('?' * len(chunk))})
+            ''', chunk
+        )
+        registers.update((row[0], row[1:]) for row in rows)
+
+    return registers
+
+
+def _optimize(db, ucNumbers: list, months: int, steps: int, tolerance: float, penalty: float) -> dict:
+    # valores de todas as UCs lidos numa consulta só. Cada UC usa os seus últimos months meses
+    registers = _registers(db, ucNumbers)
+    history = historyModule.widen(historyModule.readHistory(db, ucNumbers=list(registers)), fill=False)
+    repository = tariffModule.getRepository(db)
+
+    results = {}
+    for number, values in history.groupby(level='numero', sort=False):
+        utility, modality, subgroup, clientClass, demand, peakDemand, offPeakDemand = registers[number]
+        if subgroup not in aGroupList:
+            continue
+
+        values = values.iloc[-months:]
+        periods = [(year, month) for _, year, month in values.index]
+        tariffs = {option: _tariffs(repository, utility, option, subgroup, clientClass, periods) for option in contractModalities}
+        current = {'modalidade': modality, 'demanda': demand, 'demandaPonta': peakDemand, 'demandaForaPonta': offPeakDemand}
+
+        result = optimizeValues(values, tariffs, current, steps, tolerance, penalty)
+        result['meses'] = periods
+        results[number] = result
+
+    return results
+
+
+def optimizeUC(ucNumber: str, months: int = 12, steps: int = 50, tolerance: float = 0.05, penalty: float = 2, db = None) -> dict:
+    '''
+    This function finds the cheapest modality and contracted demands of an A group UC for its last months of values
+
+    :param ucNumber: The number of the UC
+    :param months: How many of the last months with values are considered
+    :param steps: How many candidates are tried for each contracted demand
+    :param tolerance: How much the measured demand can pass the contracted one without penalty. 0.05 is 5%
+    :param penalty: How many times the tusd is charged over the demand that passes the contracted one
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict like optimizeValues, plus 'meses', the list of (year, month) considered
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    register = _registers(db, [ucNumber]).get(ucNumber)
+    if not register:
+        raise RuntimeError('UC not found')
+    if register[2] not in aGroupList:
+        raise RuntimeError('Only A group UCs have contracted demand')
+
+    results = _optimize(db, [ucNumber], months, steps, tolerance, penalty)
+    if ucNumber not in results:
+        raise RuntimeError('There are no values for this UC')
+
+    return results[ucNumber]
+
+
+def _optimizeChunk(ucNumbers: list, months: int, steps: int, tolerance: float, penalty: float) -> list:
+    results = _optimize(connectionModule.workerDb(), ucNumbers, months, steps, tolerance, penalty)
+
+    # as curvas ficam no processo: só o resumo de cada UC volta
+    return [_summary(number, result) for number, result in results.items()]
+
+
+def _summary(number: str, result: dict) -> dict:
+    actual = result['atual'] or {}
+    best = result['melhor'] or {}
+
+    return {
+        'numero': number,
+        'modalidadeAtual': actual.get('modalidade'),
+        'custoAtual': actual.get('custo'),
+        'modalidade': best.get('modalidade'),
+        'demanda': best.get('demanda'),
+        'demandaPonta': best.get('demandaPonta'),
+        'demandaForaPonta': best.get('demandaForaPonta'),
+        'custo': best.get('custo'),
+        'economia': result['economia']
+    }
+
+
+def optimizePortfolio(ucNumbers: list = None, utility: str = None, months: int = 12, steps: int = 50, tolerance: float = 0.05,
+                      penalty: float = 2, workers: int = None, chunkSize: int = 100, db = None) -> pd.DataFrame:
+    '''
+    This function runs optimizeUC for every A group UC of a portfolio. The UCs are split in chunks and optimized by a pool
+    of processes, each one with its own read-only connection. With workers=1, or a database that other processes can't open,
+    everything runs in this process. See connectionModule.readOnlyPool
+
+    :param ucNumbers: If filled, only these UCs are optimized
+    :param utility: If filled, only the UCs of this utility are optimized
+    :param workers: How many processes are used. If None, the number of CPUs
+    :param chunkSize: How many UCs each process optimizes at a time
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: DataFrame indexed by numero with the columns modalidadeAtual, custoAtual, modalidade, demanda, demandaPonta,
+        demandaForaPonta, custo and economia, sorted by economia
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    query = f"SELECT numero FROM ucs WHERE subgrupo IN ({','.join('?' * len(aGroupList))})"
+    params = list(aGroupList)
+    if utility:
+        query += ' AND concessionaria = ?'
+        params.append(utility)
+
+    numbers = [number for (number,) in db.cursor().execute(query + ' ORDER BY numero', params)]
+    if ucNumbers:
+        selected = set(ucNumbers)
+        numbers = [number for number in numbers if number in selected]
+
+    chunks = [numbers[position:position + chunkSize] for position in range(0, len(numbers), chunkSize)]
+    rows = []
+
+    if chunks:
+        with connectionModule.readOnlyPool(db, workers) as pool:
+            futures = [pool.submit(_optimizeChunk, chunk, months, steps, tolerance, penalty) for chunk in chunks]
+            for future in as_completed(futures):
+                rows.extend(future.result())
+
+    columns = ['numero', 'modalidadeAtual', 'custoAtual', 'modalidade', 'demanda', 'demandaPonta', 'demandaForaPonta', 'custo', 'economia']
+
+    return pd.DataFrame(rows, columns=columns).set_index('numero').sort_values('economia', ascending=False)
@@ -0,0 +1,154 @@
+'''
+History of the consumptions and demands of UCs, as wide frames with one row per UC month and one column per value type.
+A history can be exported to a columnar archive, so analytics jobs read the past months without going to sqlite:
+    - '.parquet': a Parquet archive, which needs pyarrow
+    - any other path: a folder of NumPy arrays (.npy), which loadArrays opens as memory maps
+'''
+import os
+import json
+
+import numpy    as np
+import pandas   as pd
+
+import connectionModule
+import reportModule
+from clientsModule import dbName, monthDict, valueTypesList, valueTypeDict
+
+monthNames = list(monthDict)
+
+
+def readHistory(db, ucNumbers: list = None, clientID: int = None, years: list = None) -> pd.DataFrame:
+    '''
+    This function reads every consumption and demand of some UCs in a single query
+
+    :return: DataFrame with the columns numero, ano, mes, valueType, valor
+    '''
+    filters, params = reportModule._filters(clientID, ucNumbers, years, None)
+
+    query = ' UNION ALL '.join(
+        f'''
+        SELECT u.numero, r.ano, r.mes, '{tipo}', p.descricao, r.valor
+        FROM {table} r
+        JOIN ucs u ON u.id = r.uc_id
+        JOIN posto p ON p.id = r.posto_id
+        WHERE 1 = 1{filters}
+        ''' for table, tipo in (('consumos', 'consumo'), ('demandas', 'demanda'))
+    )
+
+    rows = db.cursor().execute(query, params * 2).fetchall()
+
+    return pd.DataFrame(
+        [(number, year, month, valueTypeDict[(tipo, posto)], value) for number, year, month, tipo, posto, value in rows],
+        columns=['numero', 'ano', 'mes', 'valueType', 'valor']
+    )
+
+
+def widen(readings: pd.DataFrame, fill: bool = True) -> pd.DataFrame:
+    '''
+    This function turns the readings of readHistory into the wide frame of history
+
+    :param fill: If True, the missing months between the first and the last month of each UC are added, with NaN values
+    '''
+    # cada mês vira um número contínuo (ano * 12 + mês - 1), para ordenar e preencher os meses que faltam
+    readings = readings.assign(periodo=readings['ano'] * 12 + readings['mes'].map(monthDict) - 1)
+    wide = readings.pivot_table(index=['numero', 'periodo'], columns='valueType', values='valor', aggfunc='sum')
+    wide = wide.reindex(columns=valueTypesList)
+
+    if fill and not wide.empty:
+        bounds = readings.groupby('numero')['periodo'].agg(['min', 'max'])
+        index = pd.MultiIndex.from_tuples(
+            [(number, period) for number, first, last in bounds.itertuples() for period in range(first, last + 1)],
+            names=['numero', 'periodo']
+        )
+        wide = wide.reindex(index)
+
+    numbers = wide.index.get_level_values('numero')
+    periods = np.asarray(wide.index.get_level_values('periodo'), dtype=np.int64)
+    wide.index = pd.MultiIndex.from_arrays(
+        [numbers, periods // 12, np.array(monthNames, dtype=object)[periods % 12]], names=['numero', 'ano', 'mes']
+    )
+    wide.columns.name = None
+
+    return wide
+
+
+def history(ucNumbers: list = None, cnpj: str = None, years: list = None, fill: bool = True, db = None) -> pd.DataFrame:
+    '''
+    This function returns the whole series of consumptions and demands of UCs, read in a single query
+
+    :param ucNumbers: If filled, only these UCs are read
+    :param cnpj: If filled, only the UCs linked to this client are read
+    :param years: If filled, only these years are read
+    :param fill: If True, the missing months between the first and the last month of each UC are added, with NaN values
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: DataFrame indexed by (numero, ano, mes), in chronological order, with one column for each type of valueTypesList
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    clientID = None
+    if cnpj is not None:
+        register = db.cursor().execute('SELECT id FROM clientes WHERE cnpj = ?', (cnpj,)).fetchone()
+        if not register:
+            raise RuntimeError('Client not registered')
+        clientID = register[0]
+
+    return widen(readHistory(db, ucNumbers, clientID, years), fill)
+
+
+def exportHistory(frame: pd.DataFrame, path: str) -> str:
+    '''
+    This function saves a history in a columnar archive. The format comes from the path:
+        - '.parquet': a Parquet archive, which needs pyarrow
+        - any other path: a folder with the arrays numeros.npy, anos.npy, meses.npy and valores.npy (months x value types)
+          and colunas.json
+
+    :return: The path of the archive
+    '''
+    if path.lower().endswith('.parquet'):
+        frame.reset_index().to_parquet(path, index=False)
+        return path
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'numeros.npy'), np.asarray(frame.index.get_level_values('numero'), dtype=str))
+    np.save(os.path.join(path, 'anos.npy'), np.asarray(frame.index.get_level_values('ano'), dtype=np.int32))
+    np.save(os.path.join(path, 'meses.npy'), np.asarray(frame.index.get_level_values('mes').map(monthDict), dtype=np.int8))
+    np.save(os.path.join(path, 'valores.npy'), frame.to_numpy(dtype=np.float64))
+
+    with open(os.path.join(path, 'colunas.json'), 'w') as archive:
+        json.dump(list(frame.columns), archive)
+
+    return path
+
+
+def loadArrays(path: str, mmap: bool = True) -> dict:
+    '''
+    This function opens a folder saved by exportHistory without copying it into memory
+
+    :param mmap: If True, the arrays are memory maps, read from the disk only as they are used
+
+    :return: dict with the arrays 'numeros', 'anos', 'meses' (1 to 12), 'valores' (months x value types) and the list 'colunas'
+    '''
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in ('numeros', 'anos', 'meses', 'valores')}
+
+    with open(os.path.join(path, 'colunas.json')) as archive:
+        arrays['colunas'] = json.load(archive)
+
+    return arrays
+
+
+def loadHistory(path: str) -> pd.DataFrame:
+    '''
+    This function reads an archive saved by exportHistory back into the frame of history
+    '''
+    if path.lower().endswith('.parquet'):
+        return pd.read_parquet(path).set_index(['numero', 'ano', 'mes'])
+
+    arrays = loadArrays(path)
+    index = pd.MultiIndex.from_arrays(
+        [arrays['numeros'].astype(object), np.asarray(arrays['anos'], dtype=np.int64), np.array(monthNames, dtype=object)[arrays['meses'] - 1]],
+        names=['numero', 'ano', 'mes']
+    )
+
+    return pd.DataFrame(np.asarray(arrays['valores']), index=index, columns=arrays['colunas'])
@@ -0,0 +1,306 @@
+'''
+Instrumentation of the database accesses of clientsModule and the modules around it.
+While disabled, connectionModule opens plain sqlite3 connections and nothing here runs. After enable, the connections opened
+from then on record, for every statement, how many times it ran, how long it took, how many rows it returned or changed
+and which function called it. Connections opened before enable aren't instrumented; call closeAll of the manager to reopen them.
+The statements are recorded as given by normalize, and only the first maxStatements of them; reset clears what was recorded
+Usage
+-----
+    instrumentModule.enable(slowQuery=0.05)
+    ...
+    for line in instrumentModule.report(top=10):
+        print(line)
+'''
+import os
+import re
+import sys
+import time
+import logging
+import threading
+import sqlite3  as sql
+from collections import deque
+
+logger = logging.getLogger('instrumentModule')
+
+# limites superiores, em segundos, das faixas dos histogramas. A última faixa recebe o que passar do último limite
+bucketList = [
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1
+]
+
+# quantas consultas diferentes são guardadas. As que passarem disso são somadas em otherStatements
+maxStatements = 1000
+otherStatements = '(other statements)'
+
+# listas de placeholders e de linhas de VALUES de tamanho variável viram uma só consulta
+_placeholders = re.compile(r'\?(?:\s*,\s*\?)+')
+_valueRows = re.compile(r'(VALUES\s*)(\((?:\?|\?, \.\.\.)\))(?:\s*,\s*\((?:\?|\?, \.\.\.)\))+', re.I)
+
+# módulos que não são quem chamou a consulta, e sim o caminho até ela
+_skipModules = {__name__, 'connectionModule', 'contextlib'}
+
+_lock = threading.Lock()
+_enabled = False
+_settings = {'slowQuery': None, 'trace': False}
+_stats = {}
+_connections = {'opened': 0}
+_slowLog = deque(maxlen=1000)
+
+
+def _caller() -> str:
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in _skipModules:
+        frame = frame.f_back
+
+    if frame is None:
+        return '?'
+
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def normalize(query: str) -> str:
+    '''
+    This function returns the statement under which a query is recorded: without the line breaks and the indentation of
+    multiline strings, and with the lists of placeholders, like the ones of IN (?,?,?) and VALUES (?,?),(?,?), written as ?, ...
+    '''
+    statement = _placeholders.sub('?, ...', ' '.join(query.split()))
+
+    return _valueRows.sub(r'\1\2, ...', statement)
+
+
+def _entry(query: str) -> dict:
+    statement = normalize(query)
+    if statement not in _stats and len(_stats) >= maxStatements:
+        statement = otherStatements
+
+    entry = _stats.get(statement)
+    if entry is None:
+        entry = _stats[statement] = {
+            'calls': 0,
+            'rows': 0,
+            'seconds': 0.0,
+            'fetchSeconds': 0.0,
+            'maxSeconds': 0.0,
+            'histogram': [0] * (len(bucketList) + 1),
+            'callers': {}
+        }
+
+    return entry
+
+
+def _record(query: str, elapsed: float, changed: int, calls: int = 1) -> dict:
+    caller = _caller()
+
+    with _lock:
+        entry = _entry(query)
+        entry['calls'] += calls
+        entry['seconds'] += elapsed
+        entry['maxSeconds'] = max(entry['maxSeconds'], elapsed)
+        entry['callers'][caller] = entry['callers'].get(caller, 0) + calls
+        if changed > 0:
+            entry['rows'] += changed
+
+        position = 0
+        while position < len(bucketList) and elapsed > bucketList[position]:
+            position += 1
+        entry['histogram'][position] += 1
+
+    slowQuery = _settings['slowQuery']
+    if slowQuery is not None and elapsed >= slowQuery:
+        register = {'sql': ' '.join(query.split()), 'seconds': elapsed, 'caller': caller, 'at': time.time()}
+        _slowLog.append(register)
+        logger.warning('slow query (%.4fs) from %s: %s', elapsed, caller, register['sql'])
+
+    return entry
+
+
+class instrumentedCursor(sql.Cursor):
+    '''
+    This class is the cursor of the instrumented connections. Statements are timed in execute and executemany,
+    and the rows read are counted, with the time spent reading them, in every way of fetching
+    '''
+    def execute(self, query, params = ()):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            self._entry = _record(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params)
+        finally:
+            self._entry = _record(query, time.perf_counter() - start, self.rowcount)
+
+    def _fetched(self, rows: int, elapsed: float) -> None:
+        entry = getattr(self, '_entry', None)
+        if entry is not None:
+            with _lock:
+                entry['rows'] += rows
+                entry['fetchSeconds'] += elapsed
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, time.perf_counter() - start)
+
+        return row
+
+    def fetchmany(self, size = None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), time.perf_counter() - start)
+
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), time.perf_counter() - start)
+
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(1, time.perf_counter() - start)
+
+        return row
+
+
+class instrumentedConnection(sql.Connection):
+    '''
+    This class is the connection opened by connectionModule while the instrumentation is enabled.
+    Every cursor it creates, including the ones of execute and executemany, is an instrumentedCursor
+    '''
+    def cursor(self, factory = instrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, query, params = ()):
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, params):
+        return self.cursor().executemany(query, params)
+
+
+def connectionFactory():
+    '''
+    This function returns the class of the connections that connectionModule opens: sqlite3.Connection while the
+    instrumentation is disabled and instrumentedConnection while it's enabled
+    '''
+    return instrumentedConnection if _enabled else sql.Connection
+
+
+def opened(conn: sql.Connection) -> None:
+    '''
+    This function is called by connectionModule for every connection it opens, to count it and set the trace callback
+    '''
+    if not _enabled:
+        return
+
+    with _lock:
+        _connections['opened'] += 1
+
+    if _settings['trace']:
+        conn.set_trace_callback(lambda statement: logger.debug('%s', statement))
+
+
+def enable(slowQuery: float = None, trace: bool = False) -> None:
+    '''
+    This function enables the instrumentation of the connections opened from now on
+
+    :param slowQuery: Statements that take at least these seconds are kept by slowQueries and logged as warnings. If None, none is
+    :param trace: If True, every statement run by sqlite, as expanded by sqlite3's trace callback, is logged as debug
+
+    :return: None
+    '''
+    global _enabled
+
+    _settings['slowQuery'] = slowQuery
+    _settings['trace'] = trace
+    _enabled = True
+
+
+def disable() -> None:
+    '''
+    This function disables the instrumentation of the connections opened from now on. What was recorded is kept until reset
+    '''
+    global _enabled
+
+    _enabled = False
+
+
+def isEnabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    '''
+    This function clears every counter, histogram and the slow query log
+    '''
+    with _lock:
+        _stats.clear()
+        _connections['opened'] = 0
+        _slowLog.clear()
+
+
+def snapshot() -> dict:
+    '''
+    This function returns a copy of what was recorded
+
+    :return: dict with 'connections' (how many were opened), 'buckets' (bucketList), 'queries' ({statement: counters}),
+    and 'slowQueries' (list of {'sql', 'seconds', 'caller', 'at'})
+    '''
+    with _lock:
+        queries = {
+            statement: dict(entry, histogram=list(entry['histogram']), callers=dict(entry['callers']))
+            for statement, entry in _stats.items()
+        }
+
+        return {
+            'connections': _connections['opened'],
+            'buckets': list(bucketList),
+            'queries': queries,
+            'slowQueries': list(_slowLog)
+        }
+
+
+def slowQueries() -> list:
+    return list(_slowLog)
+
+
+def report(top: int = 20, key: str = 'seconds') -> list:
+    '''
+    This function summarizes the statements that took the longest, one line each
+
+    :param top: How many statements are listed
+    :param key: The counter used to sort them: 'seconds', 'calls', 'rows' or 'maxSeconds'
+
+    :return: list of str
+    '''
+    queries = snapshot()['queries']
+    ordered = sorted(queries.items(), key=lambda item: item[1][key], reverse=True)[:top]
+
+    lines = []
+    for statement, entry in ordered:
+        caller = max(entry['callers'], key=entry['callers'].get)
+        lines.append(
+            f"{entry['seconds'] + entry['fetchSeconds']:9.4f}s {entry['calls']:7d} calls {entry['rows']:9d} rows "
+            f"max {entry['maxSeconds']:.4f}s  {caller}  {statement[:120]}"
+        )
+
+    return lines
+
+
+# AGV_PROFILE liga a instrumentação sem mudar o código. AGV_SLOW_QUERY é o limite, em segundos, das consultas lentas
+if os.environ.get('AGV_PROFILE'):
+    enable(float(os.environ['AGV_SLOW_QUERY']) if os.environ.get('AGV_SLOW_QUERY') else None, os.environ.get('AGV_PROFILE') == 'trace')
@@ -0,0 +1,194 @@
+'''
+Reader of the change journal (the alteracoes table). Triggers of consumos, demandas, lancamentos, ucs, clientes and tarifas
+write one entry for every inserted, updated or deleted row, with a seq that only grows.
+A consumer (a report cache, a BI export...) keeps the last seq it processed in alteracoes_checkpoint and reads only what
+changed after it, instead of reading the tables again. With PostgreSQL the seq is taken at the insert, and a transaction
+still open may commit a seq below the ones already read, so the consumers only read up to watermark
+Usage
+-----
+    def export(cursor, changes):
+        ...
+
+    journalModule.consume('bi', export)
+'''
+import datetime as dt
+
+import connectionModule
+from clientsModule import dbName
+
+journalColumns = ['seq', 'tabela', 'operacao', 'chave', 'uc_id', 'ano', 'mes', 'created_at']
+
+
+def lastSeq(db = None) -> int:
+    '''
+    This function returns the seq of the last change written in the journal, even if it was already pruned, or 0 if there was none
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    # o maior seq já gerado vem da sequência do banco, que não volta quando o diário é podado
+    return db.backend.lastSeq(db.cursor(), 'alteracoes', 'seq')
+
+
+def watermark(pending: tuple = None, db = None) -> tuple:
+    '''
+    This function returns the last seq of the journal below which no transaction is still open, so a consumer that reads up
+    to it never moves past a change that will be commited later. With sqlite it's always lastSeq. With PostgreSQL, the
+    lastSeq read while other transactions are open is only complete after they end, so it's returned as pending and checked
+    again on the next call
+
+    :param pending: The pending value returned by the last call of the same consumer, or None
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: tuple (seq, pending). seq is None when no seq is known to be complete yet, and pending must be given to the next call
+    '''
+    db = connectionModule.resolve(db, dbName)
+    cursor = db.cursor()
+
+    seq = None
+    if pending is not None and db.backend.settled(cursor, pending[1]):
+        seq, pending = pending[0], None
+
+    last, horizon = db.backend.watermark(cursor, 'alteracoes', 'seq')
+    if db.backend.settled(cursor, horizon):
+        return last, None
+
+    # o pendente mais antigo é mantido, para que escritas contínuas não adiem a marca para sempre
+    return seq, pending or (last, horizon)
+
+
+def changesSince(seq: int = 0, tables: list = None, limit: int = None, db = None, until: int = None) -> list:
+    '''
+    This function returns the changes of the journal after a seq, in the order they were made
+
+    :param seq: The last seq already processed. Only later changes are returned
+    :param tables: If filled, only the changes of these tables are returned
+    :param limit: If filled, at most limit changes are returned. Call again with the last seq returned to read the next ones
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+    :param until: If filled, only the changes up to this seq are returned, usually the one given by watermark
+
+    :return: list of tuples (seq, tabela, operacao, chave, uc_id, ano, mes, created_at). chave is the id of the changed row
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    query = 'SELECT seq, tabela, operacao, chave, uc_id, ano, mes, created_at FROM alteracoes WHERE seq > ?'
+    params = [seq]
+    if until is not None:
+        query += ' AND seq <= ?'
+        params.append(until)
+    if tables:
+        query += f" AND tabela IN ({','.join('?' * len(tables))})"
+        params.extend(tables)
+
+    query += ' ORDER BY seq'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    return db.cursor().execute(query, params).fetchall()
+
+
+def readCheckpoint(consumer: str, db = None) -> int:
+    '''
+    This function returns the last seq processed by a consumer, or 0 if it never ran
+    '''
+    db = connectionModule.resolve(db, dbName)
+    register = db.cursor().execute('SELECT seq FROM alteracoes_checkpoint WHERE consumidor = ?', (consumer,)).fetchone()
+
+    return register[0] if register else 0
+
+
+def saveCheckpoint(cursor, consumer: str, seq: int, pending: tuple = None) -> None:
+    '''
+    This function saves the last seq processed by a consumer. It must be called with the cursor of the transaction where the
+    changes were processed, so the checkpoint is never ahead of what was done
+
+    :param pending: The pending value of watermark, kept for the next run of the consumer
+    '''
+    pendingSeq, horizon = pending or (None, None)
+
+    cursor.execute(
+        '''
+        INSERT INTO alteracoes_checkpoint (consumidor, seq, pendente_seq, pendente_horizonte, updated_at)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT (consumidor) DO UPDATE
+        SET seq = excluded.seq, pendente_seq = excluded.pendente_seq, pendente_horizonte = excluded.pendente_horizonte, updated_at = excluded.updated_at
+        ''', (consumer, seq, pendingSeq, horizon, dt.datetime.now())
+    )
+
+
+def deleteCheckpoint(consumer: str, db = None) -> None:
+    '''
+    This function deletes the checkpoint of a consumer that stopped, so prune no longer keeps its changes
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM alteracoes_checkpoint WHERE consumidor = ?', (consumer,))
+
+
+def consume(consumer: str, handler, tables: list = None, batchSize: int = 1000, db = None) -> int:
+    '''
+    This function gives to a consumer every change after its checkpoint, up to the watermark, in batches. Each batch is
+    processed and its checkpoint saved in the same transaction, so a consumer stopped in the middle starts again from the
+    first unfinished batch. Changes of transactions still open are left for the next call
+
+    :param consumer: The name of the consumer, which identifies its checkpoint
+    :param handler: A function handler(cursor, changes), where changes is a list like the return of changesSince
+    :param tables: If filled, only the changes of these tables are given. The checkpoint still moves past the others
+    :param batchSize: How many changes are given at a time
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: int, how many changes were given to the handler
+    '''
+    db = connectionModule.resolve(db, dbName)
+    consumed = 0
+
+    with db.transaction() as cursor:
+        register = cursor.execute(
+            'SELECT seq, pendente_seq, pendente_horizonte FROM alteracoes_checkpoint WHERE consumidor = ?', (consumer,)
+        ).fetchone()
+        seq, stored = (register[0], register[1:] if register[1] is not None else None) if register else (0, None)
+
+        until, pending = watermark(stored, db)
+        if pending != stored:
+            saveCheckpoint(cursor, consumer, seq, pending)
+
+    while until is not None:
+        with db.transaction() as cursor:
+            seq = readCheckpoint(consumer, db)
+            if seq >= until:
+                break
+
+            last = cursor.execute(
+                'SELECT MAX(seq) FROM (SELECT seq FROM alteracoes WHERE seq > ? AND seq <= ? ORDER BY seq LIMIT ?) AS lote',
+                (seq, until, batchSize)
+            ).fetchone()[0]
+
+            # seqs perdidos por transações desfeitas até a marca não voltam, então o checkpoint pode passar por eles
+            if last is None:
+                saveCheckpoint(cursor, consumer, until, pending)
+                break
+
+            # o lote é a janela de batchSize alterações depois do checkpoint, filtrada pelas tabelas
+            changes = changesSince(seq, tables, batchSize, db, last)
+            if changes:
+                handler(cursor, changes)
+                consumed += len(changes)
+
+            saveCheckpoint(cursor, consumer, last, pending)
+
+    return consumed
+
+
+def prune(db = None) -> int:
+    '''
+    This function deletes the changes already processed by every consumer with a checkpoint
+
+    :return: int, how many changes were deleted
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM alteracoes WHERE seq <= (SELECT MIN(seq) FROM alteracoes_checkpoint)')
+
+        return cursor.rowcount
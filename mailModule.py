@@ -0,0 +1,236 @@
+import io
+import csv
+import threading
+import datetime as dt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import connectionModule
+from clientsModule import dbName, monthDict, uc
+
+
+def imboxFactory(host: str, username: str, password: str, port: int = None, ssl: bool = True):
+    '''
+    This function returns a function that opens a new imbox connection every time it's called.
+    Each worker thread opens its own connection, because an IMAP connection can't be shared between threads.
+    To test against a local fake IMAP server, use ssl=False and its port, or pass any other factory to ingest
+    '''
+    def factory():
+        import imbox
+
+        try:
+            from imbox.settings import Config
+        except ImportError:
+            return imbox.Imbox(host, username=username, password=password, ssl=ssl, port=port)
+
+        config = Config(username=username, password=password, imap_url=host, ssl=ssl, ssl_context=None, starttls=False, port=port or (993 if ssl else 143))
+
+        return imbox.Imbox(config)
+
+    return factory
+
+
+def csvAttachmentParser(message, attachment) -> list:
+    '''
+    This function is the default parser of ingest. It reads the csv attachments of a message, separated by ';', with the header:
+        uc;mes;tipo;valor;ano
+    Attachments of other formats are ignored, and a month out of clientsModule.monthDict raises a ValueError, so the message is
+    kept in ingestao_falhas. Write another parser with the same signature for the bills of each utility
+
+    :param message: The imbox message
+    :param attachment: One of message.attachments, a dict with the keys 'filename' and 'content'
+
+    :return: list of tuples (ucNumber, month, valueType, value, year), the rows accepted by uc.createValues
+    '''
+    if not str(attachment.get('filename', '')).lower().endswith('.csv'):
+        return []
+
+    content = attachment['content'].getvalue().decode('utf-8-sig')
+    rows = []
+    for number, line in enumerate(csv.DictReader(io.StringIO(content), delimiter=';'), 2):
+        month = line['mes'].strip().lower()
+        if month not in monthDict:
+            raise ValueError(f"month {line['mes']!r} not recognized in line {number} of {attachment.get('filename')}")
+
+        rows.append((line['uc'], month, line['tipo'], float(line['valor'].replace(',', '.')), int(line['ano']) if line.get('ano') else None))
+
+    return rows
+
+
+def readCheckpoint(db, mailbox: str) -> int:
+    '''
+    This function returns the last UID of a mailbox already ingested. A mailbox never ingested returns 0
+    '''
+    register = db.cursor().execute(
+        '''
+        SELECT ultimo_uid
+        FROM ingestao_checkpoint
+        WHERE caixa = ?
+        ''', (mailbox,)
+    ).fetchone()
+
+    return register[0] if register else 0
+
+
+def saveCheckpoint(cursor, mailbox: str, uid: int) -> None:
+    cursor.execute(
+        '''
+        INSERT INTO ingestao_checkpoint (caixa, ultimo_uid, updated_at)
+        VALUES (?,?,?)
+        ON CONFLICT (caixa) DO UPDATE SET ultimo_uid = excluded.ultimo_uid, updated_at = excluded.updated_at
+        ''', (mailbox, uid, dt.datetime.now())
+    )
+
+
+def readFailures(db, mailbox: str, maxAttempts: int = None) -> list:
+    '''
+    This function returns the UIDs of a mailbox that failed to be fetched or parsed and weren't ingested yet
+
+    :param maxAttempts: If filled, only the UIDs that failed less than maxAttempts times are returned
+    '''
+    query = 'SELECT uid FROM ingestao_falhas WHERE caixa = ?'
+    params = [mailbox]
+    if maxAttempts is not None:
+        query += ' AND tentativas < ?'
+        params.append(maxAttempts)
+
+    return [uid for (uid,) in db.cursor().execute(query + ' ORDER BY uid', params)]
+
+
+def saveFailures(cursor, mailbox: str, failures: list, recovered: list) -> None:
+    if failures:
+        cursor.executemany(
+            '''
+            INSERT INTO ingestao_falhas (caixa, uid, erro, tentativas, updated_at)
+            VALUES (?,?,?,1,?)
+            ON CONFLICT (caixa, uid) DO UPDATE SET erro = excluded.erro, tentativas = ingestao_falhas.tentativas + 1, updated_at = excluded.updated_at
+            ''', [(mailbox, uid, error, dt.datetime.now()) for uid, error in failures]
+        )
+
+    if recovered:
+        cursor.executemany('DELETE FROM ingestao_falhas WHERE caixa = ? AND uid = ?', [(mailbox, uid) for uid in recovered])
+
+
+def ingest(mailboxFactory, folder: str = 'INBOX', parser = csvAttachmentParser, workers: int = 4, batchSize: int = 1000, checkpointName: str = None, maxAttempts: int = 5, db = None) -> dict:
+    '''
+    This function reads the utility bills received since the last run and registers their values.
+    Messages are fetched and parsed by a pool of threads, each one with its own IMAP connection, and the values are
+    written by the calling thread in batches with uc.createValues. The last UID written is saved with each batch, in the same
+    transaction, so a new run continues where the last one stopped. Messages that fail to be fetched or parsed are reported
+    in errors and saved in the ingestao_falhas table, in the same transaction of the checkpoint that moves past them, and
+    the next runs fetch them again until they're ingested or fail maxAttempts times. Those are kept in the table, for inspection
+
+    :param mailboxFactory: A function that returns a new imbox connection, like the one returned by imboxFactory
+    :param folder: The folder of the mailbox to be read
+    :param parser: A function (message, attachment) -> list of rows for uc.createValues. Look at csvAttachmentParser
+    :param workers: How many threads fetch and parse messages
+    :param batchSize: How many values are written on each transaction
+    :param checkpointName: The name under which the last UID is saved. If None, the folder name is used
+    :param maxAttempts: How many times a failed message is fetched before it's left in ingestao_falhas
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict with the keys 'messages', 'inserted', 'conflicts' (list of tuples (uid, row, reason), like the ones of
+        uc.createValues, with the UID of the message instead of the index of the row), 'errors' (list of tuples (uid, error)) and 'lastUID'
+    '''
+    db = connectionModule.resolve(db, dbName)
+    checkpointName = checkpointName or folder
+    lastUID = readCheckpoint(db, checkpointName)
+    summary = {'messages': 0, 'inserted': 0, 'conflicts': [], 'errors': [], 'lastUID': lastUID}
+
+    listing = mailboxFactory()
+    try:
+        listing.connection.select(folder)
+        _, data = listing.connection.uid('search', None, f'(UID {lastUID + 1}:*)')
+    finally:
+        listing.logout()
+
+    # o IMAP devolve a última mensagem mesmo quando o intervalo começa depois dela
+    retries = set(readFailures(db, checkpointName, maxAttempts))
+    uids = sorted(retries.union(uid for uid in (int(uid) for uid in data[0].split()) if uid > lastUID))
+
+    local = threading.local()
+    connections = []
+    connectionsLock = threading.Lock()
+
+    def fetchAndParse(uid):
+        mailbox = getattr(local, 'mailbox', None)
+        if mailbox is None:
+            mailbox = local.mailbox = mailboxFactory()
+            with connectionsLock:
+                connections.append(mailbox)
+
+        rows = []
+        for _, message in mailbox.messages(folder=folder, uid__range=f'{uid}:{uid}'):
+            # a partir da versão 0.10 do imbox, a mensagem lida fica em parsed
+            message = getattr(message, 'parsed', message)
+            for attachment in message.attachments:
+                rows.extend(parser(message, attachment))
+
+        return rows
+
+    batch = []
+    origins = []
+    failures = []
+    recovered = []
+
+    def write(uid):
+        # mensagens de falhas anteriores têm UIDs abaixo do checkpoint, que nunca volta
+        uid = max(uid, lastUID)
+        with db.transaction() as cursor:
+            if batch:
+                result = uc.createValues(batch, db)
+                summary['inserted'] += result['inserted']
+                # os índices dos conflitos são do lote, então cada um é trocado pelo UID da mensagem da linha
+                summary['conflicts'].extend((origins[index], row, reason) for index, row, reason in result['conflicts'])
+            saveFailures(cursor, checkpointName, failures, recovered)
+            saveCheckpoint(cursor, checkpointName, uid)
+
+        summary['lastUID'] = uid
+        batch.clear()
+        origins.clear()
+        failures.clear()
+        recovered.clear()
+
+    pending = deque()
+    remaining = iter(uids)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # só algumas mensagens por thread ficam em memória, esperando a vez de serem gravadas em ordem de UID
+            for uid in remaining:
+                pending.append((uid, pool.submit(fetchAndParse, uid)))
+                if len(pending) >= workers * 4:
+                    break
+
+            while pending:
+                uid, future = pending.popleft()
+
+                try:
+                    rows = future.result()
+                except Exception as error:
+                    summary['errors'].append((uid, repr(error)))
+                    failures.append((uid, repr(error)))
+                else:
+                    batch.extend(rows)
+                    origins.extend([uid] * len(rows))
+                    if uid in retries:
+                        recovered.append(uid)
+
+                summary['messages'] += 1
+                if len(batch) >= batchSize:
+                    write(uid)
+
+                nextUID = next(remaining, None)
+                if nextUID is not None:
+                    pending.append((nextUID, pool.submit(fetchAndParse, nextUID)))
+
+            if uids and (batch or failures or recovered or summary['lastUID'] < uids[-1]):
+                write(uids[-1])
+
+    finally:
+        for mailbox in connections:
+            try:
+                mailbox.logout()
+            except Exception:
+                pass
+
+    return summary
@@ -0,0 +1,271 @@
+import os
+import time
+import queue
+import smtplib
+import mimetypes
+import datetime as dt
+from contextlib import contextmanager
+from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import connectionModule
+from clientsModule import dbName
+
+# status de uma mensagem da tabela outbox:
+#   - 'pendente': esperando o envio, a partir de proxima_tentativa
+#   - 'enviando': pega por uma execução de deliver, que a reserva até proxima_tentativa. Se a execução parar no meio,
+#     outra execução só a pega de novo depois desse prazo
+#   - 'enviado': enviada
+#   - 'falhou': todas as tentativas falharam
+statusList = [
+    'pendente',
+    'enviando',
+    'enviado',
+    'falhou'
+]
+
+
+class smtpPool:
+    '''
+    This class keeps a pool of open SMTP connections, reused by many messages instead of connecting for each one.
+    To test against a local SMTP sink, use its host and port with ssl=False and no username
+    '''
+    def __init__(self, host: str, port: int = 587, username: str = None, password: str = None, sender: str = None,
+                 ssl: bool = False, starttls: bool = True, size: int = 4, timeout: float = 60) -> None:
+        '''
+        Constructor of the class smtpPool. Connections are only opened when needed
+
+        :param host: The SMTP server
+        :param port: The port of the SMTP server
+        :param username: The login. If None, no login is made
+        :param password: The password of the login
+        :param sender: The From of the messages. If None, username is used
+        :param ssl: If True, the connection is made with SMTP_SSL
+        :param starttls: If True and ssl is False, STARTTLS is used after connecting
+        :param size: The most connections kept open at the same time
+        :param timeout: How many seconds a connection waits for the server
+        '''
+        self.host       = host
+        self.port       = port
+        self.username   = username
+        self.password   = password
+        self.sender     = sender or username
+        self.ssl        = ssl
+        self.starttls   = starttls
+        self.size       = size
+        self.timeout    = timeout
+        self._idle      = queue.LifoQueue()
+        self._slots     = queue.Queue()
+
+        for _ in range(size):
+            self._slots.put(None)
+
+    def _open(self) -> smtplib.SMTP:
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls and smtp.has_extn('starttls'):
+                smtp.starttls()
+
+        if self.username:
+            smtp.login(self.username, self.password)
+
+        return smtp
+
+    @contextmanager
+    def connection(self):
+        '''
+        This method lends an open connection. It waits while size connections are in use.
+        A connection that raises an error is closed instead of going back to the pool
+        '''
+        self._slots.get()
+        try:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = self._open()
+
+            try:
+                yield smtp
+            except BaseException:
+                try:
+                    smtp.close()
+                except Exception:
+                    pass
+                raise
+
+            self._idle.put(smtp)
+
+        finally:
+            self._slots.put(None)
+
+    def close(self) -> None:
+        '''
+        This method closes every idle connection
+        '''
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+def enqueue(recipient: str, subject: str, body: str, attachment: str = None, db = None) -> int:
+    '''
+    This function puts a message in the outbox. It's sent by the next deliver run
+
+    :param recipient: The email address of the recipient
+    :param subject: The subject of the message
+    :param body: The text of the message
+    :param attachment: The path of an archive to be attached
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: int, the id of the message in the outbox
+    '''
+    db = connectionModule.resolve(db, dbName)
+    date = dt.datetime.now()
+
+    with db.transaction() as cursor:
+        return cursor.execute(
+            '''
+            INSERT INTO outbox (destinatario, assunto, corpo, anexo, status, tentativas, proxima_tentativa, created_at)
+            VALUES (?,?,?,?,?,?,?,?)
+            RETURNING id
+            ''', (recipient, subject, body, attachment, 'pendente', 0, date, date)
+        ).fetchone()[0]
+
+
+def readStatus(messageID: int, db = None):
+    '''
+    This function returns (status, tentativas, ultimo_erro, enviado_em) of a message of the outbox
+    '''
+    db = connectionModule.resolve(db, dbName)
+
+    return db.cursor().execute(
+        '''
+        SELECT status, tentativas, ultimo_erro, enviado_em
+        FROM outbox
+        WHERE id = ?
+        ''', (messageID,)
+    ).fetchone()
+
+
+def summary(db = None) -> dict:
+    '''
+    This function returns how many messages of the outbox are in each status
+    '''
+    db = connectionModule.resolve(db, dbName)
+    counts = dict(db.cursor().execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    return {status: counts.get(status, 0) for status in statusList}
+
+
+def _buildMessage(sender: str, recipient: str, subject: str, body: str, attachment: str) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content(body or '')
+
+    if attachment:
+        contentType = mimetypes.guess_type(attachment)[0] or 'application/octet-stream'
+        mainType, subType = contentType.split('/', 1)
+        with open(attachment, 'rb') as archive:
+            message.add_attachment(archive.read(), maintype=mainType, subtype=subType, filename=os.path.basename(attachment))
+
+    return message
+
+
+def deliver(pool: smtpPool, workers: int = None, maxAttempts: int = 5, backoff: float = 30, batchSize: int = 100, wait: bool = False,
+            lease: float = 600, db = None) -> dict:
+    '''
+    This function sends the messages of the outbox that are due, with up to workers messages being sent at the same time.
+    A failed message is tried again after backoff * 2 ** (attempts - 1) seconds, until maxAttempts attempts.
+    Every status change is saved at once, so a run stopped by a crash can be started again without sending a message twice,
+    except the ones that were being sent at the moment of the crash. Those are only taken again when their lease ends, so
+    the messages of another run still sending them aren't sent twice
+
+    :param pool: The smtpPool used to send the messages
+    :param workers: How many messages are sent at the same time. If None, the size of the pool
+    :param maxAttempts: How many times a message is tried before being marked as 'falhou'
+    :param backoff: The wait, in seconds, before the first retry
+    :param batchSize: How many messages are taken from the outbox at a time
+    :param wait: If True, the function waits for the messages scheduled to be retried, until there is no message 'pendente'
+    :param lease: For how many seconds the messages taken by this run are reserved to it. It must be longer than a batch
+        takes to be sent
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict with how many messages were 'enviado' and how many 'falhou' or were rescheduled ('pendente') in this run
+    '''
+    db = connectionModule.resolve(db, dbName)
+    workers = workers or pool.size
+    result = {'enviado': 0, 'pendente': 0, 'falhou': 0}
+
+    def send(register):
+        messageID, recipient, subject, body, attachment, attempts = register
+        message = _buildMessage(pool.sender, recipient, subject, body, attachment)
+
+        with pool.connection() as smtp:
+            smtp.send_message(message)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            now = dt.datetime.now()
+
+            # mensagens 'enviando' com a reserva vencida são de uma execução interrompida.
+            # A condição repetida fora da subconsulta impede que duas execuções peguem a mesma mensagem
+            with db.transaction() as cursor:
+                registers = cursor.execute(
+                    '''
+                    UPDATE outbox
+                    SET status = 'enviando', proxima_tentativa = ?
+                    WHERE status IN ('pendente', 'enviando') AND proxima_tentativa <= ? AND id IN (
+                        SELECT id
+                        FROM outbox
+                        WHERE status IN ('pendente', 'enviando') AND proxima_tentativa <= ?
+                        ORDER BY proxima_tentativa
+                        LIMIT ?
+                    )
+                    RETURNING id, destinatario, assunto, corpo, anexo, tentativas
+                    ''', (now + dt.timedelta(seconds=lease), now, now, batchSize)
+                ).fetchall()
+
+            if not registers:
+                nextAttempt = db.cursor().execute("SELECT MIN(proxima_tentativa) FROM outbox WHERE status = 'pendente'").fetchone()[0]
+                if not wait or nextAttempt is None:
+                    break
+
+                seconds = (dt.datetime.fromisoformat(str(nextAttempt)) - dt.datetime.now()).total_seconds()
+                time.sleep(max(seconds, 0.1))
+                continue
+
+            futures = {executor.submit(send, register): register for register in registers}
+
+            for future in as_completed(futures):
+                messageID, attempts = futures[future][0], futures[future][5] + 1
+                error = future.exception()
+
+                with db.transaction() as cursor:
+                    if error is None:
+                        cursor.execute(
+                            "UPDATE outbox SET status = 'enviado', tentativas = ?, enviado_em = ?, ultimo_erro = NULL WHERE id = ?",
+                            (attempts, dt.datetime.now(), messageID)
+                        )
+                        result['enviado'] += 1
+
+                    else:
+                        status = 'falhou' if attempts >= maxAttempts else 'pendente'
+                        nextAttempt = dt.datetime.now() + dt.timedelta(seconds=backoff * 2 ** (attempts - 1))
+                        cursor.execute(
+                            'UPDATE outbox SET status = ?, tentativas = ?, proxima_tentativa = ?, ultimo_erro = ? WHERE id = ?',
+                            (status, attempts, nextAttempt, repr(error), messageID)
+                        )
+                        result[status] += 1
+
+    return result
@@ -0,0 +1,174 @@
+from array import array
+
+import numpy as np
+
+import connectionModule
+from clientsModule import dbName, uc, aGroupList, bGroupList, modalityList
+
+
+class ucColumns:
+    '''
+    This class keeps a whole portfolio of UCs in columns, one NumPy array per attribute, instead of one uc object per UC.
+    Subgroups and modalities are stored as small integer codes, and the demands as floats (NaN when not filled).
+    A filtered collection can be priced at once by costModule.portfolioCosts, given as its ucNumbers
+    '''
+    __slots__ = ('ids', 'clientIDs', 'numbers', 'utilities', 'classes', 'subgroupCodes', 'modalityCodes',
+                 'demand', 'peakDemand', 'offPeakDemand', 'subgroups', 'modalities', 'db')
+
+    def __init__(self, subgroups: list = None, modalities: list = None, db = None) -> None:
+        '''
+        Constructor of the class ucColumns. It creates an empty collection. Use ucColumns.load to read a portfolio
+
+        :param subgroups: The subgroups list. The code of a subgroup is its position on it
+        :param modalities: The modalities list. The code of a modality is its position on it
+        :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+        '''
+        self.subgroups      = list(subgroups or aGroupList + bGroupList)
+        self.modalities     = list(modalities or modalityList)
+        self.db             = connectionModule.resolve(db, dbName)
+
+        self.ids            = np.empty(0, dtype=np.int64)
+        self.clientIDs      = np.empty(0, dtype=np.int64)
+        self.numbers        = np.empty(0, dtype=object)
+        self.utilities      = np.empty(0, dtype=object)
+        self.classes        = np.empty(0, dtype=object)
+        self.subgroupCodes  = np.empty(0, dtype=np.int16)
+        self.modalityCodes  = np.empty(0, dtype=np.int16)
+        self.demand         = np.empty(0, dtype=np.float64)
+        self.peakDemand     = np.empty(0, dtype=np.float64)
+        self.offPeakDemand  = np.empty(0, dtype=np.float64)
+
+    @classmethod
+    def load(cls, utility: str = None, clientIDs: list = None, chunkSize: int = 10000, db = None):
+        '''
+        This method reads the UCs of the database in chunks and keeps them in columns
+
+        :param utility: If filled, only the UCs of this utility are read
+        :param clientIDs: If filled, only the UCs linked to these clients are read
+        :param chunkSize: How many rows are read from the cursor at a time
+        :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+        :return: ucColumns
+        '''
+        columns = cls(db=db)
+        subgroupCodes = {subgroup: code for code, subgroup in enumerate(columns.subgroups)}
+        modalityCodes = {modality: code for code, modality in enumerate(columns.modalities)}
+
+        query = '''
+            SELECT id, client_id, numero, concessionaria, classe, subgrupo, modalidade, demanda, demanda_ponta, demanda_fora_ponta
+            FROM ucs
+            WHERE 1 = 1
+        '''
+        params = []
+        if utility:
+            query += ' AND concessionaria = ?'
+            params.append(utility)
+        if clientIDs:
+            query += f" AND client_id IN ({','.join('?' * len(clientIDs))})"
+            params.extend(clientIDs)
+
+        # os valores numéricos vão direto para arrays compactos, sem uma lista de objetos intermediária
+        ids, clients, subgroups, modalities = array('q'), array('q'), array('h'), array('h')
+        demand, peakDemand, offPeakDemand = array('d'), array('d'), array('d')
+        numbers, utilities, classes = [], [], []
+
+        cursor = columns.db.cursor().execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                break
+
+            for ucID, clientID, number, ucUtility, clientClass, subgroup, modality, ucDemand, ucPeakDemand, ucOffPeakDemand in rows:
+                if subgroup not in subgroupCodes:
+                    subgroupCodes[subgroup] = len(columns.subgroups)
+                    columns.subgroups.append(subgroup)
+                if modality not in modalityCodes:
+                    modalityCodes[modality] = len(columns.modalities)
+                    columns.modalities.append(modality)
+
+                ids.append(ucID)
+                clients.append(clientID if clientID is not None else -1)
+                numbers.append(number)
+                utilities.append(ucUtility)
+                classes.append(clientClass)
+                subgroups.append(subgroupCodes[subgroup])
+                modalities.append(modalityCodes[modality])
+                demand.append(ucDemand if ucDemand is not None else np.nan)
+                peakDemand.append(ucPeakDemand if ucPeakDemand is not None else np.nan)
+                offPeakDemand.append(ucOffPeakDemand if ucOffPeakDemand is not None else np.nan)
+
+        columns.ids             = np.frombuffer(ids, dtype=np.int64)
+        columns.clientIDs       = np.frombuffer(clients, dtype=np.int64)
+        columns.numbers         = np.array(numbers, dtype=object)
+        columns.utilities       = np.array(utilities, dtype=object)
+        columns.classes         = np.array(classes, dtype=object)
+        columns.subgroupCodes   = np.frombuffer(subgroups, dtype=np.int16)
+        columns.modalityCodes   = np.frombuffer(modalities, dtype=np.int16)
+        columns.demand          = np.frombuffer(demand, dtype=np.float64)
+        columns.peakDemand      = np.frombuffer(peakDemand, dtype=np.float64)
+        columns.offPeakDemand   = np.frombuffer(offPeakDemand, dtype=np.float64)
+
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _codes(self, values: list, categories: list) -> list:
+        return [code for code, category in enumerate(categories) if category in values]
+
+    def mask(self, subgroups: list = None, modalities: list = None) -> np.ndarray:
+        '''
+        This method returns a boolean array with the UCs that belong to any of the subgroups and to any of the modalities.
+        Params not filled don't filter
+
+        Usage
+        -----
+            columns.mask(subgroups=aGroupList, modalities=['Azul', 'Verde'])
+        '''
+        mask = np.ones(len(self), dtype=bool)
+
+        if subgroups is not None:
+            mask &= np.isin(self.subgroupCodes, self._codes(subgroups, self.subgroups))
+        if modalities is not None:
+            mask &= np.isin(self.modalityCodes, self._codes(modalities, self.modalities))
+
+        return mask
+
+    @property
+    def isAGroup(self) -> np.ndarray:
+        return self.mask(subgroups=aGroupList)
+
+    @property
+    def isBGroup(self) -> np.ndarray:
+        return self.mask(subgroups=bGroupList)
+
+    def filter(self, subgroups: list = None, modalities: list = None, mask: np.ndarray = None):
+        '''
+        This method returns a new ucColumns with only the UCs selected by the subgroups and modalities, or by a boolean mask
+        '''
+        if mask is None:
+            mask = self.mask(subgroups, modalities)
+
+        selected = ucColumns(self.subgroups, self.modalities, self.db)
+        for column in ('ids', 'clientIDs', 'numbers', 'utilities', 'classes', 'subgroupCodes', 'modalityCodes',
+                       'demand', 'peakDemand', 'offPeakDemand'):
+            setattr(selected, column, getattr(self, column)[mask])
+
+        return selected
+
+    def record(self, position: int) -> uc:
+        '''
+        This method builds the uc object of one position of the collection. The address, CEP and client are not kept in columns
+        '''
+        def value(column):
+            return None if np.isnan(column[position]) else float(column[position])
+
+        return uc(
+            self.utilities[position], self.numbers[position], None, None, None,
+            self.subgroups[self.subgroupCodes[position]], self.modalities[self.modalityCodes[position]], self.classes[position],
+            peakDemand=value(self.peakDemand), offPeakDemand=value(self.offPeakDemand), demand=value(self.demand), db=self.db
+        )
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.record(position)
@@ -0,0 +1,145 @@
+import time
+import datetime as dt
+from concurrent.futures import as_completed
+
+import connectionModule
+import tariffModule
+import rollupModule
+import journalModule
+from clientsModule import dbName, monthDict
+
+
+def monthsBetween(start: dt.date, end: dt.date) -> list:
+    '''
+    This function returns every reference month, as tuples (year, month), between two dates
+    '''
+    months = []
+    names = list(monthDict)
+    year, number = start.year, start.month
+
+    while (year, number) <= (end.year, end.month):
+        months.append((year, names[number - 1]))
+        year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+
+    return months
+
+
+def affectedUCs(db, utility: str, subgroup: str = None, modality: str = None) -> list:
+    '''
+    This function returns the ids of the UCs of a utility, optionally only of a subgroup and a modality
+    '''
+    query = 'SELECT id FROM ucs WHERE concessionaria = ?'
+    params = [utility]
+
+    if subgroup:
+        query += ' AND subgrupo = ?'
+        params.append(subgroup)
+    if modality:
+        query += ' AND modalidade = ?'
+        params.append(modality)
+
+    return [ucID for (ucID,) in db.cursor().execute(query + ' ORDER BY id', params)]
+
+
+def _costChunk(ucIDs: list, months: list, db = None) -> list:
+    db = db or connectionModule.workerDb()
+    where = (
+        f" AND r.uc_id IN ({','.join('?' * len(ucIDs))})"
+        f" AND (r.ano, r.mes) IN (VALUES {','.join('(?,?)' for _ in months)})"
+    )
+    params = list(ucIDs) + [value for month in months for value in month]
+
+    # o pool só vive durante um recálculo, então cada processo pode guardar as tarifas lidas para todas as suas partes
+    rows = []
+    for rollup in rollupModule.rollupRows(db, where=where, params=params, lookup=tariffModule.getRepository(db).prices):
+        rows.extend(rollup)
+
+    return rows
+
+
+def _settledSeq(db) -> int:
+    # só uma marca assentada garante que toda alteração até ela já estava visível para o cálculo
+    seq, pending = journalModule.watermark(db=db)
+    while seq is None:
+        time.sleep(0.05)
+        seq, pending = journalModule.watermark(pending, db)
+
+    return seq
+
+
+def _changedUCs(db, seq: int, ucIDs: list) -> set:
+    changed = {change[4] for change in journalModule.changesSince(seq, tables=['consumos', 'demandas', 'ucs'], db=db)}
+
+    # um diário podado depois da marca pode ter perdido alterações, então todas as UCs são refeitas
+    pruned = db.cursor().execute('SELECT MIN(seq) FROM alteracoes_checkpoint').fetchone()[0]
+    if pruned is not None and pruned > seq:
+        return set(ucIDs)
+
+    return changed.intersection(ucIDs)
+
+
+def recalculate(utility: str, start: dt.date, end: dt.date, subgroup: str = None, modality: str = None,
+                workers: int = None, chunkSize: int = 200, progress = None, db = None) -> int:
+    '''
+    This function recalculates the costs of rollup_mensal of every UC of a utility in a validity window, usually after a new REH.
+    The UCs are split in chunks and calculated by a pool of processes, each one with its own read-only connection.
+    The results are written back in a single transaction, which holds the writes of values until its end and calculates
+    again the UCs written while the pool was running, so their rows aren't overwritten by older totals.
+    With workers=1, or a database that other processes can't open, everything runs in this process. See connectionModule.readOnlyPool
+
+    :param utility: The utility whose tariffs changed
+    :param start: The first day of the validity window
+    :param end: The last day of the validity window
+    :param subgroup: If filled, only the UCs of this subgroup are recalculated
+    :param modality: If filled, only the UCs of this modality are recalculated
+    :param workers: How many processes are used. If None, the number of CPUs
+    :param chunkSize: How many UCs each process calculates at a time
+    :param progress: A function progress(doneChunks, totalChunks), called every time a chunk is finished
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: int, how many rows of rollup_mensal were written
+    '''
+    db = connectionModule.resolve(db, dbName)
+    tariffModule.invalidate(db)
+
+    months = monthsBetween(start, end)
+    ucIDs = affectedUCs(db, utility, subgroup, modality)
+    chunks = [ucIDs[position:position + chunkSize] for position in range(0, len(ucIDs), chunkSize)]
+
+    if not chunks or not months:
+        return 0
+
+    seq = _settledSeq(db)
+    rows = []
+    with connectionModule.readOnlyPool(db, workers) as pool:
+        futures = [pool.submit(_costChunk, chunk, months) for chunk in chunks]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            rows.extend(future.result())
+            if progress:
+                progress(done, len(chunks))
+
+    with db.transaction() as cursor:
+        # as escritas de valores esperam o fim desta transação, e as UCs escritas durante o cálculo são refeitas nela
+        db.backend.lockTables(cursor, ['consumos', 'demandas', 'ucs'])
+        changed = _changedUCs(db, seq, ucIDs)
+        if changed:
+            rows = [row for row in rows if row[1] not in changed]
+            rows.extend(_costChunk(sorted(changed), months, db))
+
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS recalculo_ucs (uc_id INTEGER PRIMARY KEY)')
+        cursor.execute('DELETE FROM recalculo_ucs')
+        db.bulkInsert(cursor, 'recalculo_ucs', [(ucID,) for ucID in ucIDs])
+
+        for year, month in months:
+            cursor.execute(
+                '''
+                DELETE FROM rollup_mensal
+                WHERE ano = ? AND mes = ? AND uc_id IN (SELECT uc_id FROM recalculo_ucs)
+                ''', (year, month)
+            )
+
+        db.bulkInsert(cursor, 'rollup_mensal', rows)
+        cursor.execute('DELETE FROM recalculo_ucs')
+
+    return len(rows)
@@ -0,0 +1,258 @@
+import os
+import csv
+import calendar
+import datetime as dt
+
+import tariffModule
+from clientsModule import monthDict, valueTypesList, valueTypeDict, costOf
+
+reportColumns = ['uc', 'ano', 'mes'] + valueTypesList + ['custo', 'custoAcumulado', 'custoReal', 'economia', 'economiaAcumulada']
+
+# ordena os meses cronologicamente dentro do SQL, já que a coluna mes guarda a abreviação
+monthOrder = 'CASE r.mes ' + ' '.join(f"WHEN '{month}' THEN {number}" for month, number in monthDict.items()) + ' END'
+
+
+def _filters(clientID: int, ucNumbers: list, years: list, months: list) -> tuple:
+    filters = ''
+    params = []
+    if clientID is not None:
+        filters += ' AND u.client_id = ?'
+        params.append(clientID)
+    for column, values in (('u.numero', ucNumbers), ('r.ano', years), ('r.mes', months)):
+        if values:
+            filters += f" AND {column} IN ({','.join('?' * len(values))})"
+            params.extend(values)
+
+    return filters, params
+
+
+def readMonths(db, clientID: int = None, ucNumbers: list = None, years: list = None, months: list = None, chunkSize: int = 1000):
+    '''
+    This generator reads the consumptions and demands with a cursor, chunkSize rows at a time, and yields one UC month at a time.
+    Only one month of one UC is kept in memory
+
+    :return: generator of tuples (ucInfo, year, month, values), where ucInfo is (numero, concessionaria, modalidade, subgrupo, classe)
+        and values is a dict {valueType: value}
+    '''
+    filters, params = _filters(clientID, ucNumbers, years, months)
+
+    # a ordem binária dos números é a mesma do Python, com que reportRows junta os lançamentos
+    query = 'SELECT * FROM (' + ' UNION ALL '.join(
+        f'''
+        SELECT u.numero, u.concessionaria, u.modalidade, u.subgrupo, u.classe, r.ano, r.mes, {monthOrder} AS ordem, '{tipo}' AS tipo, p.descricao, r.valor
+        FROM {table} r
+        JOIN ucs u ON u.id = r.uc_id
+        JOIN posto p ON p.id = r.posto_id
+        WHERE 1 = 1{filters}
+        ''' for table, tipo in (('consumos', 'consumo'), ('demandas', 'demanda'))
+    ) + ') AS valores ORDER BY numero COLLATE BINARY, ano, ordem'
+
+    cursor = db.streamCursor(chunkSize)
+    try:
+        cursor.execute(query, params * 2)
+
+        current = None
+        values = {}
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                break
+
+            for number, utility, modality, subgroup, clientClass, year, month, order, tipo, posto, value in rows:
+                key = ((number, utility, modality, subgroup, clientClass), year, month)
+                if key != current:
+                    if current is not None:
+                        yield current + (values,)
+                    current = key
+                    values = {}
+
+                values[valueTypeDict[(tipo, posto)]] = value
+
+        if current is not None:
+            yield current + (values,)
+
+    # o cursor é fechado mesmo quando quem lê para antes do fim
+    finally:
+        cursor.close()
+
+
+def readLedger(db, clientID: int = None, ucNumbers: list = None, years: list = None, months: list = None, chunkSize: int = 1000):
+    '''
+    This generator reads the real costs of the lancamentos table, summed by UC month, in the same order of readMonths
+
+    :return: generator of tuples (numero, year, monthNumber, realCost)
+    '''
+    filters, params = _filters(clientID, ucNumbers, years, months)
+
+    cursor = db.streamCursor(chunkSize)
+    try:
+        cursor.execute(
+            f'''
+            SELECT u.numero, r.ano, {monthOrder} AS ordem, SUM(r.valor)
+            FROM lancamentos r
+            JOIN ucs u ON u.id = r.uc_id
+            WHERE 1 = 1{filters}
+            GROUP BY u.numero, r.ano, r.mes
+            ORDER BY u.numero COLLATE BINARY, 2, 3
+            ''', params
+        )
+
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if not rows:
+                break
+
+            yield from rows
+
+    finally:
+        cursor.close()
+
+
+def reportRows(db, clientID: int = None, ucNumbers: list = None, years: list = None, months: list = None, chunkSize: int = 1000):
+    '''
+    This generator prices every UC month read by readMonths and yields the rows of a report, one at a time, with the
+    columns of reportColumns. custoAcumulado is the running cost of the UC. Months without tariff have custo None.
+    custoReal is the sum of the lancamentos of the month and economia is custo minus custoReal, None when any of them is missing.
+    The real costs are read by readLedger in the same order and merged as the rows go, so they aren't kept in memory either
+    '''
+    repository = tariffModule.getRepository(db)
+    accumulated = {}
+    ledger = readLedger(db, clientID, ucNumbers, years, months, chunkSize)
+    entry = next(ledger, None)
+
+    try:
+        for (number, utility, modality, subgroup, clientClass), year, month, values in readMonths(db, clientID, ucNumbers, years, months, chunkSize):
+            minDate = dt.date(year, monthDict[month], 1)
+            maxDate = dt.date(year, monthDict[month], calendar.monthrange(year, monthDict[month])[1])
+            prices = repository.prices(utility, modality, subgroup, clientClass, minDate, maxDate)
+
+            try:
+                cost = costOf(subgroup, values, prices) if prices else None
+            except RuntimeError:
+                cost = None
+
+            # lançamentos de meses sem leitura ficam para trás
+            key = (number, year, monthDict[month])
+            while entry is not None and entry[:3] < key:
+                entry = next(ledger, None)
+            realCost = entry[3] if entry is not None and entry[:3] == key else None
+            savings = cost - realCost if cost is not None and realCost is not None else None
+
+            # só o acumulado da UC corrente precisa ficar em memória
+            if number not in accumulated:
+                accumulated = {number: [0, 0]}
+            accumulated[number][0] += cost or 0
+            accumulated[number][1] += savings or 0
+
+            row = {
+                'uc': number, 'ano': year, 'mes': month, 'custo': cost, 'custoAcumulado': accumulated[number][0],
+                'custoReal': realCost, 'economia': savings, 'economiaAcumulada': accumulated[number][1]
+            }
+            for valueType in valueTypesList:
+                row[valueType] = values.get(valueType)
+
+            yield row
+
+    # readLedger pode não ter sido lido até o fim
+    finally:
+        ledger.close()
+
+
+class csvWriter:
+    def __init__(self, path: str, columns: list) -> None:
+        self.file   = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, delimiter=';')
+        self.writer.writeheader()
+
+    def writeRow(self, row: dict) -> None:
+        self.writer.writerow(row)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class xlsxWriter:
+    def __init__(self, path: str, columns: list) -> None:
+        import openpyxl
+
+        # o modo write_only grava as linhas no arquivo conforme chegam, sem montar a planilha em memória
+        self.path       = path
+        self.columns    = columns
+        self.book       = openpyxl.Workbook(write_only=True)
+        self.sheet      = self.book.create_sheet('relatorio')
+        self.sheet.append(columns)
+
+    def writeRow(self, row: dict) -> None:
+        self.sheet.append([row.get(column) for column in self.columns])
+
+    def close(self) -> None:
+        self.book.save(self.path)
+
+
+class pdfWriter:
+    def __init__(self, path: str, columns: list) -> None:
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.pdfgen import canvas
+
+        # cada página é gravada assim que fica cheia
+        self.columns    = columns
+        self.width, self.height = landscape(A4)
+        self.canvas     = canvas.Canvas(path, pagesize=(self.width, self.height))
+        self.step       = (self.width - 40) / len(columns)
+        self._newPage()
+
+    def _newPage(self) -> None:
+        self.canvas.setFont('Helvetica-Bold', 7)
+        self.y = self.height - 30
+        self._line(self.columns)
+        self.canvas.setFont('Helvetica', 7)
+
+    def _line(self, values: list) -> None:
+        for position, value in enumerate(values):
+            text = '' if value is None else (f'{value:.2f}' if isinstance(value, float) else str(value))
+            self.canvas.drawString(20 + position * self.step, self.y, text)
+        self.y -= 12
+
+    def writeRow(self, row: dict) -> None:
+        if self.y < 30:
+            self.canvas.showPage()
+            self._newPage()
+        self._line([row.get(column) for column in self.columns])
+
+    def close(self) -> None:
+        self.canvas.showPage()
+        self.canvas.save()
+
+
+writerDict = {
+            '.csv':csvWriter,
+            '.xlsx':xlsxWriter,
+            '.pdf':pdfWriter
+        }
+
+
+def writeReport(rows, path: str, columns: list = None) -> str:
+    '''
+    This function writes the rows of a report progressively, as they are yielded. The format comes from the extension of path:
+        - '.csv'
+        - '.xlsx', which needs openpyxl
+        - '.pdf', which needs reportlab
+
+    :param rows: An iterable of dicts, like the generator reportRows
+    :param path: The path of the archive
+    :param columns: The columns of the report. If None, reportColumns is used
+
+    :return: The path of the archive
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in writerDict:
+        raise TypeError('Report format not recognized')
+
+    writer = writerDict[extension](path, columns or reportColumns)
+    try:
+        for row in rows:
+            writer.writeRow(row)
+    finally:
+        writer.close()
+
+    return path
@@ -0,0 +1,190 @@
+import sys
+import calendar
+import functools
+import datetime as dt
+
+import connectionModule
+import tariffModule
+import clientsModule
+
+
+def _prices(lookup, memo: dict, utility, modality, subgroup, clientClass, year: int, month: str) -> dict:
+    key = (utility, modality, subgroup, clientClass, year, month)
+    if key not in memo:
+        minDate = dt.date(year, clientsModule.monthDict[month], 1)
+        maxDate = dt.date(year, clientsModule.monthDict[month], calendar.monthrange(year, clientsModule.monthDict[month])[1])
+        memo[key] = lookup(utility, modality, subgroup, clientClass, minDate, maxDate)
+
+    return memo[key]
+
+
+def rollupRows(db, join: str = '', where: str = '', params: list = (), chunkSize: int = 5000, lookup = None):
+    '''
+    This generator reads the consumos and demandas tables and yields the rows of rollup_mensal, in lists of up to chunkSize rows.
+    Rows without tariff for their month have cost None
+
+    :param db: The connectionModule.connectionManager read
+    :param join: An extra JOIN clause to select the values, over the alias r of consumos and demandas
+    :param where: An extra condition to select the values, over the aliases r and u (ucs)
+    :param params: The params of join and where
+    :param chunkSize: How many rows are read at a time
+    :param lookup: A function lookup(utility, modality, subgroup, clientClass, date, until) that returns the prices of a month,
+        like tariffModule.queryPrices. If None, the tarifas table is read once into a new tariffRepository, so the costs
+        never come from tariffs kept in memory before another process changed them
+
+    :return: generator of lists of tuples (cliente_id, uc_id, ano, mes, posto_id, tipo, valor, custo)
+    '''
+    query = ' UNION ALL '.join(
+        f'''
+        SELECT u.client_id, r.uc_id, r.ano, r.mes, r.posto_id, '{tipo}', p.descricao, r.valor, u.concessionaria, u.modalidade, u.subgrupo, u.classe
+        FROM {table} r
+        {join}
+        JOIN ucs u ON u.id = r.uc_id
+        JOIN posto p ON p.id = r.posto_id
+        WHERE 1 = 1{where}
+        ''' for table, tipo in (('consumos', 'consumo'), ('demandas', 'demanda'))
+    )
+
+    if lookup is None:
+        lookup = tariffModule.tariffRepository(db).prices
+    memo = {}
+
+    # cursor próprio de leitura, para que quem chama possa escrever com o cursor da transação entre um bloco e outro
+    reader = db.streamCursor(chunkSize)
+    try:
+        reader.execute(query, list(params) * 2)
+        while True:
+            rows = reader.fetchmany(chunkSize)
+            if not rows:
+                break
+
+            rollup = []
+            for clientID, ucID, year, month, postoID, tipo, posto, value, utility, modality, subgroup, clientClass in rows:
+                valueType = clientsModule.valueTypeDict[(tipo, posto)]
+                prices = _prices(lookup, memo, utility, modality, subgroup, clientClass, year, month)
+
+                try:
+                    cost = clientsModule.valueCost(subgroup, valueType, value or 0, prices) if prices else None
+                except RuntimeError:
+                    cost = None
+
+                rollup.append((clientID, ucID, year, month, postoID, valueType, value, cost))
+
+            yield rollup
+
+    # o cursor é fechado mesmo quando quem lê para antes do fim
+    finally:
+        reader.close()
+
+
+def refresh(db, cursor, keys = None, chunkSize: int = 5000) -> int:
+    '''
+    This function recalculates the rows of rollup_mensal of some UC months from the consumos and demandas tables.
+    It must be called in the same transaction of every write of values, with the cursor of the transaction.
+    When keys are given, only the prices of the months touched are read, with tariffModule.queryPrices, so a single write
+    doesn't load the whole tarifas table
+
+    :param db: The connectionModule.connectionManager of the cursor, used to read the tariffs
+    :param cursor: The cursor of the transaction
+    :param keys: An iterable of tuples (uc_id, year, month). If None, every UC month is recalculated
+    :param chunkSize: How many rows are read and written at a time
+
+    :return: int, how many rows were written in rollup_mensal
+    '''
+    join = ''
+    lookup = None
+    if keys is not None:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS rollup_chaves (uc_id INTEGER, ano INTEGER, mes TEXT)')
+        cursor.execute('DELETE FROM rollup_chaves')
+        db.bulkInsert(cursor, 'rollup_chaves', keys)
+        cursor.execute('DELETE FROM rollup_mensal WHERE (uc_id, ano, mes) IN (SELECT uc_id, ano, mes FROM rollup_chaves)')
+        join = 'JOIN rollup_chaves k ON k.uc_id = r.uc_id AND k.ano = r.ano AND k.mes = r.mes'
+        lookup = functools.partial(tariffModule.queryPrices, db)
+    else:
+        cursor.execute('DELETE FROM rollup_mensal')
+
+    written = 0
+    for rollup in rollupRows(db, join=join, chunkSize=chunkSize, lookup=lookup):
+        db.bulkInsert(cursor, 'rollup_mensal', rollup)
+        written += len(rollup)
+
+    if keys is not None:
+        cursor.execute('DELETE FROM rollup_chaves')
+
+    return written
+
+
+def rebuild(db = None) -> int:
+    '''
+    This function recalculates the whole rollup_mensal table. It's needed once after upgrading an existing database and
+    every time the tarifas table changes
+
+    :return: int, how many rows were written
+    '''
+    db = connectionModule.resolve(db, clientsModule.dbName)
+
+    with db.transaction() as cursor:
+        return refresh(db, cursor)
+
+
+def readTotals(cnpj: str = None, ucNumber: str = None, years: list = None, months: list = None, valueTypes: list = None, db = None) -> dict:
+    '''
+    This function reads the totals of values and costs from rollup_mensal, in a single query
+
+    :param cnpj: If filled, only the UCs of this client are summed
+    :param ucNumber: If filled, only this UC is summed
+    :param years: The reference years. If None, all the years are considered
+    :param months: The reference months. If None, all the months are considered
+    :param valueTypes: The value types, from valueTypesList. If None, all of them are considered
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict {(year, month, valueType): (value, cost)}
+    '''
+    db = connectionModule.resolve(db, clientsModule.dbName)
+
+    filters = ''
+    params = []
+    if cnpj is not None:
+        filters += ' AND r.cliente_id = (SELECT id FROM clientes WHERE cnpj = ?)'
+        params.append(cnpj)
+    if ucNumber is not None:
+        filters += ' AND r.uc_id = (SELECT id FROM ucs WHERE numero = ?)'
+        params.append(ucNumber)
+    for column, values in (('r.ano', years), ('r.mes', months), ('r.tipo', valueTypes)):
+        if values:
+            filters += f" AND {column} IN ({','.join('?' * len(values))})"
+            params.extend(values)
+
+    rows = db.cursor().execute(
+        f'''
+        SELECT r.ano, r.mes, r.tipo, SUM(r.valor), SUM(r.custo)
+        FROM rollup_mensal r
+        WHERE 1 = 1{filters}
+        GROUP BY r.ano, r.mes, r.tipo
+        ''', params
+    )
+
+    return {(year, month, valueType): (value, cost) for year, month, valueType, value, cost in rows}
+
+
+def yearOverYear(year: int, cnpj: str = None, ucNumber: str = None, db = None) -> dict:
+    '''
+    This function compares every month of a year with the same month of the year before, from rollup_mensal
+
+    :return: dict {month: {valueType: {'atual': (value, cost), 'anterior': (value, cost)}}}. Missing values are (0, 0)
+    '''
+    totals = readTotals(cnpj, ucNumber, [year - 1, year], db=db)
+
+    return {
+        month: {
+            valueType: {
+                'atual': totals.get((year, month, valueType), (0, 0)),
+                'anterior': totals.get((year - 1, month, valueType), (0, 0))
+            } for valueType in clientsModule.valueTypesList
+        } for month in clientsModule.monthDict
+    }
+
+
+if __name__ == '__main__':
+    dbPath = sys.argv[1] if len(sys.argv) > 1 else clientsModule.dbName
+    print(f'{dbPath}: {rebuild(connectionModule.getManager(dbPath))} rows in rollup_mensal')
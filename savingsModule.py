@@ -0,0 +1,155 @@
+import datetime as dt
+
+import pandas   as pd
+
+import connectionModule
+import costModule
+from clientsModule import dbName, monthDict, costCategoryList
+
+
+def recordCosts(rows, db = None) -> dict:
+    '''
+    This function registers the real costs of many UCs at once in the lancamentos table, in a single transaction.
+    A cost already registered for the same UC, month and category is replaced
+
+    :param rows: An iterable of tuples (ucNumber, month, category, value, year), or a DataFrame with the columns
+        'number', 'month', 'category', 'value' and 'year'. The category must be in costCategoryList. If year is None, the current year is considered
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: dict with the keys 'recorded', how many costs were written, and 'conflicts', a list of tuples (row index, row, reason).
+        The reason can be 'category not recognized', 'month not recognized' or 'UC not found'
+    '''
+    db = connectionModule.resolve(db, dbName)
+    date = dt.datetime.now()
+
+    if hasattr(rows, 'itertuples'):
+        rows = rows[['number', 'month', 'category', 'value', 'year']].itertuples(index=False, name=None)
+
+    rows = list(rows)
+    conflicts = []
+
+    with db.transaction() as cursor:
+        numbers = list({row[0] for row in rows})
+        ucIDs = {}
+        for start in range(0, len(numbers), 500):
+            chunk = numbers[start:start + 500]
+            ucIDs.update(cursor.execute(
+                f'''
+                SELECT numero, id
+                FROM ucs
+                WHERE numero IN ({','.join('?' * len(chunk))})
+                ''', chunk
+            ).fetchall())
+
+        batch = []
+        for index, row in enumerate(rows):
+            number, month, category, value, year = row
+            year = int(year) if year and year == year else date.year
+
+            if category not in costCategoryList:
+                conflicts.append((index, row, 'category not recognized'))
+            elif month not in monthDict:
+                conflicts.append((index, row, 'month not recognized'))
+            elif number not in ucIDs:
+                conflicts.append((index, row, 'UC not found'))
+            else:
+                batch.append((ucIDs[number], month, year, category, value, date))
+
+        cursor.executemany(
+            '''
+            INSERT INTO lancamentos (uc_id, mes, ano, categoria, valor, created_at)
+            VALUES (?,?,?,?,?,?)
+            ON CONFLICT (uc_id, ano, mes, categoria) DO UPDATE SET valor = excluded.valor, created_at = excluded.created_at
+            ''', batch
+        )
+
+    return {'recorded': len(batch), 'conflicts': conflicts}
+
+
+def readCosts(db, years: list, months: list, utility: str = None, subgroups: list = None, ucNumbers: list = None) -> pd.DataFrame:
+    '''
+    This function reads every real cost of a period in a single query, already summed by UC month and category
+
+    :return: DataFrame with the columns numero, ano, mes, categoria, valor
+    '''
+    filters, params = costModule._filters(utility, subgroups, ucNumbers)
+
+    rows = db.cursor().execute(
+        f'''
+        SELECT u.numero, r.ano, r.mes, r.categoria, SUM(r.valor)
+        FROM lancamentos r
+        JOIN ucs u ON u.id = r.uc_id
+        WHERE r.ano IN ({','.join('?' * len(years))}) AND r.mes IN ({','.join('?' * len(months))}){filters}
+        GROUP BY u.numero, r.ano, r.mes, r.categoria
+        ''', list(years) + list(months) + params
+    ).fetchall()
+
+    return pd.DataFrame(rows, columns=['numero', 'ano', 'mes', 'categoria', 'valor'])
+
+
+def ucNumbersOf(db, cnpj: str) -> list:
+    '''
+    This function returns the numbers of the UCs linked to a client
+    '''
+    rows = db.cursor().execute(
+        '''
+        SELECT u.numero
+        FROM ucs u
+        JOIN clientes cl ON cl.id = u.client_id
+        WHERE cl.cnpj = ?
+        ''', (cnpj,)
+    )
+
+    return [number for (number,) in rows]
+
+
+def portfolioSavings(year, months: list = None, utility: str = None, subgroups: list = None, ucNumbers: list = None, cnpj: str = None, db = None) -> pd.DataFrame:
+    '''
+    This function calculates the savings of a whole portfolio: the regulated cost, priced by costModule.portfolioCosts, minus the
+    real cost registered in lancamentos. Readings, tariffs and real costs are read with one query each and joined as whole columns
+
+    :param year: A reference year or a list of years
+    :param months: A list of reference months. If None, all the months are considered
+    :param utility: If filled, only the UCs of this utility are considered
+    :param subgroups: If filled, only the UCs of these subgroups are considered
+    :param ucNumbers: If filled, only these UCs are considered
+    :param cnpj: If filled, only the UCs linked to this client are considered
+    :param db: The database used. It accepts a connectionModule.connectionManager or a sqlite3 connection
+
+    :return: DataFrame indexed by (numero, ano, mes), with the columns:
+        - custoRegulado: the cost with the tariffs of the utility. NaN when some reading had no tariff or there's no reading
+        - one column for each category of costCategoryList, and custoReal, their sum. NaN when nothing was registered
+        - economia: custoRegulado minus custoReal. NaN when any of them is NaN
+        - missingTariff: True when some reading of the month had no tariff to be priced with
+    '''
+    db = connectionModule.resolve(db, dbName)
+    years = [year] if isinstance(year, int) else list(year)
+    months = list(months or monthDict)
+    columns = ['custoRegulado'] + costCategoryList + ['custoReal', 'economia', 'missingTariff']
+
+    if cnpj is not None:
+        linked = ucNumbersOf(db, cnpj)
+        ucNumbers = [number for number in linked if number in ucNumbers] if ucNumbers else linked
+
+        # um cliente sem UCs não pode virar um filtro vazio, que consideraria todas as UCs
+        if not ucNumbers:
+            return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_tuples([], names=['numero', 'ano', 'mes']))
+
+    regulated = costModule.portfolioCosts(years, months, utility, subgroups, ucNumbers, db)
+    regulated = pd.DataFrame({
+        'custoRegulado': regulated['total'].where(~regulated['missingTariff'].astype(bool)),
+        'missingTariff': regulated['missingTariff'].astype(bool)
+    })
+
+    costs = readCosts(db, years, months, utility, subgroups, ucNumbers)
+    real = costs.pivot_table(index=['numero', 'ano', 'mes'], columns='categoria', values='valor', aggfunc='sum')
+    real = real.reindex(columns=costCategoryList)
+    if costs.empty:
+        real.index = pd.MultiIndex.from_tuples([], names=['numero', 'ano', 'mes'])
+
+    savings = regulated.join(real, how='outer')
+    savings['custoReal'] = savings[costCategoryList].sum(axis=1, min_count=1)
+    savings['economia'] = savings['custoRegulado'] - savings['custoReal']
+    savings['missingTariff'] = savings['missingTariff'].fillna(False).astype(bool)
+
+    return savings[columns]
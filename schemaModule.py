@@ -0,0 +1,375 @@
+'''
+Every change in the database structure used by clientsModule must be appended to the migrations list as a new version.
+Applied versions are recorded in the schema_version table, so existing databases are upgraded in place.
+A statement can be a string, a tuple (statement, list of params), which is run with executemany, or a function f(cursor)
+for what SQL alone can't do. Statements are written for sqlite. With PostgreSQL, the cursors of backendModule translate them
+'''
+import sys
+import json
+import logging
+import datetime as dt
+
+logger = logging.getLogger('schemaModule')
+
+postoList = [
+    'Nao se aplica',
+    'Ponta',
+    'Fora ponta'
+]
+
+# tabelas com chaves que os índices únicos da versão 2 passam a exigir: (tabela, chave, registro mantido, referências)
+# lancamentos só é criada na versão 6, então ainda não há o que apontar para as UCs nela
+duplicateList = [
+    ('clientes', ['cnpj'], 'last', [('ucs', 'client_id')]),
+    ('ucs', ['numero'], 'last', [('consumos', 'uc_id'), ('demandas', 'uc_id')]),
+    ('posto', ['descricao'], 'first', [('consumos', 'posto_id'), ('demandas', 'posto_id')]),
+    ('consumos', ['uc_id', 'posto_id', 'ano', 'mes'], 'last', []),
+    ('demandas', ['uc_id', 'posto_id', 'ano', 'mes'], 'last', []),
+    ('tarifas', ['concessionaria', 'modalidade', 'subgrupo', 'classe', 'posto', 'unidade', 'inicio_vigencia'], 'last', []),
+]
+
+
+def mergeDuplicates(cursor) -> int:
+    '''
+    This function removes the repeated registers of old databases, which would prevent the unique indexes of version 2.
+    Of each group with the same key, the most recent register is kept (the first one for posto), and before the others are
+    deleted, the registers that point to them are moved to the kept one. Every deleted register is saved, as JSON, in the
+    duplicados_removidos table, and their number is logged as a warning. Registers with an empty key are kept, since the
+    unique indexes accept them
+
+    :return: int, how many registers were removed
+    '''
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS duplicados_removidos (
+            tabela              TEXT,
+            id                  INTEGER,
+            mantido_id          INTEGER,
+            registro            TEXT,
+            removido_em         TEXT
+        )
+        '''
+    )
+
+    date = dt.datetime.now()
+    total = 0
+    for table, key, keep, references in duplicateList:
+        columns = ', '.join(key)
+        rows = cursor.execute(
+            f'''
+            SELECT {columns}, id
+            FROM {table}
+            WHERE ({columns}) IN (SELECT {columns} FROM {table} GROUP BY {columns} HAVING COUNT(*) > 1)
+            ORDER BY {columns}, id
+            '''
+        ).fetchall()
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[:-1], []).append(row[-1])
+
+        # pares (id removido, id mantido)
+        removed = []
+        for ids in groups.values():
+            kept = ids[-1] if keep == 'last' else ids[0]
+            removed.extend((registerID, kept) for registerID in ids if registerID != kept)
+
+        if not removed:
+            continue
+
+        for reference, column in references:
+            cursor.executemany(f'UPDATE {reference} SET {column} = ? WHERE {column} = ?', [(kept, registerID) for registerID, kept in removed])
+
+        names = [column[0] for column in cursor.execute(f'SELECT * FROM {table} LIMIT 0').description]
+        for registerID, kept in removed:
+            register = cursor.execute(f'SELECT * FROM {table} WHERE id = ?', (registerID,)).fetchone()
+            cursor.execute(
+                'INSERT INTO duplicados_removidos (tabela, id, mantido_id, registro, removido_em) VALUES (?,?,?,?,?)',
+                (table, registerID, kept, json.dumps(dict(zip(names, register)), default=str), date)
+            )
+
+        cursor.executemany(f'DELETE FROM {table} WHERE id = ?', [(registerID,) for registerID, kept in removed])
+        logger.warning('%s: %d repeated registers merged into the kept ones and saved in duplicados_removidos', table, len(removed))
+        total += len(removed)
+
+    return total
+
+
+migrations = [
+    (1, 'tabelas', [
+        '''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome                TEXT,
+            endereco            TEXT,
+            cep                 TEXT,
+            cnpj                TEXT,
+            email               TEXT,
+            telefone            TEXT,
+            responsavel_legal   TEXT,
+            forma_de_pagamento  TEXT,
+            created_at          TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ucs (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero              TEXT,
+            concessionaria      TEXT,
+            client_id           INTEGER REFERENCES clientes (id),
+            endereco            TEXT,
+            cep                 TEXT,
+            subgrupo            TEXT,
+            modalidade          TEXT,
+            classe              TEXT,
+            demanda             REAL,
+            demanda_ponta       REAL,
+            demanda_fora_ponta  REAL,
+            created_at          TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS posto (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao           TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS consumos (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            uc_id               INTEGER REFERENCES ucs (id),
+            posto_id            INTEGER REFERENCES posto (id),
+            mes                 TEXT,
+            ano                 INTEGER,
+            valor               REAL,
+            created_at          TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS demandas (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            uc_id               INTEGER REFERENCES ucs (id),
+            posto_id            INTEGER REFERENCES posto (id),
+            mes                 TEXT,
+            ano                 INTEGER,
+            valor               REAL,
+            created_at          TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tarifas (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            inicio_vigencia     TEXT,
+            fim_vigencia        TEXT,
+            concessionaria      TEXT,
+            modalidade          TEXT,
+            subgrupo            TEXT,
+            classe              TEXT,
+            posto               TEXT,
+            unidade             TEXT,
+            tusd                REAL,
+            te                  REAL
+        )
+        ''',
+        (
+            'INSERT INTO posto (descricao) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM posto WHERE descricao = ?)',
+            [(posto, posto) for posto in postoList]
+        ),
+    ]),
+    (2, 'indices', [
+        # bancos antigos podem ter registros repetidos, que impediriam os índices únicos
+        mergeDuplicates,
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_clientes_cnpj ON clientes (cnpj)',
+        'CREATE INDEX IF NOT EXISTS ix_clientes_nome ON clientes (nome)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_ucs_numero ON ucs (numero)',
+        'CREATE INDEX IF NOT EXISTS ix_ucs_client_id ON ucs (client_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_posto_descricao ON posto (descricao)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_consumos_chave ON consumos (uc_id, posto_id, ano, mes)',
+        'CREATE INDEX IF NOT EXISTS ix_consumos_periodo ON consumos (ano, mes, posto_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_demandas_chave ON demandas (uc_id, posto_id, ano, mes)',
+        'CREATE INDEX IF NOT EXISTS ix_demandas_periodo ON demandas (ano, mes, posto_id)',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_tarifas_chave
+        ON tarifas (concessionaria, modalidade, subgrupo, classe, posto, unidade, inicio_vigencia)
+        ''',
+    ]),
+    (3, 'checkpoint e falhas da caixa de email', [
+        '''
+        CREATE TABLE IF NOT EXISTS ingestao_checkpoint (
+            caixa               TEXT PRIMARY KEY,
+            ultimo_uid          INTEGER,
+            updated_at          TEXT
+        )
+        ''',
+        # mensagens que o checkpoint já passou sem conseguir ler, lidas de novo a cada ingestão até darem certo
+        '''
+        CREATE TABLE IF NOT EXISTS ingestao_falhas (
+            caixa               TEXT,
+            uid                 INTEGER,
+            erro                TEXT,
+            tentativas          INTEGER,
+            updated_at          TEXT,
+            PRIMARY KEY (caixa, uid)
+        )
+        ''',
+    ]),
+    (4, 'fila de envio de emails', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            destinatario        TEXT,
+            assunto             TEXT,
+            corpo               TEXT,
+            anexo               TEXT,
+            status              TEXT,
+            tentativas          INTEGER DEFAULT 0,
+            proxima_tentativa   TEXT,
+            ultimo_erro         TEXT,
+            created_at          TEXT,
+            enviado_em          TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS ix_outbox_status ON outbox (status, proxima_tentativa)',
+    ]),
+    (5, 'consolidado mensal', [
+        # mantida por rollupModule a cada escrita de valores. Bancos atualizados precisam de um rebuild
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_mensal (
+            cliente_id          INTEGER,
+            uc_id               INTEGER,
+            ano                 INTEGER,
+            mes                 TEXT,
+            posto_id            INTEGER,
+            tipo                TEXT,
+            valor               REAL,
+            custo               REAL,
+            PRIMARY KEY (uc_id, ano, mes, posto_id, tipo)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS ix_rollup_cliente ON rollup_mensal (cliente_id, ano, mes)',
+        'CREATE INDEX IF NOT EXISTS ix_rollup_periodo ON rollup_mensal (ano, mes)',
+    ]),
+    (6, 'lancamentos de custos reais', [
+        # custos efetivamente pagos pela UC (cooperativa, ACL, encargos), comparados com o custo regulado para a economia
+        '''
+        CREATE TABLE IF NOT EXISTS lancamentos (
+            id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+            uc_id               INTEGER REFERENCES ucs (id),
+            mes                 TEXT,
+            ano                 INTEGER,
+            categoria           TEXT,
+            valor               REAL,
+            created_at          TEXT
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_lancamentos_chave ON lancamentos (uc_id, ano, mes, categoria)',
+        'CREATE INDEX IF NOT EXISTS ix_lancamentos_periodo ON lancamentos (ano, mes)',
+    ]),
+    (7, 'diario de alteracoes', [
+        # AUTOINCREMENT garante que seq nunca é reutilizado, e as escritas serializadas do sqlite, que cresce na ordem dos commits
+        '''
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            seq                 INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela              TEXT,
+            operacao            TEXT,
+            chave               INTEGER,
+            uc_id               INTEGER,
+            ano                 INTEGER,
+            mes                 TEXT,
+            created_at          TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS alteracoes_checkpoint (
+            consumidor          TEXT PRIMARY KEY,
+            seq                 INTEGER,
+            updated_at          TEXT
+        )
+        ''',
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS tr_{table}_{operation} AFTER {operation.upper()} ON {table}
+        BEGIN
+            INSERT INTO alteracoes (tabela, operacao, chave, uc_id, ano, mes)
+            VALUES ('{table}', '{operation}', {row}.id, {ucID.format(row=row)}, {period.format(row=row)});
+        END
+        '''
+        for table, ucID, period in (
+            ('consumos', '{row}.uc_id', '{row}.ano, {row}.mes'),
+            ('demandas', '{row}.uc_id', '{row}.ano, {row}.mes'),
+            ('lancamentos', '{row}.uc_id', '{row}.ano, {row}.mes'),
+            ('ucs', '{row}.id', 'NULL, NULL'),
+            ('clientes', 'NULL', 'NULL, NULL'),
+            ('tarifas', 'NULL', 'NULL, NULL'),
+        )
+        for operation, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD'))
+    ]),
+    (8, 'marca pendente dos consumidores do diario', [
+        # com PostgreSQL, o último seq lido com transações abertas só é lido pelo consumidor depois que elas terminam
+        'ALTER TABLE alteracoes_checkpoint ADD COLUMN pendente_seq INTEGER',
+        'ALTER TABLE alteracoes_checkpoint ADD COLUMN pendente_horizonte BIGINT',
+    ]),
+]
+
+
+def currentVersion(cursor) -> int:
+    '''
+    This function returns the schema version of the database. A database without the schema_version table is version 0
+    '''
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao      INTEGER PRIMARY KEY,
+            descricao   TEXT,
+            aplicada_em TEXT
+        )
+        '''
+    )
+    version = cursor.execute('SELECT MAX(versao) FROM schema_version').fetchone()[0]
+
+    return version or 0
+
+
+def migrate(db) -> int:
+    '''
+    This function creates or upgrades the database to the last version of the schema.
+    Each version is applied in its own transaction
+
+    :param db: A connectionModule.connectionManager
+
+    :return: The version of the database after the upgrade
+    '''
+    with db.transaction() as cursor:
+        version = currentVersion(cursor)
+
+    for number, description, statements in migrations:
+        if number <= version:
+            continue
+
+        with db.transaction() as cursor:
+            for statement in statements:
+                if isinstance(statement, tuple):
+                    cursor.executemany(*statement)
+                elif callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+
+            cursor.execute(
+                '''
+                INSERT INTO schema_version (versao, descricao, aplicada_em)
+                VALUES (?,?,?)
+                ''', (number, description, dt.datetime.now())
+            )
+
+        version = number
+
+    return version
+
+
+if __name__ == '__main__':
+    import backendModule
+    import connectionModule
+
+    dbPath = sys.argv[1] if len(sys.argv) > 1 else backendModule.defaultDatabase('agv.db')
+    print(f'{dbPath}: schema version {migrate(connectionModule.connectionManager(dbPath))}')
@@ -0,0 +1,611 @@
+'''
+Read-only HTTP service over clientsModule, for dashboards and other systems that look up consumptions and costs.
+The requests are answered by a fixed pool of threads, each with its own read-only connection, opened when the service
+starts, and the tariff repository is loaded once for all of them. The results are kept by a cacheModule.resultCache, keyed
+by (entity, key, period, type), and every request first reads the change journal (journalModule) to discard the results
+of whatever was written since, by this or any other process. Each route keeps its latency percentiles, given by /metrics
+Routes
+------
+    GET /clientes/{cnpj}
+    GET /clientes/{cnpj}/ucs
+    GET /clientes/{cnpj}/consumo?mes=jan&ano=2024&tipo=consumption
+    GET /clientes/{cnpj}/custo?mes=jan&ano=2024
+    GET /ucs/{numero}
+    GET /ucs/{numero}/valor?mes=jan&ano=2024&tipo=peak-demand
+    GET /ucs/{numero}/custo?mes=jan&ano=2024
+    GET /metrics
+    GET /health
+Usage
+-----
+    python serviceModule.py serve --db agv.db --port 8080 --workers 8
+    python serviceModule.py loadtest --db agv.db --url http://127.0.0.1:8080 --requests 5000 --concurrency 16
+'''
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import threading
+import datetime as dt
+import urllib.error
+import urllib.request
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cacheModule
+import tariffModule
+import journalModule
+import clientsModule
+import instrumentModule
+import connectionModule
+from clientsModule import dbName, monthDict, valueTypesList
+
+logger = logging.getLogger('serviceModule')
+
+
+def _percentile(values: list, fraction: float) -> float:
+    # values já vem ordenada. Percentil pelo posto mais próximo
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class latencyMetrics:
+    '''
+    This class keeps the latencies of the requests of each route: counters, a histogram over instrumentModule.bucketList
+    and the last window latencies, from which the percentiles are calculated
+    '''
+    def __init__(self, window: int = 10000) -> None:
+        '''
+        Constructor of the class latencyMetrics
+
+        :param window: How many of the last latencies of each route are kept for the percentiles
+        '''
+        self.window     = window
+        self.started    = time.time()
+        self._routes    = {}
+        self._lock      = threading.Lock()
+
+    def record(self, route: str, elapsed: float, status: int, cached: bool = False) -> None:
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'cached': 0,
+                    'seconds': 0.0,
+                    'histogram': [0] * (len(instrumentModule.bucketList) + 1),
+                    'latencies': deque(maxlen=self.window)
+                }
+
+            entry['requests'] += 1
+            entry['errors'] += status >= 400
+            entry['cached'] += cached
+            entry['seconds'] += elapsed
+            entry['latencies'].append(elapsed)
+
+            position = 0
+            while position < len(instrumentModule.bucketList) and elapsed > instrumentModule.bucketList[position]:
+                position += 1
+            entry['histogram'][position] += 1
+
+    def snapshot(self) -> dict:
+        '''
+        This method returns the metrics of every route
+
+        :return: dict {route: {'requests', 'errors', 'cached', 'mean', 'p50', 'p95', 'p99', 'max', 'histogram'}}, in seconds
+        '''
+        with self._lock:
+            routes = {route: (dict(entry), sorted(entry['latencies'])) for route, entry in self._routes.items()}
+
+        return {
+            route: {
+                'requests': entry['requests'],
+                'errors': entry['errors'],
+                'cached': entry['cached'],
+                'mean': entry['seconds'] / entry['requests'],
+                'p50': _percentile(latencies, 0.50),
+                'p95': _percentile(latencies, 0.95),
+                'p99': _percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+                'histogram': list(entry['histogram'])
+            }
+            for route, (entry, latencies) in routes.items()
+        }
+
+
+class httpError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class queryService:
+    '''
+    This class answers the queries of the service, keeping their results in a cacheModule.resultCache.
+    The results are tagged with ('uc', id) and ('cliente', id), and sync discards them by the changes of the journal:
+        - consumos, demandas and lancamentos: the results of the UC and of its client
+        - clientes: the results of the client
+        - ucs and tarifas: every result, since they change links and prices of many UCs at once
+    The service has its own connectionManager, whose identity map is kept in a session for the whole life of the service,
+    since sync clears it by the journal too. The last seq read by sync is saved as the checkpoint of a consumer of
+    journalModule, so journalModule.prune, run by any process, keeps the changes the service still didn't read.
+    close ends the session and deletes the checkpoint
+    '''
+    def __init__(self, dbName: str = dbName, cacheSize: int = 10000, maxChanges: int = 10000, window: int = 10000, consumer: str = None) -> None:
+        '''
+        Constructor of the class queryService
+
+        :param dbName: The path of the sqlite database
+        :param cacheSize: How many results are kept in memory
+        :param maxChanges: If more changes than this were written since the last sync, the whole cache is discarded instead
+        :param window: How many of the last latencies of each route are kept for the percentiles
+        :param consumer: The name of the checkpoint of the service in the journal. If None, one of this host and process
+        '''
+        # o banco é criado ou migrado pelo gerenciador compartilhado, que também grava o checkpoint, e o serviço só lê com o seu próprio
+        self._writer    = connectionModule.getManager(dbName)
+
+        self.db         = connectionModule.connectionManager(dbName, readOnly=True)
+        self.consumer   = consumer or f'servico_{socket.gethostname()}_{os.getpid()}_{id(self)}'
+        self.cache      = cacheModule.resultCache(cacheSize)
+        self.metrics    = latencyMetrics(window)
+        self.maxChanges = maxChanges
+        self._syncLock  = threading.Lock()
+        self._columns   = {
+            table: [column[0] for column in self.db.cursor().execute(f'SELECT * FROM {table} LIMIT 0').description]
+            for table in ('clientes', 'ucs', 'consumos')
+        }
+
+        self.db.identity.begin()
+
+        # o checkpoint é gravado antes da marca ser lida, para que nada depois dela seja podado nesse meio tempo
+        self._pending = None
+        self._checkpoint(0)
+
+        # sem um seq completo, o primeiro sync lê o diário desde o início
+        seq, self._pending = journalModule.watermark(db=self.db)
+        self.cache.seq  = seq or 0
+        self._checkpoint(self.cache.seq)
+
+    def _checkpoint(self, seq: int) -> None:
+        with self._writer.transaction() as cursor:
+            journalModule.saveCheckpoint(cursor, self.consumer, seq, self._pending)
+
+    def close(self) -> None:
+        '''
+        This method ends the session of the identity map of the service, deletes its checkpoint and closes its connections
+        '''
+        journalModule.deleteCheckpoint(self.consumer, self._writer)
+        self.db.identity.end()
+        self.db.closeAll()
+
+    def warm(self) -> None:
+        '''
+        This method opens the connection of the current thread and loads the tariff repository, if it wasn't loaded yet
+        '''
+        self.db.connection()
+        tariffModule.getRepository(self.db)._getIndex()
+
+    def sync(self) -> None:
+        '''
+        This method discards the results changed by what was written in the journal after the last sync
+        '''
+        if journalModule.lastSeq(self.db) == self.cache.seq:
+            return
+
+        with self._syncLock:
+            # só até a marca do diário, para não passar por uma alteração de uma transação ainda aberta
+            seq, self._pending = journalModule.watermark(self._pending, self.db)
+            if seq is None or seq <= self.cache.seq:
+                return
+
+            # o checkpoint do serviço impede a poda do que ainda não foi lido, e os seqs que faltam são de transações desfeitas
+            changes = journalModule.changesSince(self.cache.seq, limit=self.maxChanges + 1, db=self.db, until=seq)
+            tables = {change[1] for change in changes}
+
+            if len(changes) > self.maxChanges or tables & {'ucs', 'tarifas'}:
+                self.cache.clear()
+                self.db.identity.clear()
+                tariffModule.invalidate(self.db)
+                self._advance(seq)
+                return
+
+            ucIDs = {change[4] for change in changes if change[1] != 'clientes' and change[4] is not None}
+            clientIDs = {change[3] for change in changes if change[1] == 'clientes'}
+            if ucIDs:
+                rows = self.db.cursor().execute(
+                    f"SELECT client_id FROM ucs WHERE id IN ({','.join('?' * len(ucIDs))})", list(ucIDs)
+                ).fetchall()
+                clientIDs.update(row[0] for row in rows if row[0] is not None)
+
+            for ucID in ucIDs:
+                self.cache.invalidate(('uc', ucID))
+            for clientID in clientIDs:
+                self.cache.invalidate(('cliente', clientID))
+
+            # o mapa de identidade guarda os clientes por cnpj e nome, que o diário não traz
+            if 'clientes' in tables:
+                self.db.identity.clear()
+
+            self._advance(seq)
+
+    def _advance(self, seq: int) -> None:
+        self.cache.seq = seq
+        self._checkpoint(seq)
+
+    def _cached(self, key: tuple, compute) -> tuple:
+        found, result = self.cache.get(key)
+        if found:
+            return result, True
+
+        generation = self.cache.generation
+        result, tags = compute()
+        self.cache.put(key, result, tags, generation)
+
+        return result, False
+
+    def _client(self, cnpj: str):
+        register = clientsModule.client(None, None, None, cnpj, None, None, None, db=self.db).readClient()
+        if register is None:
+            raise httpError(404, 'Client not registered')
+
+        return register
+
+    def _uc(self, ucNumber: str):
+        register = clientsModule.uc(None, ucNumber, None, None, None, None, None, None, db=self.db).readUC()
+        if register is None:
+            raise httpError(404, 'UC not found')
+
+        return register
+
+    def _build(self, register) -> clientsModule.uc:
+        return clientsModule.uc(
+            register[2], register[1], None, register[4], register[5], register[6], register[7], register[8],
+            peakDemand=register[10], offPeakDemand=register[11], demand=register[9], db=self.db
+        )
+
+    def client(self, cnpj: str) -> tuple:
+        def compute():
+            register = self._client(cnpj)
+            return dict(zip(self._columns['clientes'], register)), (('cliente', register[0]),)
+
+        return self._cached(('cliente', cnpj, None, 'registro'), compute)
+
+    def clientUCs(self, cnpj: str) -> tuple:
+        def compute():
+            register = self._client(cnpj)
+            owner = clientsModule.client(register[1], None, None, cnpj, None, None, None, db=self.db)
+            return {'cnpj': cnpj, 'ucs': owner.ucList.numbers()}, (('cliente', register[0]),)
+
+        return self._cached(('cliente', cnpj, None, 'ucs'), compute)
+
+    def clientConsumption(self, cnpj: str, month: str, year: int, valueType: str) -> tuple:
+        def compute():
+            register = self._client(cnpj)
+            owner = clientsModule.client(register[1], None, None, cnpj, None, None, None, db=self.db)
+            total = owner.totalConsumption(month, valueType, year)
+            return {'cnpj': cnpj, 'ano': year, 'mes': month, 'tipo': valueType, 'valor': total}, (('cliente', register[0]),)
+
+        return self._cached(('cliente', cnpj, (year, month), valueType), compute)
+
+    def clientCosts(self, cnpj: str, month: str, year: int) -> tuple:
+        def compute():
+            register = self._client(cnpj)
+            owner = clientsModule.client(register[1], None, None, cnpj, None, None, None, db=self.db)
+            total = owner.totalCosts(month, year)
+            return {'cnpj': cnpj, 'ano': year, 'mes': month, 'custo': total}, (('cliente', register[0]),)
+
+        return self._cached(('cliente', cnpj, (year, month), 'custo'), compute)
+
+    def uc(self, ucNumber: str) -> tuple:
+        def compute():
+            register = self._uc(ucNumber)
+            return dict(zip(self._columns['ucs'], register)), (('uc', register[0]), ('cliente', register[3]))
+
+        return self._cached(('uc', ucNumber, None, 'registro'), compute)
+
+    def ucValue(self, ucNumber: str, month: str, year: int, valueType: str) -> tuple:
+        def compute():
+            register = self._uc(ucNumber)
+            value = self._build(register).readValue(month, valueType, year)
+            if value is None:
+                raise httpError(404, 'Value not registered')
+            return dict(zip(self._columns['consumos'], value), tipo=valueType), (('uc', register[0]),)
+
+        return self._cached(('uc', ucNumber, (year, month), valueType), compute)
+
+    def ucCosts(self, ucNumber: str, month: str, year: int) -> tuple:
+        def compute():
+            register = self._uc(ucNumber)
+            cost = self._build(register).monthlyCosts(month, year)
+            return {'uc': ucNumber, 'ano': year, 'mes': month, 'custo': cost}, (('uc', register[0]),)
+
+        return self._cached(('uc', ucNumber, (year, month), 'custo'), compute)
+
+    def status(self) -> dict:
+        return {
+            'uptime': time.time() - self.metrics.started,
+            'connections': self.db.connectionCount(),
+            'cache': {
+                'size': len(self.cache),
+                'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'seq': self.cache.seq
+            },
+            'routes': self.metrics.snapshot()
+        }
+
+
+def _period(query: dict) -> tuple:
+    month = query.get('mes', [None])[0]
+    if month not in monthDict:
+        raise httpError(400, 'mes must be one of ' + ', '.join(monthDict))
+
+    try:
+        year = int(query.get('ano', [dt.datetime.now().year])[0])
+    except ValueError:
+        raise httpError(400, 'ano must be an integer')
+
+    return month, year
+
+
+def _valueType(query: dict) -> str:
+    valueType = query.get('tipo', ['consumption'])[0]
+    if valueType not in valueTypesList:
+        raise httpError(400, 'tipo must be one of ' + ', '.join(valueTypesList))
+
+    return valueType
+
+
+# cada rota: (padrão do caminho, nome nas métricas, função que responde)
+routeList = [
+    (re.compile(r'/clientes/([^/]+)'), '/clientes/{cnpj}', lambda service, key, query: service.client(key)),
+    (re.compile(r'/clientes/([^/]+)/ucs'), '/clientes/{cnpj}/ucs', lambda service, key, query: service.clientUCs(key)),
+    (re.compile(r'/clientes/([^/]+)/consumo'), '/clientes/{cnpj}/consumo', lambda service, key, query: service.clientConsumption(key, *_period(query), _valueType(query))),
+    (re.compile(r'/clientes/([^/]+)/custo'), '/clientes/{cnpj}/custo', lambda service, key, query: service.clientCosts(key, *_period(query))),
+    (re.compile(r'/ucs/([^/]+)'), '/ucs/{numero}', lambda service, key, query: service.uc(key)),
+    (re.compile(r'/ucs/([^/]+)/valor'), '/ucs/{numero}/valor', lambda service, key, query: service.ucValue(key, *_period(query), _valueType(query))),
+    (re.compile(r'/ucs/([^/]+)/custo'), '/ucs/{numero}/custo', lambda service, key, query: service.ucCosts(key, *_period(query)))
+]
+
+
+class requestHandler(BaseHTTPRequestHandler):
+    '''
+    This class answers the requests of the service. Only GET is accepted, and every answer is JSON
+    '''
+    server_version = 'agv-service/1.0'
+
+    def do_GET(self) -> None:
+        start = time.perf_counter()
+        service = self.server.service
+        parts = urlsplit(self.path)
+        route = parts.path
+        cached = False
+
+        try:
+            if parts.path == '/health':
+                status, body = 200, {'status': 'ok'}
+
+            elif parts.path == '/metrics':
+                status, body = 200, service.status()
+
+            else:
+                for pattern, name, answer in routeList:
+                    match = pattern.fullmatch(parts.path)
+                    if match:
+                        route = name
+                        service.sync()
+                        body, cached = answer(service, unquote(match.group(1)), parse_qs(parts.query))
+                        status = 200
+                        break
+                else:
+                    route = 'other'
+                    raise httpError(404, 'Route not found')
+
+        except httpError as error:
+            status, body = error.status, {'erro': str(error)}
+
+        except RuntimeError as error:
+            # erros do domínio, como falta de tarifa para o mês
+            status, body = 422, {'erro': str(error)}
+
+        except Exception as error:
+            logger.exception('error answering %s', self.path)
+            status, body = 500, {'erro': str(error)}
+
+        payload = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-Cache', 'hit' if cached else 'miss')
+        self.end_headers()
+        self.wfile.write(payload)
+
+        service.metrics.record(route, time.perf_counter() - start, status, cached)
+
+    def log_message(self, format, *args) -> None:
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class pooledHTTPServer(ThreadingHTTPServer):
+    '''
+    This class is a ThreadingHTTPServer whose requests are answered by a fixed pool of threads, instead of a new thread
+    for each one, so the connection of each thread is opened once and kept warm
+    '''
+    def __init__(self, address: tuple, service: queryService, workers: int = 8) -> None:
+        super().__init__(address, requestHandler)
+        self.service    = service
+        self.workers    = workers
+        self.executor   = ThreadPoolExecutor(workers, thread_name_prefix='agv-service')
+
+    def warm(self, timeout: float = 60) -> None:
+        '''
+        This method opens the connection of every thread of the pool and loads the tariff repository, before the first request
+        '''
+        # a barreira segura cada tarefa até todas começarem, então cada uma roda numa thread diferente do pool
+        barrier = threading.Barrier(self.workers)
+
+        def task():
+            self.service.warm()
+            barrier.wait(timeout)
+
+        for future in wait([self.executor.submit(task) for _ in range(self.workers)], timeout).done:
+            future.result()
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.service.close()
+
+
+def createServer(dbName: str = dbName, host: str = '127.0.0.1', port: int = 8080, workers: int = 8, cacheSize: int = 10000) -> pooledHTTPServer:
+    '''
+    This function creates the server of the service, with its connections already opened. Call serve_forever to start it
+
+    :param dbName: The path of the sqlite database
+    :param host: The address where the server listens
+    :param port: The port where the server listens. If 0, any free port is used (see server.server_address)
+    :param workers: How many threads, each with its own connection, answer the requests
+    :param cacheSize: How many results are kept in memory
+
+    :return: pooledHTTPServer
+    '''
+    server = pooledHTTPServer((host, port), queryService(dbName, cacheSize), workers)
+    server.warm()
+
+    return server
+
+
+def samplePaths(db = None, count: int = 100, seed: int = 0) -> list:
+    '''
+    This function draws paths of the routes for a load test, from UC months and clients that exist in the database
+
+    :return: list of paths, like '/ucs/123/custo?mes=jan&ano=2024'
+    '''
+    db = connectionModule.resolve(db, dbName)
+    generator = random.Random(seed)
+
+    months = db.cursor().execute(
+        '''
+        SELECT DISTINCT u.numero, cl.cnpj, r.ano, r.mes
+        FROM consumos r
+        JOIN ucs u ON u.id = r.uc_id
+        LEFT JOIN clientes cl ON cl.id = u.client_id
+        '''
+    ).fetchall()
+    if not months:
+        raise RuntimeError('There are no values registered to sample')
+
+    paths = []
+    for number, cnpj, year, month in generator.sample(months, min(count, len(months))):
+        paths.extend([f'/ucs/{number}', f'/ucs/{number}/custo?mes={month}&ano={year}'])
+        if cnpj is not None:
+            paths.extend([f'/clientes/{cnpj}', f'/clientes/{cnpj}/consumo?mes={month}&ano={year}&tipo=consumption'])
+
+    return paths
+
+
+def loadTest(url: str, paths: list, requests: int = 1000, concurrency: int = 8, timeout: float = 30, seed: int = 0) -> dict:
+    '''
+    This function requests random paths of a running service from concurrent threads and measures the latencies seen by the clients
+
+    :param url: The address of the service, like 'http://127.0.0.1:8080'
+    :param paths: The paths requested, like the return of samplePaths
+    :param requests: How many requests are made in total
+    :param concurrency: How many requests are made at the same time
+
+    :return: dict with 'requests', 'errors', 'seconds', 'requestsPerSecond', 'p50', 'p95', 'p99', 'max' and 'statuses'
+    '''
+    generator = random.Random(seed)
+    chosen = [generator.choice(paths) for _ in range(requests)]
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def request(path):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url.rstrip('/') + path, timeout=timeout) as answer:
+                answer.read()
+                status = answer.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except OSError:
+            status = 0
+
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(request, chosen))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        'requests': requests,
+        'errors': sum(count for status, count in statuses.items() if status == 0 or status >= 500),
+        'seconds': seconds,
+        'requestsPerSecond': requests / seconds if seconds else None,
+        'p50': _percentile(latencies, 0.50),
+        'p95': _percentile(latencies, 0.95),
+        'p99': _percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+
+def main(arguments: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Read-only HTTP service over clientsModule')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='starts the service')
+    serve.add_argument('--db', default=dbName)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int, default=8)
+    serve.add_argument('--cache-size', type=int, default=10000)
+
+    load = commands.add_parser('loadtest', help='requests random paths of a running service and prints the latencies')
+    load.add_argument('--db', default=dbName, help='database from where the paths are sampled')
+    load.add_argument('--url', default='http://127.0.0.1:8080')
+    load.add_argument('--requests', type=int, default=1000)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--sample', type=int, default=100, help='how many UC months are sampled')
+    options = parser.parse_args(arguments)
+
+    if options.command == 'loadtest':
+        paths = samplePaths(connectionModule.getManager(options.db), options.sample)
+        json.dump(loadTest(options.url, paths, options.requests, options.concurrency), sys.stdout, indent=2)
+        print()
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    server = createServer(options.db, options.host, options.port, options.workers, options.cache_size)
+    logger.info('listening on http://%s:%s', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import bisect
+import threading
+import weakref
+import datetime as dt
+
+_repositories = weakref.WeakKeyDictionary()
+_repositoriesLock = threading.Lock()
+
+
+def toDate(value) -> dt.date:
+    '''
+    This function converts a validity date read from the tarifas table into a date.
+    It accepts ISO strings, with or without the time, and date or datetime objects
+    '''
+    if value is None or value == '':
+        return None
+
+    if isinstance(value, dt.datetime):
+        return value.date()
+
+    if isinstance(value, dt.date):
+        return value
+
+    return dt.date.fromisoformat(str(value)[:10])
+
+
+class tariffRepository:
+    '''
+    This class keeps the whole tarifas table in memory, indexed by (utility, modality, subgroup, class) and, inside
+    each of these keys, by (posto, unit) with the validity intervals sorted by their start.
+    A price lookup is a dict access followed by a binary search, so it costs O(log n) on the number of tariff versions
+    '''
+    def __init__(self, db) -> None:
+        '''
+        Constructor of the class tariffRepository. The table is only read on the first lookup
+
+        :param db: A connectionModule.connectionManager
+        '''
+        self.db         = db
+        self._index     = None
+        self._lock      = threading.Lock()
+
+    def _load(self) -> dict:
+        index = {}
+        rows = self.db.cursor().execute(
+            '''
+            SELECT concessionaria, modalidade, subgrupo, classe, posto, unidade, inicio_vigencia, fim_vigencia, tusd, te
+            FROM tarifas
+            '''
+        )
+
+        for utility, modality, subgroup, clientClass, posto, unit, start, end, tusd, te in rows:
+            intervals = index.setdefault((utility, modality, subgroup, clientClass), {}).setdefault((posto, unit), [])
+            intervals.append((toDate(start), toDate(end), tusd or 0, te or 0))
+
+        # cada lista vira (inícios, intervalos), ordenados pelo início da vigência, para a busca binária
+        for postos in index.values():
+            for key, intervals in postos.items():
+                intervals.sort(key=lambda interval: interval[0])
+                postos[key] = ([interval[0] for interval in intervals], intervals)
+
+        return index
+
+    def _getIndex(self) -> dict:
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+                index = self._index
+
+        return index
+
+    def invalidate(self) -> None:
+        '''
+        This method discards the tariffs in memory. They'll be read again from the database on the next lookup.
+        It must be called every time the tarifas table is changed
+        '''
+        with self._lock:
+            self._index = None
+
+    def price(self, utility: str, modality: str, subgroup: str, clientClass: str, posto: str, unit: str, date, until = None):
+        '''
+        This method returns the tariff in force on a date
+
+        :param utility: The utility of the UC
+        :param modality: The tariff modality. One of modalityList
+        :param subgroup: The subgroup of the UC
+        :param clientClass: The class of the UC
+        :param posto: One of the values of hourDict
+        :param unit: 'R$/kW' or 'R$/MWh'
+        :param date: The reference date
+        :param until: If filled, the tariff must also be in force until this date
+
+        :return: tuple (tusd, te), or None if there is no tariff for the date
+        '''
+        postos = self._getIndex().get((utility, modality, subgroup, clientClass))
+        if not postos or (posto, unit) not in postos:
+            return None
+
+        return self._find(postos[(posto, unit)], toDate(date), toDate(until))
+
+    def prices(self, utility: str, modality: str, subgroup: str, clientClass: str, date, until = None) -> dict:
+        '''
+        This method returns every tariff in force on a date for a combination of utility, modality, subgroup and class
+
+        :return: dict {(posto, unit): (tusd, te)}
+        '''
+        postos = self._getIndex().get((utility, modality, subgroup, clientClass), {})
+        date = toDate(date)
+        until = toDate(until)
+        prices = {}
+
+        for key, intervals in postos.items():
+            found = self._find(intervals, date, until)
+            if found:
+                prices[key] = found
+
+        return prices
+
+    @staticmethod
+    def _find(intervals, date, until):
+        starts, entries = intervals
+        position = bisect.bisect_right(starts, date) - 1
+
+        if position < 0:
+            return None
+
+        start, end, tusd, te = entries[position]
+        if end is not None and end < (until or date):
+            return None
+
+        return tusd, te
+
+
+def queryPrices(db, utility: str, modality: str, subgroup: str, clientClass: str, date, until = None) -> dict:
+    '''
+    This function returns the same prices of tariffRepository.prices with a single query, without reading the whole tarifas table.
+    It's meant for short-lived processes, which would pay for loading the repository to look up a few prices
+
+    :return: dict {(posto, unit): (tusd, te)}
+    '''
+    date = toDate(date)
+    until = toDate(until) or date
+
+    # as datas podem ter sido gravadas com a hora, então só os dez primeiros caracteres são comparados
+    rows = db.cursor().execute(
+        '''
+        SELECT t.posto, t.unidade, t.tusd, t.te
+        FROM tarifas t
+        WHERE t.concessionaria = ? AND t.modalidade = ? AND t.subgrupo = ? AND t.classe = ?
+        AND t.inicio_vigencia = (
+            SELECT MAX(v.inicio_vigencia)
+            FROM tarifas v
+            WHERE v.concessionaria = t.concessionaria AND v.modalidade = t.modalidade AND v.subgrupo = t.subgrupo
+            AND v.classe = t.classe AND v.posto = t.posto AND v.unidade = t.unidade AND substr(v.inicio_vigencia, 1, 10) <= ?
+        )
+        AND (t.fim_vigencia IS NULL OR t.fim_vigencia = '' OR substr(t.fim_vigencia, 1, 10) >= ?)
+        ''', (utility, modality, subgroup, clientClass, date.isoformat(), until.isoformat())
+    )
+
+    return {(posto, unit): (tusd or 0, te or 0) for posto, unit, tusd, te in rows}
+
+
+def getRepository(db) -> tariffRepository:
+    '''
+    This function returns the tariffRepository shared by everyone that uses the same connectionManager
+    '''
+    with _repositoriesLock:
+        repository = _repositories.get(db)
+        if repository is None:
+            repository = tariffRepository(db)
+            _repositories[db] = repository
+
+    return repository
+
+
+def invalidate(db) -> None:
+    '''
+    This function discards the tariffs in memory of a database. Call it after changing the tarifas table
+    '''
+    getRepository(db).invalidate()
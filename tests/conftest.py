@@ -0,0 +1,86 @@
+'''
+Fixtures of the tests. The tests that use the db fixture run once with sqlite and once with PostgreSQL, each one over a new
+database. PostgreSQL is the server of the environment variable AGV_TEST_PG_URL, the URL of a database of a user that can create
+other databases, or, when it isn't set, a local server started by pgserver. Without any of them, the PostgreSQL runs are skipped
+Usage
+-----
+    AGV_TEST_PG_URL=postgresql://agv@localhost/postgres python -m pytest -q tests
+'''
+import os
+import sys
+import uuid
+import tempfile
+from urllib.parse import urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schemaModule
+import connectionModule
+import benchmarkModule
+from clientsModule import uc
+
+pgVariable = 'AGV_TEST_PG_URL'
+
+
+@pytest.fixture(scope='session')
+def postgresServer() -> str:
+    '''
+    This fixture returns the URL of the PostgreSQL server of the tests, skipping them if there is none
+    '''
+    pytest.importorskip('psycopg')
+
+    url = os.environ.get(pgVariable)
+    if url:
+        return url
+
+    pgserver = pytest.importorskip('pgserver', reason=f'{pgVariable} not set and pgserver not installed')
+
+    return pgserver.get_server(os.path.join(tempfile.gettempdir(), 'agv_test_pgdata'), cleanup_mode='stop').get_uri()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def databaseUrl(request, tmp_path) -> str:
+    '''
+    This fixture returns the path or the URL of a new, empty database of each backend
+    '''
+    if request.param == 'sqlite':
+        yield str(tmp_path / 'agv.db')
+        return
+
+    import psycopg
+
+    server = request.getfixturevalue('postgresServer')
+    name = f'agv_test_{uuid.uuid4().hex[:12]}'
+    with psycopg.connect(server, autocommit=True) as admin:
+        admin.execute(f'CREATE DATABASE {name}')
+
+    yield urlsplit(server)._replace(path=f'/{name}').geturl()
+
+    with psycopg.connect(server, autocommit=True) as admin:
+        admin.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+
+
+@pytest.fixture
+def db(databaseUrl) -> connectionModule.connectionManager:
+    '''
+    This fixture returns a connectionManager over a new database, already migrated to the last version of schemaModule
+    '''
+    manager = connectionModule.connectionManager(databaseUrl)
+    schemaModule.migrate(manager)
+
+    yield manager
+
+    manager.closeAll()
+
+
+@pytest.fixture
+def portfolio(db) -> dict:
+    '''
+    This fixture fills the database with a small synthetic portfolio of benchmarkModule, with its values and tariffs
+    '''
+    portfolio = benchmarkModule.buildPortfolio(db, clients=2, ucsPerClient=3, months=6)
+    uc.createValues(portfolio['rows'], db=db)
+
+    return portfolio
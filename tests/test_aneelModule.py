@@ -0,0 +1,88 @@
+import csv
+import datetime as dt
+
+import pytest
+
+import aneelModule
+import rollupModule
+
+aneelColumns = [
+    'SigAgente', 'DatInicioVigencia', 'DatFimVigencia', 'DscBaseTarifaria', 'DscSubGrupo', 'DscModalidadeTarifaria', 'DscClasse',
+    'DscSubClasse', 'DscDetalhe', 'NomPostoTarifario', 'DscUnidadeTerciaria', 'SigAgenteAcessante', 'VlrTUSD', 'VlrTE'
+]
+
+
+def line(**values) -> dict:
+    row = {
+        'SigAgente': 'CEMIG-D', 'DatInicioVigencia': '28/05/2024', 'DatFimVigencia': '27/05/2025',
+        'DscBaseTarifaria': 'Tarifa de Aplicação', 'DscSubGrupo': 'A4', 'DscModalidadeTarifaria': 'Azul', 'DscClasse': 'Industrial',
+        'DscSubClasse': 'Não se aplica', 'DscDetalhe': 'Não se aplica', 'NomPostoTarifario': 'Ponta',
+        'DscUnidadeTerciaria': 'R$/MWh', 'SigAgenteAcessante': 'Não se aplica', 'VlrTUSD': '1.234,56', 'VlrTE': '0,5'
+    }
+    row.update(values)
+
+    return row
+
+
+def test_normalize():
+    assert aneelModule.normalize(line(), {'CEMIG-D': 'CEMIG'}) == (
+        '2024-05-28', '2025-05-27', 'CEMIG', 'Azul', 'A4', 'Industrial', 'Ponta', 'R$/MWh', 1234.56, 0.5
+    )
+
+    # R$/kWh vira R$/MWh, as datas podem vir em ISO e o posto sem acento
+    row = aneelModule.normalize(line(DscUnidadeTerciaria='R$/kWh', DatInicioVigencia='2024-05-28 00:00:00', DatFimVigencia='',
+                                     NomPostoTarifario='Não se aplica', VlrTUSD='0.25', VlrTE=''))
+    assert row[:3] == ('2024-05-28', None, 'CEMIG-D')
+    assert row[6:] == ('Nao se aplica', 'R$/MWh', pytest.approx(250), 0)
+
+    for ignored in ({'DscBaseTarifaria': 'Base Econômica'}, {'DscDetalhe': 'SCEE'}, {'DscSubClasse': 'Residencial Baixa Renda'},
+                    {'NomPostoTarifario': 'Intermediário'}, {'DscUnidadeTerciaria': 'R$/kvarh'}, {'DscModalidadeTarifaria': 'Outra'}):
+        assert aneelModule.normalize(line(**ignored)) is None
+
+
+def _aneelFile(db, path, factor: float) -> None:
+    # as tarifas da CEMIG já cadastradas, com os valores multiplicados por factor, no formato da ANEEL
+    tariffs = db.cursor().execute(
+        '''
+        SELECT inicio_vigencia, fim_vigencia, modalidade, subgrupo, classe, posto, unidade, tusd, te
+        FROM tarifas
+        WHERE concessionaria = 'CEMIG'
+        '''
+    ).fetchall()
+
+    with open(path, 'w', newline='', encoding='utf-8') as archive:
+        writer = csv.DictWriter(archive, fieldnames=aneelColumns, delimiter=';')
+        writer.writeheader()
+        for start, end, modality, subgroup, clientClass, posto, unit, tusd, te in tariffs:
+            writer.writerow(line(
+                SigAgente='CEMIG', DatInicioVigencia=dt.date.fromisoformat(start).strftime('%d/%m/%Y'),
+                DatFimVigencia=dt.date.fromisoformat(end).strftime('%d/%m/%Y'), DscSubGrupo=subgroup,
+                DscModalidadeTarifaria=modality, DscClasse=clientClass, NomPostoTarifario=posto, DscUnidadeTerciaria=unit,
+                VlrTUSD=f'{tusd * factor:.2f}'.replace('.', ','), VlrTE=f'{te * factor:.2f}'.replace('.', ',')
+            ))
+
+
+def test_importIsIdempotentAndRecalculates(db, portfolio, tmp_path):
+    path = tmp_path / 'tarifas.csv'
+    _aneelFile(db, path, 2)
+    before = rollupModule.readTotals(ucNumber=portfolio['ucs'][0].number, db=db)
+    count = db.cursor().execute('SELECT COUNT(*) FROM tarifas').fetchone()[0]
+
+    result = aneelModule.importTariffs(path, workers=1, db=db)
+    imported = rollupModule.readTotals(db=db)
+
+    assert result['imported'] == result['read'] > 0 and result['recalculated'] > 0
+    assert db.cursor().execute('SELECT COUNT(*) FROM tarifas').fetchone()[0] == count
+
+    # o rollup já tem os custos das tarifas novas, iguais aos de uma reconstrução completa
+    after = rollupModule.readTotals(ucNumber=portfolio['ucs'][0].number, db=db)
+    assert all(after[key][1] != pytest.approx(before[key][1]) for key in before if before[key][1])
+    rollupModule.rebuild(db)
+    for key, (value, cost) in rollupModule.readTotals(db=db).items():
+        assert imported[key] == (pytest.approx(value), pytest.approx(cost))
+
+    # importar o mesmo arquivo de novo não muda nada
+    aneelModule.importTariffs(path, workers=1, db=db)
+    assert db.cursor().execute('SELECT COUNT(*) FROM tarifas').fetchone()[0] == count
+    for key, (value, cost) in rollupModule.readTotals(db=db).items():
+        assert imported[key] == (pytest.approx(value), pytest.approx(cost))
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import pytest
+
+import asyncModule
+import schemaModule
+import backendModule
+import connectionModule
+from clientsModule import aGroupList
+
+
+def test_aopenMigratesInThePool(databaseUrl, monkeypatch):
+    threads = []
+    migrate = schemaModule.migrate
+
+    def recordedMigrate(manager):
+        threads.append(threading.current_thread().name)
+        migrate(manager)
+
+    monkeypatch.setenv(backendModule.urlVariable, databaseUrl)
+    monkeypatch.setattr(schemaModule, 'migrate', recordedMigrate)
+
+    async def main():
+        return await asyncModule.asyncUC.aopen(None, '0000000001', None, None, None, None, None, None)
+
+    try:
+        unit = asyncio.run(main())
+
+        # o gerenciador compartilhado foi criado e migrado numa thread do pool, não na do loop de eventos
+        assert unit.db is connectionModule.getManager(databaseUrl)
+        assert len(threads) == 1 and threads[0].startswith('agv-db')
+    finally:
+        manager = connectionModule._managers.pop(databaseUrl, None)
+        if manager is not None:
+            manager.closeAll()
+
+
+def test_wrappersRunTheMethods(db, portfolio):
+    template = next(unit for unit in portfolio['ucs'] if unit.subgroup in aGroupList)
+    owner = portfolio['clients'][0]
+
+    async def main():
+        unit = await asyncModule.asyncUC.aopen(
+            template.utility, template.number, template.client, template.address, template.CEP, template.subgroup,
+            template.modality, template.clientClass, db=db
+        )
+        newClient = await asyncModule.asyncClient.aopen(
+            owner.name, owner.address, owner.CEP, owner.cnpj, owner.email, owner.phone, owner.legalPerson, db=db
+        )
+
+        assert await unit.aunlinkClient() == 0
+        assert await unit.alinkClient(owner.cnpj) == 0
+        assert await unit.aupdateUC() == 0
+        assert await newClient.alinkUC(template.number) == 0
+        assert await newClient.aunlinkUC(template.number) == 0
+
+        reads = await unit.areadUC(), await newClient.areadClient(), await unit.amonthlyCosts('jan', 2024)
+
+        history = await unit.ahistory([2024])
+        optimized, expected = await asyncio.gather(unit.aoptimizeDemand(6), asyncio.to_thread(template.optimizeDemand, 6))
+
+        return reads, history, optimized, expected, await newClient.ahistory([2024])
+
+    (register, clientRegister, cost), history, optimized, expected, clientHistory = asyncio.run(main())
+
+    assert register == template.readUC()
+    assert clientRegister == owner.readClient()
+    assert cost == pytest.approx(template.monthlyCosts('jan', 2024))
+    assert history.equals(template.history([2024]))
+    assert optimized['melhor'] == expected['melhor']
+    assert optimized['economia'] == pytest.approx(expected['economia'])
+    assert template.number not in clientHistory.index.get_level_values('numero')
@@ -0,0 +1,78 @@
+import backendModule
+import schemaModule
+import rollupModule
+import reportModule
+from clientsModule import client, uc
+
+
+def openCursors(db) -> int:
+    # só o PostgreSQL mantém cursores no servidor
+    if db.backend.name != 'postgresql':
+        return 0
+
+    return db.cursor().execute('SELECT COUNT(*) FROM pg_cursors').fetchone()[0]
+
+
+def test_translate():
+    assert backendModule.translate("SELECT * FROM t WHERE a = ? AND b LIKE '%?%'") == "SELECT * FROM t WHERE a = %s AND b LIKE '%%?%%'"
+    assert backendModule.translate('SELECT 1 % 2', False) == 'SELECT 1 % 2'
+    assert backendModule.translate('SELECT numero FROM ucs ORDER BY numero COLLATE BINARY') == 'SELECT numero FROM ucs ORDER BY numero COLLATE "C"'
+
+    ddl = backendModule.translate('CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, valor REAL)')
+    assert 'SERIAL PRIMARY KEY' in ddl and 'DOUBLE PRECISION' in ddl
+
+    trigger = backendModule.translate(schemaModule.migrations[6][2][2])
+    assert 'LANGUAGE plpgsql' in trigger and 'EXECUTE FUNCTION' in trigger
+
+
+def test_fromUrl():
+    assert isinstance(backendModule.fromUrl('postgresql://agv@localhost/agv'), backendModule.postgresBackend)
+    assert backendModule.fromUrl('sqlite:///tmp/agv.db').path == 'tmp/agv.db'
+    assert backendModule.fromUrl('agv.db').path == 'agv.db'
+
+
+def test_writesAndRollup(db, portfolio):
+    newUC = portfolio['ucs'][0]
+    assert newUC.readUC()[1] == newUC.number
+
+    conflicts = uc.createValues(portfolio['rows'][:3], db=db)['conflicts']
+    assert [reason for _, _, reason in conflicts] == ['already registered'] * 3
+
+    newUC.createValue('jan', 'consumption', 100, 2030)
+    assert newUC.readValue('jan', 'consumption', 2030)[5] == 100
+
+    # o consolidado mantido a cada escrita é o mesmo de um recálculo completo
+    incremental = rollupModule.readTotals(db=db)
+    rollupModule.rebuild(db)
+    rebuilt = rollupModule.readTotals(db=db)
+
+    assert incremental.keys() == rebuilt.keys()
+    for key, (value, cost) in rebuilt.items():
+        assert incremental[key][0] == value
+        assert incremental[key][1] is None and cost is None or abs(incremental[key][1] - cost) < 1e-6
+
+
+def test_streamCursorsAreClosed(db, portfolio):
+    owner = client(*[None] * 3, portfolio['clients'][0].cnpj, *[None] * 3, db=db)
+    clientID = owner.readClient()[0]
+
+    months = list(reportModule.readMonths(db, clientID=clientID, chunkSize=2))
+    assert len(months) == 3 * 6
+
+    # leitores interrompidos antes do fim
+    reader = reportModule.readMonths(db, clientID=clientID, chunkSize=2)
+    next(reader)
+    reader.close()
+
+    rows = reportModule.reportRows(db, clientID=clientID, chunkSize=2)
+    next(rows)
+    rows.close()
+
+    for newUC in owner.ucList:
+        break
+    assert sorted(newUC.number for newUC in owner.ucList) == sorted(newUC.number for newUC in portfolio['ucs'][:3])
+
+    for rollup in rollupModule.rollupRows(db, chunkSize=2):
+        break
+
+    assert openCursors(db) == 0
@@ -0,0 +1,198 @@
+import os
+import sys
+import threading
+import subprocess
+
+import pytest
+
+import tariffModule
+import rollupModule
+import benchmarkModule
+import connectionModule
+import clientsModule
+
+# um processo curto, como um cron, que grava um valor e calcula um custo
+cronScript = '''
+import sys
+import connectionModule, clientsModule, tariffModule
+
+db = connectionModule.getManager(sys.argv[1])
+newUC = clientsModule.uc(None, sys.argv[2], None, None, None, None, None, None, db=db)
+newUC.createValue('jul', 'consumption', 123, 2024)
+clientsModule.monthlyCostOf(sys.argv[2], 'jul', 2024, db=db)
+
+repository = tariffModule._repositories.get(db)
+print(repository is not None and repository._index is not None)
+print(','.join(sorted(sys.modules)))
+'''
+
+
+def test_importBudget():
+    result = benchmarkModule.importTime('clientsModule', runs=3)
+
+    assert result['heavyModules'] == []
+    assert result['seconds'] < benchmarkModule.importBudget
+
+
+def test_createValueLoadsNoRepository(db, portfolio):
+    newUC = portfolio['ucs'][0]
+    repository = tariffModule.getRepository(db)
+    repository.invalidate()
+
+    newUC.createValue('jul', 'consumption', 123, 2024)
+    newUC.updateValue('jul', 'consumption', 321, 2024)
+
+    assert repository._index is None
+    assert clientsModule.monthlyCostOf(newUC.number, 'jul', 2024, db=db) == pytest.approx(newUC.monthlyCosts('jul', 2024, cached=False))
+
+
+def test_cronPath(databaseUrl, portfolio):
+    output = subprocess.run(
+        [sys.executable, '-c', cronScript, databaseUrl, portfolio['ucs'][0].number],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+
+    assert output[0] == 'False'
+    assert set(output[1].split(',')).isdisjoint(benchmarkModule.heavyModules)
+
+
+def test_identityMapIsScopedToSessions(db, databaseUrl, portfolio):
+    newUC = portfolio['ucs'][0]
+
+    # outro processo, com o seu próprio gerenciador, muda o endereço da UC
+    def move(address):
+        with other.transaction() as cursor:
+            cursor.execute('UPDATE ucs SET endereco = ? WHERE numero = ?', (address, newUC.number))
+
+    other = connectionModule.connectionManager(databaseUrl)
+    try:
+        with db.session():
+            register = newUC.readUC()
+            move('Rua Nova')
+            assert newUC.readUC() is register
+
+        # fora de uma sessão nada fica em memória, e a próxima sessão começa vazia
+        assert newUC.readUC()[4] == 'Rua Nova'
+        move('Rua Velha')
+        with db.session():
+            assert newUC.readUC()[4] == 'Rua Velha'
+
+    finally:
+        other.closeAll()
+
+
+def test_unknownMonthsAreRejectedBeforeWriting(db, portfolio):
+    newUC = portfolio['ucs'][0]
+
+    with pytest.raises(ValueError):
+        newUC.createValue('janeiro', 'consumption', 123, 2030)
+    with pytest.raises(ValueError):
+        newUC.updateValue('April', 'consumption', 123, 2024)
+
+    # o mês desconhecido é só mais um conflito do lote, e as outras linhas são gravadas
+    result = clientsModule.uc.createValues([(newUC.number, 'abr', 'consumption', 1, 2030), (newUC.number, 'April', 'consumption', 2, 2030)], db=db)
+
+    assert result['inserted'] == 1
+    assert [(index, reason) for index, _, reason in result['conflicts']] == [(1, 'month not recognized')]
+    assert newUC.readValue('abr', 'consumption', 2030)[5] == 1
+
+
+def test_identityIsInvalidatedAfterCommit(db, portfolio, monkeypatch):
+    newUC = portfolio['ucs'][0]
+    refresh = rollupModule.refresh
+
+    # outra thread da mesma sessão lê a UC enquanto a transação da escrita ainda está aberta
+    def readDuringWrite(*args, **kwargs):
+        reader = threading.Thread(target=lambda: clientsModule.uc(None, newUC.number, None, None, None, None, None, None, db=db).readUC())
+        reader.start()
+        reader.join()
+
+        return refresh(*args, **kwargs)
+
+    with db.session():
+        monkeypatch.setattr(rollupModule, 'refresh', readDuringWrite)
+        newUC.address = 'Rua Nova'
+        newUC.updateUC()
+        monkeypatch.undo()
+
+        assert newUC.readUC()[4] == 'Rua Nova'
+
+
+def test_createValuesReportsConflicts(db, portfolio):
+    number = portfolio['ucs'][0].number
+    rows = [
+        (number, 'jan', 'consumption', 1, 2031),
+        (number, 'jan', 'consumo', 1, 2031),
+        ('9999999999', 'jan', 'consumption', 1, 2031),
+        (number, 'jan', 'consumption', 2, 2031),
+        portfolio['rows'][0],
+        (number, 'fev', 'peak-demand', 3, 2031),
+    ]
+    result = clientsModule.uc.createValues(rows, db=db)
+
+    assert result['inserted'] == 2
+    assert result['conflicts'] == [
+        (1, rows[1], 'valueType not recognized'), (2, rows[2], 'UC not found'),
+        (3, rows[3], 'duplicated in batch'), (4, rows[4], 'already registered')
+    ]
+
+    # o valor repetido no lote não substitui o primeiro
+    newUC = clientsModule.uc(None, number, None, None, None, None, None, None, db=db)
+    assert newUC.readValue('jan', 'consumption', 2031)[5] == 1
+    assert newUC.readValue('fev', 'peak-demand', 2031)[5] == 3
+
+
+def test_consumptionTotals(db, portfolio):
+    cnpjs = {owner.name: owner.cnpj for owner in portfolio['clients']}
+    owners = {newUC.number: cnpjs[newUC.client] for newUC in portfolio['ucs']}
+
+    expected = {}
+    for number, month, valueType, value, year in portfolio['rows']:
+        key = (owners[number], year, month, valueType)
+        expected[key] = expected.get(key, 0) + value
+
+    totals = clientsModule.client.consumptionTotals(db=db)
+    assert totals.keys() == expected.keys()
+    assert all(totals[key] == pytest.approx(value) for key, value in expected.items())
+
+    owner = portfolio['clients'][1]
+    month = portfolio['rows'][0][1]
+    assert clientsModule.client.consumptionTotals([owner.cnpj], [month], [2024], ['off-peak-demand'], db=db) == {
+        key: totals[key] for key in totals if key == (owner.cnpj, 2024, month, 'off-peak-demand')
+    }
+    assert owner.totalConsumption(month, 'off-peak-demand', 2024) == pytest.approx(expected[(owner.cnpj, 2024, month, 'off-peak-demand')])
+
+    with pytest.raises(TypeError):
+        clientsModule.client.consumptionTotals(valueTypes=['consumo'], db=db)
+
+
+def test_ucListIsLazy(db, portfolio):
+    owner = clientsModule.client(*[None] * 3, portfolio['clients'][0].cnpj, *[None] * 3, db=db)
+    numbers = sorted(newUC.number for newUC in portfolio['ucs'] if newUC.client == portfolio['clients'][0].name)
+
+    # iterar antes de carregar lê as UCs com o cursor, sem guardá-las
+    assert [newUC.number for newUC in owner.ucList] == numbers
+    assert owner.ucList._registers is None
+
+    assert len(owner.ucList) == len(numbers) and owner.ucList._registers is not None
+    assert owner.ucList.numbers() == numbers and numbers[0] in owner.ucList and owner.ucList[1].number == numbers[1]
+
+    other = next(newUC for newUC in portfolio['ucs'] if newUC.number not in numbers)
+    owner.linkUC(other.number)
+    assert other.number in owner.ucList and len(owner.ucList) == len(numbers) + 1
+
+
+def test_ucListPrefetch(db, portfolio):
+    owner = portfolio['clients'][0]
+    year, month = portfolio['rows'][0][4], portfolio['rows'][0][1]
+
+    readings = owner.ucList.prefetch(year, [month])
+    assert {key[0] for key in readings} == set(owner.ucList.numbers())
+
+    for newUC in owner.ucList:
+        values = owner.ucList.readings(newUC.number, month, year)
+        assert values.keys() == set(clientsModule.valueTypesList)
+        for valueType, value in values.items():
+            assert value == pytest.approx(newUC.readValue(month, valueType, year)[5])
+
+    assert owner.ucList.readings(owner.ucList.numbers()[0], month, 1999) == {}
@@ -0,0 +1,48 @@
+import sqlite3
+
+import tariffModule
+import connectionModule
+
+
+def _workerDatabase() -> tuple:
+    db = connectionModule.workerDb()
+
+    return db.dbName, db.readOnly, db.cursor().execute('SELECT COUNT(*) FROM ucs').fetchone()[0]
+
+
+def test_readOnlyPool(db, databaseUrl, portfolio):
+    count = len(portfolio['ucs'])
+
+    with connectionModule.readOnlyPool(db, 2) as pool:
+        assert pool.submit(_workerDatabase).result() == (databaseUrl, True, count)
+
+    # com um só processo, as funções usam o próprio gerenciador de quem chama
+    with connectionModule.readOnlyPool(db, 1) as pool:
+        assert pool.submit(_workerDatabase).result() == (databaseUrl, False, count)
+    assert connectionModule.workerDb() is None
+
+
+def test_readOnlyPoolOfWrappedConnection(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'agv.db')
+    conn.execute('CREATE TABLE ucs (id INTEGER)')
+
+    manager = connectionModule.connectionManager.fromConnection(conn)
+    try:
+        with connectionModule.readOnlyPool(manager) as pool:
+            assert pool.submit(_workerDatabase).result() == (None, False, 0)
+    finally:
+        conn.close()
+
+
+def test_resolveKeepsTheManagerOfAConnection(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'agv.db')
+
+    try:
+        manager = connectionModule.resolve(conn, None)
+
+        # o mesmo gerenciador, e com ele o mesmo repositório de tarifas, é usado em todas as chamadas
+        assert connectionModule.resolve(conn, None) is manager
+        assert tariffModule.getRepository(connectionModule.resolve(conn, None)) is tariffModule.getRepository(manager)
+        assert connectionModule.resolve(manager, None) is manager
+    finally:
+        conn.close()
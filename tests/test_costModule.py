@@ -0,0 +1,50 @@
+import datetime as dt
+
+import pytest
+
+import costModule
+import clientsModule
+from clientsModule import client, uc
+
+
+@pytest.fixture
+def tariffVersions(db):
+    client('Cliente', 'Rua', '00000-000', '00000000000001', 'cliente@cliente.com', '', 'company', db=db).createClient()
+    newUC = uc('CEMIG', '0000000001', 'Cliente', 'Rua', '00000-000', 'B3', 'Convencional', 'Comercial', db=db)
+    newUC.createUC()
+
+    # a versão nova, sem fim de vigência, é gravada antes da que ela substitui
+    db.cursor().executemany(
+        '''
+        INSERT INTO tarifas (inicio_vigencia, fim_vigencia, concessionaria, modalidade, subgrupo, classe, posto, unidade, tusd, te)
+        VALUES (?,?,?,?,?,?,?,?,?,?)
+        ''', [
+            ('2024-03-01', '', 'CEMIG', 'Convencional', 'B3', 'Comercial', 'Nao se aplica', 'R$/MWh', 300, 200),
+            ('2024-01-01 00:00:00', '2024-12-31', 'CEMIG', 'Convencional', 'B3', 'Comercial', 'Nao se aplica', 'R$/MWh', 100, 50),
+        ]
+    )
+
+    for month in ('jan', 'mai'):
+        newUC.createValue(month, 'consumption', 1000, 2024)
+
+    return newUC
+
+
+def test_portfolioCostsUseTheLatestVersion(db, tariffVersions):
+    costs = costModule.portfolioCosts(2024, ['jan', 'mai'], db=db)
+
+    assert costs.loc[('0000000001', 2024, 'jan'), 'total'] == pytest.approx(150)
+    assert costs.loc[('0000000001', 2024, 'mai'), 'total'] == pytest.approx(500)
+    assert not costs['missingTariff'].any()
+
+    # os mesmos custos de tariffModule, pelo repositório e pela consulta
+    for month in ('jan', 'mai'):
+        assert costs.loc[('0000000001', 2024, month), 'total'] == pytest.approx(tariffVersions.monthlyCosts(month, 2024))
+        assert costs.loc[('0000000001', 2024, month), 'total'] == pytest.approx(clientsModule.monthlyCostOf('0000000001', month, 2024, db=db))
+
+
+def test_readTariffsKeepsOpenEndedVersions(db, tariffVersions):
+    tariffs = costModule.readTariffs(db, dt.date(2025, 1, 1), dt.date(2025, 1, 31))
+
+    assert len(tariffs) == 1
+    assert tariffs['fim_vigencia'].isna().all()
@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+import pandas as pd
+
+import demandModule
+
+
+def test_optimizePortfolio(db, portfolio):
+    serial = demandModule.optimizePortfolio(months=6, steps=5, workers=1, chunkSize=1, db=db)
+    assert len(serial) > 0
+
+    pooled = demandModule.optimizePortfolio(months=6, steps=5, workers=2, chunkSize=1, db=db)
+    pd.testing.assert_frame_equal(pooled.sort_index(), serial.sort_index())
+
+
+def test_optimizePortfolioWrappedConnection(db, databaseUrl, portfolio):
+    if db.backend.name != 'sqlite':
+        pytest.skip('only sqlite connections can be passed directly')
+
+    expected = demandModule.optimizePortfolio(months=6, steps=5, workers=1, db=db)
+
+    # os processos do pool não conseguem abrir uma conexão de fora, então tudo roda neste processo
+    conn = sqlite3.connect(databaseUrl, check_same_thread=False)
+    try:
+        optimized = demandModule.optimizePortfolio(months=6, steps=5, workers=2, chunkSize=1, db=conn)
+    finally:
+        conn.close()
+
+    pd.testing.assert_frame_equal(optimized.sort_index(), expected.sort_index())
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import historyModule
+from clientsModule import monthDict, valueTypesList
+
+
+@pytest.fixture
+def gap(db, portfolio):
+    # um mês do meio sem nenhum valor na primeira UC
+    newUC = portfolio['ucs'][0]
+    periods = sorted({(year, monthDict[month], month) for number, month, _, _, year in portfolio['rows'] if number == newUC.number})
+    year, _, month = periods[2]
+    for valueType in valueTypesList:
+        newUC.deleteValue(month, valueType, year)
+
+    return newUC, periods, (year, month)
+
+
+def test_history(db, portfolio, gap):
+    newUC, periods, (year, month) = gap
+    frame = historyModule.history([newUC.number], db=db)
+
+    assert frame.index.tolist() == [(newUC.number, year, name) for year, _, name in periods]
+    assert list(frame.columns) == valueTypesList
+    assert frame.loc[(newUC.number, year, month)].isna().all()
+
+    expected = {(number, year, month, valueType): value for number, month, valueType, value, year in portfolio['rows']}
+    first = periods[0]
+    for valueType in valueTypesList:
+        assert frame.loc[(newUC.number, first[0], first[2]), valueType] == pytest.approx(expected[(newUC.number, first[0], first[2], valueType)])
+
+    assert (newUC.number, year, month) not in historyModule.history([newUC.number], fill=False, db=db).index
+
+    owner = portfolio['clients'][0]
+    assert len(owner.history()) == len(historyModule.history(cnpj=owner.cnpj, db=db)) > len(frame)
+
+
+@pytest.mark.parametrize('name', ['historico.parquet', 'historico'])
+def test_exportRoundTrip(db, portfolio, gap, tmp_path, name):
+    if name.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+
+    frame = historyModule.history(db=db)
+
+    path = historyModule.exportHistory(frame, str(tmp_path / name))
+    loaded = historyModule.loadHistory(path)
+
+    pd.testing.assert_frame_equal(loaded, frame, check_index_type=False)
+
+
+def test_loadArrays(db, portfolio, gap, tmp_path):
+    frame = historyModule.history(db=db)
+    path = historyModule.exportHistory(frame, str(tmp_path / 'historico'))
+
+    arrays = historyModule.loadArrays(path)
+    assert isinstance(arrays['valores'], np.memmap)
+    assert arrays['valores'].shape == (len(frame), len(valueTypesList))
+    assert arrays['colunas'] == valueTypesList
+    assert arrays['numeros'].tolist() == frame.index.get_level_values('numero').tolist()
+    assert arrays['meses'].tolist() == [monthDict[month] for month in frame.index.get_level_values('mes')]
+    np.testing.assert_array_equal(arrays['valores'], frame.to_numpy())
+
+    assert not isinstance(historyModule.loadArrays(path, mmap=False)['valores'], np.memmap)
@@ -0,0 +1,48 @@
+import pytest
+
+import instrumentModule
+import connectionModule
+
+
+@pytest.fixture
+def instrumented(tmp_path):
+    instrumentModule.enable()
+    manager = connectionModule.connectionManager(str(tmp_path / 'agv.db'))
+    manager.cursor().execute('CREATE TABLE valores (id INTEGER, valor REAL)')
+    instrumentModule.reset()
+
+    yield manager
+
+    manager.closeAll()
+    instrumentModule.disable()
+    instrumentModule.reset()
+
+
+def test_statementsAreNormalized(instrumented):
+    cursor = instrumented.cursor()
+    cursor.executemany('INSERT INTO valores VALUES (?,?)', [(ucID, ucID * 10) for ucID in range(5)])
+    for size in range(2, 5):
+        cursor.execute(f"SELECT valor FROM valores WHERE id IN ({','.join('?' * size)})", list(range(size))).fetchall()
+
+    queries = instrumentModule.snapshot()['queries']
+    entry = queries['SELECT valor FROM valores WHERE id IN (?, ...)']
+    assert (entry['calls'], entry['rows']) == (3, 9)
+    assert queries['INSERT INTO valores VALUES (?, ...)']['rows'] == 5
+    assert 'test_instrumentModule.test_statementsAreNormalized' in entry['callers']
+
+    assert instrumentModule.normalize('SELECT 1 WHERE (a, b) IN (VALUES (?,?), (?,?))\n  AND c = ?') == \
+        'SELECT 1 WHERE (a, b) IN (VALUES (?, ...), ...) AND c = ?'
+
+
+def test_statementsAreBounded(instrumented, monkeypatch):
+    monkeypatch.setattr(instrumentModule, 'maxStatements', 3)
+    cursor = instrumented.cursor()
+    for number in range(6):
+        cursor.execute(f'SELECT {number} FROM valores').fetchall()
+
+    queries = instrumentModule.snapshot()['queries']
+    assert len(queries) == 4
+    assert queries[instrumentModule.otherStatements]['calls'] == 3
+
+    instrumentModule.reset()
+    assert instrumentModule.snapshot()['queries'] == {} and instrumentModule.report() == []
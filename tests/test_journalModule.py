@@ -0,0 +1,61 @@
+import pytest
+
+import journalModule
+import connectionModule
+from clientsModule import uc
+
+
+def _collect(changes: list):
+    def handler(cursor, batch):
+        changes.extend(batch)
+
+    return handler
+
+
+def test_consumeInBatches(db, portfolio):
+    changes = []
+    consumed = journalModule.consume('teste', _collect(changes), tables=['consumos'], batchSize=7, db=db)
+
+    assert consumed == len(changes) > 0
+    assert {change[1] for change in changes} == {'consumos'}
+    assert [change[0] for change in changes] == sorted({change[0] for change in changes})
+    assert journalModule.readCheckpoint('teste', db) == journalModule.lastSeq(db)
+
+    # sem alterações novas, nada é dado de novo
+    assert journalModule.consume('teste', _collect(changes), db=db) == 0
+
+    portfolio['ucs'][0].createValue('jan', 'consumption', 10, 2030)
+    assert journalModule.consume('teste', _collect(changes), db=db) == 1
+    assert changes[-1][1:3] == ('consumos', 'insert')
+
+    assert journalModule.prune(db) == journalModule.lastSeq(db)
+    assert journalModule.changesSince(db=db) == []
+
+
+def test_consumeWaitsForOpenTransactions(db, databaseUrl, portfolio):
+    if db.backend.name != 'postgresql':
+        pytest.skip('sqlite serializes the writes, so the seqs are commited in order')
+
+    journalModule.consume('teste', _collect([]), db=db)
+    other = connectionModule.connectionManager(databaseUrl)
+    first, second = portfolio['ucs'][:2]
+    changes = []
+
+    try:
+        # a transação aberta tira um seq antes do seq de uma escrita que tem commit primeiro
+        with other.transaction():
+            uc(first.utility, first.number, first.client, None, None, first.subgroup, first.modality, first.clientClass, db=other).createValue('jan', 'consumption', 10, 2030)
+            second.createValue('jan', 'consumption', 20, 2030)
+
+            journalModule.consume('teste', _collect(changes), db=db)
+            assert changes == []
+            assert journalModule.readCheckpoint('teste', db) < journalModule.lastSeq(db)
+
+        journalModule.consume('teste', _collect(changes), db=db)
+
+    finally:
+        other.closeAll()
+
+    assert [change[5:7] for change in changes] == [(2030, 'jan'), (2030, 'jan')]
+    assert [change[0] for change in changes] == sorted(change[0] for change in changes)
+    assert journalModule.readCheckpoint('teste', db) == journalModule.lastSeq(db)
@@ -0,0 +1,206 @@
+import re
+import threading
+import socketserver
+from email.message import EmailMessage
+
+import pytest
+
+import mailModule
+
+
+class fakeImap(socketserver.ThreadingTCPServer):
+    '''
+    This class is an IMAP server over a dict {uid: raw message}, with only the commands used by imbox and mailModule.
+    The fetches of the UIDs in failing are answered with NO, and every UID fetched is kept in fetched
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages: dict) -> None:
+        super().__init__(('127.0.0.1', 0), fakeImapHandler)
+        self.messages   = messages
+        self.failing    = set()
+        self.fetched    = []
+        self.lock       = threading.Lock()
+
+    def search(self, criteria: str) -> list:
+        uids = sorted(self.messages)
+        match = re.search(r'UID (\d+):(\d+|\*)', criteria)
+        if not match or not uids:
+            return uids
+
+        start = int(match.group(1))
+        end = uids[-1] if match.group(2) == '*' else int(match.group(2))
+
+        # como nos servidores reais, n:* inclui a última mensagem mesmo quando n é maior que o seu UID
+        found = [uid for uid in uids if min(start, end) <= uid <= max(start, end)]
+        return found or ([uids[-1]] if match.group(2) == '*' else [])
+
+
+class fakeImapHandler(socketserver.StreamRequestHandler):
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self) -> None:
+        server = self.server
+        self.send('* OK fake IMAP ready')
+
+        for raw in self.rfile:
+            tag, command, *rest = raw.decode().strip().split(' ', 2)
+            arguments = rest[0] if rest else ''
+            command = command.upper()
+
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1')
+            elif command == 'SELECT':
+                self.send(f'* {len(server.messages)} EXISTS')
+                self.send(f'{tag} OK [READ-WRITE] SELECT completed')
+                continue
+            elif command == 'LOGOUT':
+                self.send('* BYE')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            elif command == 'UID':
+                action, _, criteria = arguments.partition(' ')
+                if action.upper() == 'SEARCH':
+                    self.send('* SEARCH ' + ' '.join(str(uid) for uid in server.search(criteria)))
+                else:
+                    uid = int(criteria.split(' ')[0])
+                    with server.lock:
+                        server.fetched.append(uid)
+                    if uid in server.failing or uid not in server.messages:
+                        self.send(f'{tag} NO fetch failed')
+                        continue
+
+                    body = server.messages[uid]
+                    self.wfile.write(f'* {uid} FETCH (UID {uid} FLAGS () BODY[] {{{len(body)}}}\r\n'.encode() + body + b')\r\n')
+
+            self.send(f'{tag} OK completed')
+
+
+def bill(uid: int, rows: list) -> bytes:
+    message = EmailMessage()
+    message['From'] = 'faturas@concessionaria.com'
+    message['To'] = 'agv@agv.com'
+    message['Subject'] = f'Fatura {uid}'
+    message.set_content('Fatura em anexo')
+
+    content = 'uc;mes;tipo;valor;ano\n' + ''.join(f'{number};{month};consumption;{value};2030\n' for number, month, value in rows)
+    message.add_attachment(content.encode(), maintype='text', subtype='csv', filename='fatura.csv')
+
+    return bytes(message)
+
+
+@pytest.fixture
+def mailbox(portfolio):
+    numbers = [newUC.number for newUC in portfolio['ucs']]
+    months = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun']
+    server = fakeImap({uid: bill(uid, [(numbers[0], months[uid - 1], uid), (numbers[1], months[uid - 1], uid * 10)]) for uid in range(1, 7)})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def factory(server):
+    return mailModule.imboxFactory('127.0.0.1', 'agv', 'senha', port=server.server_address[1], ssl=False)
+
+
+def consumptions(db) -> int:
+    return db.cursor().execute('SELECT COUNT(*) FROM consumos WHERE ano = 2030').fetchone()[0]
+
+
+def test_ingestResumesFromCheckpoint(db, mailbox):
+    summary = mailModule.ingest(factory(mailbox), workers=2, batchSize=3, db=db)
+
+    assert (summary['messages'], summary['inserted'], summary['errors'], summary['lastUID']) == (6, 12, [], 6)
+    assert mailModule.readCheckpoint(db, 'INBOX') == 6
+    assert consumptions(db) == 12
+
+    # sem mensagens novas, a busca devolve a última e nada é lido
+    mailbox.fetched.clear()
+    assert mailModule.ingest(factory(mailbox), db=db)['messages'] == 0
+    assert mailbox.fetched == []
+
+    mailbox.messages[7] = bill(7, [(db.cursor().execute('SELECT numero FROM ucs ORDER BY id').fetchone()[0], 'jul', 7)])
+    summary = mailModule.ingest(factory(mailbox), db=db)
+
+    assert (summary['messages'], summary['inserted'], summary['lastUID']) == (1, 1, 7)
+    assert mailbox.fetched == [7]
+
+
+def test_ingestCrashMidBatch(db, mailbox):
+    class crash(BaseException):
+        pass
+
+    def parser(message, attachment):
+        if message.subject == 'Fatura 4':
+            raise crash()
+        return mailModule.csvAttachmentParser(message, attachment)
+
+    # a mensagem 3 está no lote ainda não gravado quando o processo cai na 4
+    with pytest.raises(crash):
+        mailModule.ingest(factory(mailbox), parser=parser, workers=1, batchSize=4, db=db)
+
+    assert mailModule.readCheckpoint(db, 'INBOX') == 2
+    assert consumptions(db) == 4
+
+    mailbox.fetched.clear()
+    summary = mailModule.ingest(factory(mailbox), workers=2, batchSize=4, db=db)
+
+    assert sorted(mailbox.fetched) == [3, 4, 5, 6]
+    assert (summary['inserted'], summary['conflicts'], summary['lastUID']) == (8, [], 6)
+    assert consumptions(db) == 12
+
+
+def test_failedFetchIsNotSkipped(db, mailbox):
+    mailbox.failing.add(3)
+    summary = mailModule.ingest(factory(mailbox), workers=2, batchSize=2, db=db)
+
+    assert [uid for uid, _ in summary['errors']] == [3]
+    assert summary['inserted'] == 10
+    assert mailModule.readFailures(db, 'INBOX') == [3]
+
+    # a próxima ingestão lê de novo a mensagem que falhou, mesmo com o checkpoint depois dela
+    mailbox.failing.clear()
+    mailbox.fetched.clear()
+    summary = mailModule.ingest(factory(mailbox), db=db)
+
+    assert mailbox.fetched == [3]
+    assert (summary['messages'], summary['inserted'], summary['errors'], summary['lastUID']) == (1, 2, [], 6)
+    assert mailModule.readFailures(db, 'INBOX') == []
+    assert consumptions(db) == 12
+
+
+def test_unknownMonthFailsTheMessage(db, mailbox):
+    mailbox.messages[3] = bill(3, [(db.cursor().execute('SELECT numero FROM ucs ORDER BY id').fetchone()[0], 'March', 3)])
+    summary = mailModule.ingest(factory(mailbox), db=db)
+
+    assert [uid for uid, _ in summary['errors']] == [3] and 'March' in summary['errors'][0][1]
+    assert (summary['inserted'], summary['lastUID']) == (10, 6)
+    assert mailModule.readFailures(db, 'INBOX') == [3]
+
+
+def test_failedMessageStopsAfterMaxAttempts(db, mailbox):
+    mailbox.failing.add(3)
+    for _ in range(3):
+        mailModule.ingest(factory(mailbox), maxAttempts=2, db=db)
+
+    # depois de duas falhas a mensagem não é mais lida, mas continua na tabela para ser vista
+    assert mailbox.fetched.count(3) == 2
+    assert mailModule.readFailures(db, 'INBOX') == [3]
+    assert mailModule.readFailures(db, 'INBOX', maxAttempts=2) == []
+    assert db.cursor().execute('SELECT tentativas FROM ingestao_falhas WHERE uid = 3').fetchone()[0] == 2
+
+
+def test_conflictsReportTheUID(db, mailbox):
+    numbers = [number for (number,) in db.cursor().execute('SELECT numero FROM ucs ORDER BY id LIMIT 2')]
+    mailbox.messages[7] = bill(7, [(numbers[1], 'jul', 1)])
+    mailbox.messages[8] = bill(8, [(numbers[0], 'fev', 1), (numbers[1], 'ago', 1)])
+    summary = mailModule.ingest(factory(mailbox), batchSize=100, db=db)
+
+    # a linha de fevereiro da mensagem 8 já veio na mensagem 2, no mesmo lote
+    assert [(uid, row[:2]) for uid, row, _ in summary['conflicts']] == [(8, (numbers[0], 'fev'))]
+    assert summary['inserted'] == 14
@@ -0,0 +1,92 @@
+import socket
+import datetime as dt
+
+import pytest
+
+import outboxModule
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+
+class sinkHandler:
+    '''
+    This class keeps every message received by the SMTP sink, and refuses the recipients of refused
+    '''
+    def __init__(self) -> None:
+        self.messages   = []
+        self.refused    = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, options):
+        if address in self.refused:
+            return '550 mailbox unavailable'
+
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content))
+        return '250 Message accepted'
+
+
+@pytest.fixture
+def sink():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    handler = sinkHandler()
+    controller = aiosmtpd.Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+
+    yield handler, outboxModule.smtpPool('127.0.0.1', port, sender='agv@agv.com', starttls=False, size=2)
+
+    controller.stop()
+
+
+def test_deliverSendsAndRetries(db, sink):
+    handler, pool = sink
+    handler.refused.add('recusa@cliente.com')
+
+    sent = [outboxModule.enqueue(f'cliente{number}@cliente.com', 'Relatorio', 'Em anexo', db=db) for number in range(3)]
+    refused = outboxModule.enqueue('recusa@cliente.com', 'Relatorio', 'Em anexo', db=db)
+
+    try:
+        assert outboxModule.deliver(pool, maxAttempts=2, backoff=60, db=db) == {'enviado': 3, 'pendente': 1, 'falhou': 0}
+        assert sorted(tos[0] for tos, _ in handler.messages) == [f'cliente{number}@cliente.com' for number in range(3)]
+        assert all(outboxModule.readStatus(messageID, db)[:2] == ('enviado', 1) for messageID in sent)
+
+        status, attempts, error, _ = outboxModule.readStatus(refused, db)
+        assert (status, attempts) == ('pendente', 1) and 'recusa@cliente.com' in error
+
+        # a nova tentativa só vence depois do backoff
+        assert outboxModule.deliver(pool, db=db) == {'enviado': 0, 'pendente': 0, 'falhou': 0}
+        db.cursor().execute('UPDATE outbox SET proxima_tentativa = ? WHERE id = ?', (dt.datetime.now(), refused))
+        assert outboxModule.deliver(pool, maxAttempts=2, db=db) == {'enviado': 0, 'pendente': 0, 'falhou': 1}
+
+    finally:
+        pool.close()
+
+    assert len(handler.messages) == 3
+    assert outboxModule.summary(db) == {'pendente': 0, 'enviando': 0, 'enviado': 3, 'falhou': 1}
+
+
+def test_deliverReclaimsOnlyStaleLeases(db, sink):
+    handler, pool = sink
+    now = dt.datetime.now()
+
+    # uma mensagem de uma execução que caiu, com a reserva vencida, e outra de uma execução que ainda a está enviando
+    stale = outboxModule.enqueue('parada@cliente.com', 'Relatorio', 'Em anexo', db=db)
+    leased = outboxModule.enqueue('enviando@cliente.com', 'Relatorio', 'Em anexo', db=db)
+    db.cursor().executemany(
+        "UPDATE outbox SET status = 'enviando', proxima_tentativa = ? WHERE id = ?",
+        [(now - dt.timedelta(seconds=1), stale), (now + dt.timedelta(minutes=10), leased)]
+    )
+
+    try:
+        assert outboxModule.deliver(pool, db=db) == {'enviado': 1, 'pendente': 0, 'falhou': 0}
+    finally:
+        pool.close()
+
+    assert [tos for tos, _ in handler.messages] == [['parada@cliente.com']]
+    assert outboxModule.readStatus(stale, db)[0] == 'enviado'
+    assert outboxModule.readStatus(leased, db)[0] == 'enviando'
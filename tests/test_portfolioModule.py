@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import costModule
+import portfolioModule
+from clientsModule import aGroupList, bGroupList
+
+
+def test_loadAndFilter(db, portfolio):
+    columns = portfolioModule.ucColumns.load(db=db)
+
+    assert columns.numbers.tolist() == [newUC.number for newUC in portfolio['ucs']]
+    assert columns.isAGroup.tolist() == [newUC.subgroup in aGroupList for newUC in portfolio['ucs']]
+    assert not columns.isBGroup.any()
+
+    selected = columns.filter(aGroupList, ['Azul', 'Verde'])
+    assert selected.numbers.tolist() == [newUC.number for newUC in portfolio['ucs'] if newUC.modality in ('Azul', 'Verde')]
+
+    # cada posição volta a ser um uc com os mesmos atributos
+    for newUC, record in zip(portfolio['ucs'], columns):
+        assert (record.number, record.utility, record.subgroup, record.modality, record.clientClass) == \
+            (newUC.number, newUC.utility, newUC.subgroup, newUC.modality, newUC.clientClass)
+        assert record.demand == pytest.approx(newUC.demand)
+
+    clientIDs = np.unique(columns.clientIDs)[:1].tolist()
+    assert len(portfolioModule.ucColumns.load(clientIDs=clientIDs, db=db)) == (columns.clientIDs == clientIDs[0]).sum()
+
+
+def test_portfolioCostsOfColumns(db, portfolio):
+    columns = portfolioModule.ucColumns.load(db=db)
+    selected = columns.filter(modalities=['Azul', 'Branca'])
+
+    costs = costModule.portfolioCosts(2024, ['jan', 'fev'], ucNumbers=selected, db=db)
+    expected = costModule.portfolioCosts(2024, ['jan', 'fev'], ucNumbers=selected.numbers.tolist(), db=db)
+
+    assert sorted(costs.index.get_level_values('numero').unique()) == sorted(selected.numbers)
+    assert costs['total'].tolist() == pytest.approx(expected['total'].tolist())
+
+    # uma coleção vazia não seleciona nenhuma UC
+    assert costModule.portfolioCosts(2024, ['jan'], ucNumbers=columns.filter(subgroups=bGroupList), db=db).empty
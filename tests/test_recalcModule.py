@@ -0,0 +1,62 @@
+import sqlite3
+import datetime as dt
+
+import pytest
+
+import rollupModule
+import recalcModule
+import connectionModule
+from clientsModule import uc
+
+
+def _assertRecalculated(db, manager = None, **kwargs) -> None:
+    expected = rollupModule.readTotals(db=db)
+
+    # os custos apagados voltam iguais aos calculados a cada escrita
+    db.cursor().execute("UPDATE rollup_mensal SET custo = NULL WHERE uc_id IN (SELECT id FROM ucs WHERE concessionaria = 'CEMIG')")
+    assert recalcModule.recalculate('CEMIG', dt.date(2024, 1, 1), dt.date(2024, 12, 31), chunkSize=1, db=manager or db, **kwargs) > 0
+    totals = rollupModule.readTotals(db=db)
+
+    assert totals.keys() == expected.keys()
+    for key, (value, cost) in expected.items():
+        assert totals[key] == (pytest.approx(value), pytest.approx(cost))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_recalculate(db, portfolio, workers):
+    _assertRecalculated(db, workers=workers)
+
+
+def test_recalculateWrappedConnection(db, databaseUrl, portfolio):
+    if db.backend.name != 'sqlite':
+        pytest.skip('only sqlite connections can be passed directly')
+
+    # os processos do pool não conseguem abrir uma conexão de fora, então tudo roda neste processo
+    conn = sqlite3.connect(databaseUrl, check_same_thread=False)
+    try:
+        _assertRecalculated(db, conn)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_recalculateKeepsWritesMadeDuringIt(db, databaseUrl, portfolio, workers):
+    newUC = portfolio['ucs'][0]
+    other = connectionModule.connectionManager(databaseUrl)
+    writer = uc(None, newUC.number, None, None, None, None, None, None, db=other)
+
+    # outro processo grava um valor enquanto as partes ainda estão sendo calculadas
+    def progress(done, total):
+        if done == 1:
+            writer.updateValue('jan', 'consumption', 99999, 2024)
+
+    try:
+        recalcModule.recalculate('CEMIG', dt.date(2024, 1, 1), dt.date(2024, 12, 31), workers=workers, chunkSize=1, progress=progress, db=db)
+    finally:
+        other.closeAll()
+
+    totals = rollupModule.readTotals(ucNumber=newUC.number, db=db)
+    rollupModule.rebuild(db)
+
+    assert totals == rollupModule.readTotals(ucNumber=newUC.number, db=db)
+    assert totals[(2024, 'jan', 'consumption')][0] == 99999
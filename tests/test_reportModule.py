@@ -0,0 +1,64 @@
+import csv
+
+import pytest
+
+import reportModule
+import savingsModule
+from clientsModule import client, uc
+
+# números cuja ordem binária é diferente da ordem alfabética das collations do PostgreSQL
+numbers = ['B1', 'a2']
+
+
+@pytest.fixture
+def reportClient(db, portfolio):
+    template = portfolio['ucs'][0]
+    owner = client('Cliente Relatorio', 'Rua', '00000-000', '12.345.678/0001-90', 'relatorio@cliente.com', '', 'company', db=db)
+    owner.createClient()
+
+    for number in numbers:
+        uc(template.utility, number, owner.name, 'Rua', '00000-000', template.subgroup, template.modality, template.clientClass, db=db).createUC()
+
+    rows = [(number, month, valueType, value, year) for ucNumber, month, valueType, value, year in portfolio['rows'] if ucNumber == template.number for number in numbers]
+    uc.createValues(rows, db=db)
+
+    periods = sorted({(year, month) for _, month, _, _, year in rows})
+    savingsModule.recordCosts([(number, month, 'encargos', 100, year) for number in numbers for year, month in periods], db=db)
+
+    return owner
+
+
+def test_reportRowsMergeTheLedger(db, reportClient):
+    rows = list(reportModule.reportRows(db, ucNumbers=numbers))
+
+    assert sorted({row['uc'] for row in rows}) == sorted(numbers)
+    assert all(row['custoReal'] == pytest.approx(100) for row in rows)
+
+
+def test_csvRoundTrip(db, reportClient, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # o caminho padrão usa só os dígitos do cnpj formatado
+    path = reportClient.createSavingsReport(year=2024)
+    assert path == 'relatorio_12345678000190.csv'
+
+    with open(tmp_path / path, newline='', encoding='utf-8') as archive:
+        written = list(csv.DictReader(archive, delimiter=';'))
+
+    expected = list(reportModule.reportRows(db, ucNumbers=numbers, years=[2024]))
+    assert len(written) == len(expected) > 0
+    for line, row in zip(written, expected):
+        assert list(line) == reportModule.reportColumns
+        assert (line['uc'], int(line['ano']), line['mes']) == (row['uc'], row['ano'], row['mes'])
+        assert float(line['custoReal']) == pytest.approx(row['custoReal'])
+        assert line['custo'] == '' if row['custo'] is None else float(line['custo']) == pytest.approx(row['custo'])
+
+
+def test_createReportAcceptsYearsAsText(db, reportClient, tmp_path):
+    report = uc(None, numbers[0], None, None, None, None, None, None, db=db)
+
+    text = report.createReport('2024', str(tmp_path / 'texto.csv'))
+    number = report.createReport(2024, str(tmp_path / 'numero.csv'))
+
+    with open(text, encoding='utf-8') as first, open(number, encoding='utf-8') as second:
+        assert first.read() == second.read()
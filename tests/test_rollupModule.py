@@ -0,0 +1,27 @@
+import pytest
+
+import rollupModule
+
+
+def test_refreshMatchesRebuild(db, portfolio):
+    newUC = portfolio['ucs'][0]
+    newUC.createValue('jan', 'consumption', 100, 2030)
+    newUC.updateValue('jan', 'consumption', 150, 2030)
+    newUC.deleteValue(portfolio['rows'][0][1], portfolio['rows'][0][2], portfolio['rows'][0][4])
+
+    # o consolidado mantido a cada escrita é o mesmo de um recálculo completo
+    incremental = rollupModule.readTotals(db=db)
+    rollupModule.rebuild(db)
+
+    assert incremental == {key: (pytest.approx(value), pytest.approx(cost)) for key, (value, cost) in rollupModule.readTotals(db=db).items()}
+    assert rollupModule.readTotals(ucNumber=newUC.number, years=[2030], db=db)[(2030, 'jan', 'consumption')][0] == 150
+
+
+def test_yearOverYear(db, portfolio):
+    owner = portfolio['clients'][0]
+    comparison = rollupModule.yearOverYear(2024, cnpj=owner.cnpj, db=db)
+    totals = rollupModule.readTotals(cnpj=owner.cnpj, years=[2024], db=db)
+
+    for (year, month, valueType), (value, cost) in totals.items():
+        assert comparison[month][valueType]['atual'] == (pytest.approx(value), pytest.approx(cost))
+        assert comparison[month][valueType]['anterior'] == (0, 0)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import costModule
+import savingsModule
+from clientsModule import client, uc
+
+
+def test_recordCostsReportsConflicts(db, portfolio):
+    number = portfolio['ucs'][0].number
+    rows = [
+        (number, 'jan', 'encargos', 10, 2024),
+        (number, 'jan', 'impostos', 10, 2024),
+        (number, 'janeiro', 'encargos', 10, 2024),
+        ('9999999999', 'jan', 'encargos', 10, 2024),
+    ]
+    result = savingsModule.recordCosts(rows, db=db)
+
+    assert result['recorded'] == 1
+    assert [(index, reason) for index, _, reason in result['conflicts']] == [
+        (1, 'category not recognized'), (2, 'month not recognized'), (3, 'UC not found')
+    ]
+
+    # o mesmo lançamento gravado de novo substitui o valor
+    savingsModule.recordCosts([(number, 'jan', 'encargos', 25, 2024)], db=db)
+    costs = savingsModule.readCosts(db, [2024], ['jan'], ucNumbers=[number])
+    assert costs[['categoria', 'valor']].values.tolist() == [['encargos', 25]]
+
+
+def test_portfolioSavings(db, portfolio):
+    number = portfolio['ucs'][0].number
+    savingsModule.recordCosts([(number, 'jan', 'cooperativa', 100, 2024), (number, 'jan', 'encargos', 20, 2024)], db=db)
+
+    savings = savingsModule.portfolioSavings(2024, ['jan', 'fev'], db=db)
+    regulated = costModule.portfolioCosts(2024, ['jan', 'fev'], db=db)
+
+    assert savings['custoRegulado'].tolist() == pytest.approx(regulated['total'].tolist())
+    assert savings.loc[(number, 2024, 'jan'), 'custoReal'] == pytest.approx(120)
+    assert savings.loc[(number, 2024, 'jan'), 'economia'] == pytest.approx(savings.loc[(number, 2024, 'jan'), 'custoRegulado'] - 120)
+
+    # sem lançamentos, não há custo real nem economia
+    assert np.isnan(savings.loc[(number, 2024, 'fev'), 'custoReal'])
+    assert savings['economia'].notna().sum() == 1
+
+
+def test_totalSavings(db, portfolio):
+    owner = portfolio['clients'][0]
+    numbers = savingsModule.ucNumbersOf(db, owner.cnpj)
+    savingsModule.recordCosts([(number, 'mar', 'energia contratada', 50, 2024) for number in numbers], db=db)
+
+    savings = savingsModule.portfolioSavings(2024, ['mar'], ucNumbers=numbers, db=db)
+    first = uc(None, numbers[0], None, None, None, None, None, None, db=db)
+
+    assert first.totalSavings('mar', 2024) == pytest.approx(savings.loc[(numbers[0], 2024, 'mar'), 'economia'])
+    assert owner.totalSavings('mar', 2024) == pytest.approx(savings['economia'].sum())
+
+    # um cliente sem UCs não soma as UCs de todos
+    lonely = client('Sem UCs', 'Rua', '00000-000', '99999999999999', 'sem@ucs.com', '', 'company', db=db)
+    lonely.createClient()
+    assert savingsModule.portfolioSavings(2024, ['mar'], cnpj=lonely.cnpj, db=db).empty
+    assert lonely.totalSavings('mar', 2024) == 0
@@ -0,0 +1,40 @@
+import json
+
+import schemaModule
+import connectionModule
+
+
+def test_migrate(db):
+    with db.transaction() as cursor:
+        assert schemaModule.currentVersion(cursor) == schemaModule.migrations[-1][0]
+
+    # uma segunda migração não tem o que aplicar
+    assert schemaModule.migrate(db) == schemaModule.migrations[-1][0]
+
+
+def test_mergeDuplicates(databaseUrl, monkeypatch):
+    db = connectionModule.connectionManager(databaseUrl)
+
+    # um banco antigo, só com as tabelas, que aceitava clientes e UCs repetidos
+    monkeypatch.setattr(schemaModule, 'migrations', schemaModule.migrations[:1])
+    schemaModule.migrate(db)
+    monkeypatch.undo()
+
+    with db.transaction() as cursor:
+        cursor.executemany('INSERT INTO clientes (nome, cnpj) VALUES (?,?)', [('Antigo', '1'), ('Novo', '1'), ('Outro', '2')])
+        cursor.executemany('INSERT INTO ucs (numero, client_id) VALUES (?,?)', [('10', 1), ('10', 2), ('20', 1)])
+        cursor.executemany('INSERT INTO consumos (uc_id, posto_id, mes, ano, valor) VALUES (?,?,?,?,?)', [(1, 1, 'jan', 2024, 5), (3, 1, 'jan', 2024, 7)])
+
+    schemaModule.migrate(db)
+
+    with db.transaction() as cursor:
+        assert cursor.execute('SELECT id, nome FROM clientes ORDER BY id').fetchall() == [(2, 'Novo'), (3, 'Outro')]
+        # as referências dos registros removidos passam para os mantidos
+        assert cursor.execute('SELECT id, numero, client_id FROM ucs ORDER BY id').fetchall() == [(2, '10', 2), (3, '20', 2)]
+        assert cursor.execute('SELECT uc_id, valor FROM consumos ORDER BY valor').fetchall() == [(2, 5), (3, 7)]
+
+        removed = cursor.execute('SELECT tabela, id, mantido_id, registro FROM duplicados_removidos ORDER BY tabela').fetchall()
+        assert [row[:3] for row in removed] == [('clientes', 1, 2), ('ucs', 1, 2)]
+        assert json.loads(removed[0][3])['nome'] == 'Antigo'
+
+    db.closeAll()
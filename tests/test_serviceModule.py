@@ -0,0 +1,90 @@
+import pytest
+
+import serviceModule
+import journalModule
+import connectionModule
+from clientsModule import uc
+
+
+@pytest.fixture
+def service(databaseUrl, portfolio):
+    service = serviceModule.queryService(databaseUrl)
+
+    yield service
+
+    service.close()
+    connectionModule.getManager(databaseUrl).closeAll()
+
+
+def test_syncDiscardsChangedResults(service, portfolio):
+    newUC = portfolio['ucs'][0]
+
+    assert service.ucValue(newUC.number, 'jan', 2024, 'consumption')[1] is False
+    assert service.ucValue(newUC.number, 'jan', 2024, 'consumption')[1] is True
+
+    newUC.updateValue('jan', 'consumption', 1, 2024)
+    service.sync()
+
+    result, cached = service.ucValue(newUC.number, 'jan', 2024, 'consumption')
+    assert not cached and result['valor'] == 1
+    assert service.cache.seq == journalModule.lastSeq(service.db)
+
+
+def test_syncWaitsForOpenTransactions(service, databaseUrl, db, portfolio):
+    if db.backend.name != 'postgresql':
+        pytest.skip('sqlite serializes the writes, so the seqs are commited in order')
+
+    first, second = portfolio['ucs'][:2]
+    service.ucValue(first.number, 'jan', 2024, 'consumption')
+    other = connectionModule.connectionManager(databaseUrl)
+
+    try:
+        with other.transaction():
+            uc(first.utility, first.number, first.client, None, None, first.subgroup, first.modality, first.clientClass, db=other).updateValue('jan', 'consumption', 1, 2024)
+            second.updateValue('jan', 'consumption', 2, 2024)
+
+            service.sync()
+            assert service.cache.seq < journalModule.lastSeq(db)
+
+        service.sync()
+
+    finally:
+        other.closeAll()
+
+    result, cached = service.ucValue(first.number, 'jan', 2024, 'consumption')
+    assert not cached and result['valor'] == 1
+    assert service.cache.seq == journalModule.lastSeq(db)
+
+
+def test_pruneKeepsWhatTheServiceDidntRead(service, db, portfolio):
+    first, second = portfolio['ucs'][:2]
+    service.ucValue(first.number, 'jan', 2024, 'consumption')
+    service.ucValue(second.number, 'jan', 2024, 'consumption')
+
+    # outro consumidor lê tudo e poda o diário antes do sync do serviço
+    first.updateValue('jan', 'consumption', 1, 2024)
+    journalModule.consume('teste', lambda cursor, changes: None, db=db)
+    journalModule.prune(db)
+    assert journalModule.changesSince(service.cache.seq, db=db) != []
+
+    service.sync()
+
+    result, cached = service.ucValue(first.number, 'jan', 2024, 'consumption')
+    assert not cached and result['valor'] == 1
+    assert service.ucValue(second.number, 'jan', 2024, 'consumption')[1] is True
+    assert journalModule.readCheckpoint(service.consumer, db) == service.cache.seq
+
+    journalModule.prune(db)
+    assert journalModule.changesSince(db=db) == []
+
+
+def test_closeDeletesTheCheckpoint(databaseUrl, db, portfolio):
+    service = serviceModule.queryService(databaseUrl, consumer='painel')
+    service.warm()
+    assert service.status()['connections'] == service.db.connectionCount() == 1
+    assert journalModule.readCheckpoint('painel', db) == service.cache.seq > 0
+
+    service.close()
+    connectionModule.getManager(databaseUrl).closeAll()
+
+    assert db.cursor().execute('SELECT COUNT(*) FROM alteracoes_checkpoint').fetchone()[0] == 0